@@ -6,7 +6,11 @@ from homeassistant.core import HomeAssistant
 
 from .const import CONF_USB_PATH
 
-from .gateway import async_setup_entry_gw, async_unload_entry_gw
+from .gateway import (
+    async_remove_entry_gw,
+    async_setup_entry_gw,
+    async_unload_entry_gw,
+)
 from .usb import async_setup_entry_usb, async_unload_entry_usb
 
 
@@ -31,3 +35,9 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
     if entry.data.get(CONF_USB_PATH):
         return await async_unload_entry_usb(hass, entry)
     return False
+
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry):
+    """Remove the stored data of a Plugwise config entry."""
+    if entry.data.get(CONF_HOST):
+        await async_remove_entry_gw(hass, entry)
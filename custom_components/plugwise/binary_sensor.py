@@ -6,10 +6,7 @@ import voluptuous as vol
 
 from homeassistant.components.binary_sensor import BinarySensorEntity
 from homeassistant.const import (
-    ATTR_DEVICE_CLASS,
-    ATTR_ICON,
     ATTR_NAME,
-    ATTR_STATE,
     STATE_OFF,
     STATE_ON,
 )
@@ -19,7 +16,6 @@ from homeassistant.helpers import config_validation as cv, entity_platform
 
 from .const import (
     API,
-    ATTR_ENABLED_DEFAULT,
     ATTR_SCAN_DAYLIGHT_MODE,
     ATTR_SCAN_SENSITIVITY_MODE,
     ATTR_SCAN_RESET_TIMER,
@@ -38,8 +34,10 @@ from .const import (
     GW_BINARY_SENSORS,
     IDLE_ICON,
     MOTION_SENSOR_ID,
+    NODE_INVENTORY,
     NO_NOTIFICATION_ICON,
     NOTIFICATION_ICON,
+    NOTIFICATIONS,
     PW_CLASS,
     PW_MODEL,
     PW_TYPE,
@@ -47,12 +45,12 @@ from .const import (
     SERVICE_CONFIGURE_BATTERY,
     SERVICE_CONFIGURE_SCAN,
     STICK,
+    STICK_BRIDGE,
     USB,
-    USB_BINARY_SENSORS,
 )
 
 from .sensor import SmileSensor
-from .usb import NodeEntity
+from .usb import USB_BINARY_SENSOR_DESCRIPTIONS, NodeEntity
 
 PARALLEL_UPDATES = 0
 
@@ -70,16 +68,21 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
 async def async_setup_entry_usb(hass, config_entry, async_add_entities):
     """Set up Plugwise binary sensor based on config_entry."""
     stick = hass.data[DOMAIN][config_entry.entry_id][STICK]
+    bridge = hass.data[DOMAIN][config_entry.entry_id][STICK_BRIDGE]
+    inventory = hass.data[DOMAIN][config_entry.entry_id][NODE_INVENTORY]
     platform = entity_platform.current_platform.get()
 
     async def async_add_sensor(mac):
         """Add plugwise sensor."""
         _LOGGER.debug("Add binary_sensors for %s", mac)
 
-        node = stick.node(mac)
+        node = stick.node(mac) or inventory.async_cached_node(mac)
         for sensor_type in node.get_sensors():
-            if sensor_type in USB_BINARY_SENSORS:
-                async_add_entities([USBBinarySensor(node, mac, sensor_type)])
+            if sensor_type in USB_BINARY_SENSOR_DESCRIPTIONS:
+                # Entities created from the inventory move over to the discovered node
+                async_add_entities(
+                    inventory.async_unknown([USBBinarySensor(node, mac, sensor_type)])
+                )
                 _LOGGER.debug("Added %s as binary_sensor", sensor_type)
 
                 if node.get_node_type() == "Scan" and sensor_type == MOTION_SENSOR_ID:
@@ -117,11 +120,12 @@ async def async_setup_entry_usb(hass, config_entry, async_add_entities):
                     )
 
     for mac in hass.data[DOMAIN][config_entry.entry_id]["binary_sensor"]:
-        hass.async_create_task(async_add_sensor(mac))
+        await async_add_sensor(mac)
 
     def discoved_binary_sensor(mac):
         """Add newly discovered binary sensor."""
-        hass.async_create_task(async_add_sensor(mac))
+        # Called on the stick thread, add the entities on the event loop
+        bridge.call(hass.async_create_task, async_add_sensor(mac))
 
     # Listen for discovered nodes
     stick.subscribe_stick_callback(discoved_binary_sensor, CB_NEW_NODE)
@@ -133,16 +137,17 @@ async def async_setup_entry_gateway(hass, config_entry, async_add_entities):
     coordinator = hass.data[DOMAIN][config_entry.entry_id][COORDINATOR]
 
     entities = []
-    is_thermostat = api.single_master_thermostat()
+    topology = coordinator.topology
+    is_thermostat = topology.single_master_thermostat
 
-    devices = api.get_all_devices()
+    devices = topology.devices
     for dev_id in devices:
         if devices[dev_id][PW_CLASS] == "heater_central":
             _LOGGER.debug("Plugwise device_class %s found", devices[dev_id][PW_CLASS])
-            data = api.get_device_data(dev_id)
+            keys = topology.device_keys.get(dev_id, ())
             for binary_sensor in GW_BINARY_SENSORS:
                 _LOGGER.debug("Binary_sensor: %s", binary_sensor)
-                if binary_sensor not in data:
+                if binary_sensor not in keys:
                     continue
 
                 _LOGGER.debug(
@@ -182,7 +187,7 @@ async def async_setup_entry_gateway(hass, config_entry, async_add_entities):
                 f"{devices[dev_id][ATTR_NAME]}_{'plugwise_notification'}",
             )
 
-    async_add_entities(entities, True)
+    async_add_entities(entities)
 
 
 class GwBinarySensor(SmileSensor, BinarySensorEntity):
@@ -204,6 +209,7 @@ class GwBinarySensor(SmileSensor, BinarySensorEntity):
         self._name = key[ATTR_NAME] if key else None
         self._state = None
 
+        self._device_keys = {dev_id: (binary_sensor,)}
         self._unique_id = f"{dev_id}-{binary_sensor}"
 
     @property
@@ -215,7 +221,7 @@ class GwBinarySensor(SmileSensor, BinarySensorEntity):
     def _async_process_data(self):
         """Update the entity."""
         _LOGGER.debug("Update binary_sensor called")
-        data = self._api.get_device_data(self._dev_id)
+        data = self.coordinator.data.get(self._dev_id, {})
 
         if self._binary_sensor not in data:
             self.async_write_ha_state()
@@ -261,6 +267,7 @@ class GwNotifySensor(GwBinarySensor, BinarySensorEntity):
         self._icon = None
         self._name = f"{name} {binary_sensor}"
 
+        self._device_keys = {coordinator.topology.gateway_id: (NOTIFICATIONS,)}
         self._unique_id = f"{dev_id}-{binary_sensor}"
 
     @property
@@ -301,40 +308,41 @@ class USBBinarySensor(NodeEntity, BinarySensorEntity):
 
     def __init__(self, node, mac, sensor_id):
         """Initialize a Node entity."""
-        super().__init__(node, mac)
+        super().__init__(node, mac, USB_BINARY_SENSOR_DESCRIPTIONS[sensor_id])
         self.sensor_id = sensor_id
-        self.sensor_type = USB_BINARY_SENSORS[sensor_id]
         self.node_callbacks = (AVAILABLE_SENSOR_ID, sensor_id)
+        self._name = f"{self.description.name} ({mac[-5:]})"
+        self._unique_id = f"{mac}-{sensor_id}"
 
     @property
     def device_class(self):
         """Return the device class of the sensor."""
-        return self.sensor_type[ATTR_DEVICE_CLASS]
+        return self.description.device_class
 
     @property
     def entity_registry_enabled_default(self):
         """Return the sensor registration state."""
-        return self.sensor_type[ATTR_ENABLED_DEFAULT]
+        return self.description.enabled_default
 
     @property
     def icon(self):
         """Icon to use in the frontend, if any."""
-        return self.sensor_type[ATTR_ICON]
+        return self.description.icon
 
     @property
     def name(self):
         """Return the display name of this sensor."""
-        return f"{self.sensor_type[ATTR_NAME]} ({self._mac[-5:]})"
+        return self._name
 
     @property
     def is_on(self):
         """Return true if the binary_sensor is on."""
-        return getattr(self._node, self.sensor_type[ATTR_STATE])()
+        return self._get_state()
 
     @property
     def unique_id(self):
         """Get unique ID."""
-        return f"{self._mac}-{self.sensor_id}"
+        return self._unique_id
 
     def _service_configure_scan(self, **kwargs):
         """Service call to configure motion sensor of Scan device."""
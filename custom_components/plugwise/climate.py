@@ -1,11 +1,14 @@
 """Plugwise Climate component for Home Assistant."""
 
+import asyncio
 import logging
 
 from plugwise.exceptions import PlugwiseException
+import voluptuous as vol
 
 from homeassistant.components.climate import ClimateEntity
 from homeassistant.components.climate.const import (
+    DOMAIN as CLIMATE_DOMAIN,
     CURRENT_HVAC_COOL,
     CURRENT_HVAC_HEAT,
     CURRENT_HVAC_IDLE,
@@ -21,10 +24,12 @@ from homeassistant.components.climate.const import (
 )
 from homeassistant.const import ATTR_NAME, ATTR_TEMPERATURE, TEMP_CELSIUS
 from homeassistant.core import callback
+from homeassistant.helpers import config_validation as cv
 
 from .gateway import SmileGateway
 from .const import (
     API,
+    ATTR_HVAC_MODES,
     COORDINATOR,
     DEFAULT_MAX_TEMP,
     DEFAULT_MIN_TEMP,
@@ -34,6 +39,7 @@ from .const import (
     PW_MODEL,
     SCHEDULE_OFF,
     SCHEDULE_ON,
+    SERVICE_SET_HVAC_MODES,
     THERMOSTAT_CLASSES,
 )
 
@@ -42,6 +48,14 @@ HVAC_MODES_HEAT_COOL = [HVAC_MODE_HEAT_COOL, HVAC_MODE_AUTO, HVAC_MODE_OFF]
 
 SUPPORT_FLAGS = SUPPORT_TARGET_TEMPERATURE | SUPPORT_PRESET_MODE
 
+SET_HVAC_MODES_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_HVAC_MODES): {
+            cv.entity_id: vol.In(set(HVAC_MODES_HEAT_ONLY + HVAC_MODES_HEAT_COOL))
+        }
+    }
+)
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -51,7 +65,7 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     coordinator = hass.data[DOMAIN][config_entry.entry_id][COORDINATOR]
 
     entities = []
-    devices = api.get_all_devices()
+    devices = coordinator.topology.devices
 
     for dev_id in devices:
 
@@ -73,7 +87,38 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
         entities.append(thermostat)
         _LOGGER.info("Added climate.%s", "{}".format(devices[dev_id][ATTR_NAME]))
 
-    async_add_entities(entities, True)
+    async_add_entities(entities)
+
+    async def async_set_hvac_modes(service):
+        """Service: set the hvac modes of multiple zones in one call."""
+        hvac_modes = service.data[ATTR_HVAC_MODES]
+        component = hass.data[CLIMATE_DOMAIN]
+        thermostats = {}
+        for entity_id, hvac_mode in hvac_modes.items():
+            entity = component.get_entity(entity_id)
+            if not isinstance(entity, PwThermostat):
+                _LOGGER.error("Entity %s is not a Plugwise thermostat", entity_id)
+                continue
+            if hvac_mode not in entity.hvac_modes:
+                _LOGGER.error("Entity %s does not support %s", entity_id, hvac_mode)
+                continue
+            thermostats[entity] = hvac_mode
+
+        # Each zone sends its commands, the coordinators limit the concurrency
+        await asyncio.gather(
+            *[
+                thermostat.async_set_hvac_mode(hvac_mode)
+                for thermostat, hvac_mode in thermostats.items()
+            ]
+        )
+
+    if not hass.services.has_service(DOMAIN, SERVICE_SET_HVAC_MODES):
+        hass.services.async_register(
+            DOMAIN,
+            SERVICE_SET_HVAC_MODES,
+            async_set_hvac_modes,
+            schema=SET_HVAC_MODES_SCHEMA,
+        )
 
 
 class PwThermostat(SmileGateway, ClimateEntity):
@@ -109,9 +154,16 @@ class PwThermostat(SmileGateway, ClimateEntity):
         self._temperature = None
         self._water_pressure = None
 
-        self._single_thermostat = self._api.single_master_thermostat()
+        self._single_thermostat = coordinator.topology.single_master_thermostat
         self._unique_id = f"{dev_id}-climate"
 
+        if coordinator.topology.heater_id is not None:
+            self._device_keys[coordinator.topology.heater_id] = (
+                "heating_state",
+                "cooling_state",
+                "compressor_state",
+            )
+
     @property
     def hvac_action(self):
         """Return the current action."""
@@ -199,9 +251,15 @@ class PwThermostat(SmileGateway, ClimateEntity):
         ):
             _LOGGER.debug("Set temp to %sºC", temperature)
             try:
-                await self._api.set_temperature(self._loc_id, temperature)
+                await self._coordinator.async_command(
+                    self._api.set_temperature, self._loc_id, temperature
+                )
                 self._setpoint = temperature
+                self._coordinator.async_invalidate(self._dev_id, "setpoint")
                 self.async_write_ha_state()
+                await self._coordinator.async_request_confirmation(
+                    self._dev_id, self._loc_id
+                )
             except PlugwiseException:
                 _LOGGER.error("Error while communicating to device")
         else:
@@ -210,43 +268,63 @@ class PwThermostat(SmileGateway, ClimateEntity):
     async def async_set_hvac_mode(self, hvac_mode):
         """Set the hvac mode."""
         _LOGGER.debug("Set hvac_mode to: %s", hvac_mode)
-        state = SCHEDULE_OFF
+        setpoint = self._setpoint
+        preset_mode = None
         if hvac_mode == HVAC_MODE_AUTO:
-            state = SCHEDULE_ON
-            try:
+            setpoint = self._schedule_temp
+        if hvac_mode == HVAC_MODE_OFF:
+            preset_mode = PRESET_AWAY
+        if hvac_mode == HVAC_MODE_HEAT and self._preset_mode == PRESET_AWAY:
+            preset_mode = PRESET_HOME
+        if preset_mode is not None:
+            setpoint = self._presets.get(preset_mode, PRESET_NONE)[0]
+
+        async def async_send():
+            """Send the commands in order, stop at the first failure."""
+            # The Smile expects the setpoint before the schedule is switched on
+            state = SCHEDULE_OFF
+            if hvac_mode == HVAC_MODE_AUTO:
+                state = SCHEDULE_ON
                 await self._api.set_temperature(self._loc_id, self._schedule_temp)
-                self._setpoint = self._schedule_temp
-            except PlugwiseException:
-                _LOGGER.error("Error while communicating to device")
-        try:
             await self._api.set_schedule_state(
                 self._loc_id, self._last_active_schema, state
             )
-            self._mode_off = False
-            if hvac_mode == HVAC_MODE_OFF:
-                self._mode_off = True
-                preset_mode = PRESET_AWAY
-                await self._api.set_preset(self._loc_id, preset_mode)
-                self._preset_mode = preset_mode
-                self._setpoint = self._presets.get(self._preset_mode, PRESET_NONE)[0]
-            if hvac_mode == HVAC_MODE_HEAT and self._preset_mode == PRESET_AWAY:
-                preset_mode = PRESET_HOME
+            if preset_mode is not None:
                 await self._api.set_preset(self._loc_id, preset_mode)
+
+        try:
+            await self._coordinator.async_command(async_send)
+        except PlugwiseException:
+            _LOGGER.error("Error while communicating to device")
+        else:
+            # Only apply the new state when all commands succeeded
+            self._mode_off = hvac_mode == HVAC_MODE_OFF
+            if preset_mode is not None:
                 self._preset_mode = preset_mode
-                self._setpoint = self._presets.get(self._preset_mode, PRESET_NONE)[0]
+            self._setpoint = setpoint
             self._hvac_mode = hvac_mode
             self.async_write_ha_state()
-        except PlugwiseException:
-            _LOGGER.error("Error while communicating to device")
+        finally:
+            # The commands sent before a failure did change the Smile
+            self._coordinator.async_invalidate(self._dev_id)
+            await self._coordinator.async_request_confirmation(
+                self._dev_id, self._loc_id
+            )
 
     async def async_set_preset_mode(self, preset_mode):
         """Set the preset mode."""
         _LOGGER.debug("Set preset mode to %s.", preset_mode)
         try:
-            await self._api.set_preset(self._loc_id, preset_mode)
+            await self._coordinator.async_command(
+                self._api.set_preset, self._loc_id, preset_mode
+            )
             self._preset_mode = preset_mode
             self._setpoint = self._presets.get(self._preset_mode, PRESET_NONE)[0]
+            self._coordinator.async_invalidate(self._dev_id)
             self.async_write_ha_state()
+            await self._coordinator.async_request_confirmation(
+                self._dev_id, self._loc_id
+            )
         except PlugwiseException:
             _LOGGER.error("Error while communicating to device")
 
@@ -254,8 +332,8 @@ class PwThermostat(SmileGateway, ClimateEntity):
     def _async_process_data(self):
         """Update the data for this climate device."""
         _LOGGER.info("Updating climate...")
-        climate_data = self._api.get_device_data(self._dev_id)
-        heater_central_data = self._api.get_device_data(self._api.heater_id)
+        climate_data = self.coordinator.data.get(self._dev_id, {})
+        heater_central_data = self.coordinator.data.get(self._api.heater_id, {})
 
         self._setpoint = climate_data.get("setpoint")
         self._temperature = climate_data.get("temperature")
@@ -6,7 +6,6 @@ from typing import Dict
 
 import voluptuous as vol
 
-import plugwise
 from plugwise.smile import Smile
 from plugwise.exceptions import (
     InvalidAuthentication,
@@ -27,15 +26,20 @@ from homeassistant.const import (
     CONF_SCAN_INTERVAL,
     CONF_USERNAME,
 )
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.helpers.typing import DiscoveryInfoType
 from homeassistant.core import callback
 
 from .const import (
     API,
+    CONF_ADAPTIVE_SCAN_INTERVAL,
+    CONF_MAX_SCAN_INTERVAL,
+    CONF_STATE_WRITE_WINDOW,
     CONF_USB_PATH,
+    COORDINATOR,
+    DEFAULT_MAX_SCAN_INTERVAL,
     DEFAULT_PORT,
     DEFAULT_SCAN_INTERVAL,
+    DEFAULT_STATE_WRITE_WINDOW,
     DEFAULT_USERNAME,
     DOMAIN,
     FLOW_NET,
@@ -50,6 +54,8 @@ from .const import (
     STRETCH_USERNAME,
     ZEROCONF_MAP,
 )  # pylint:disable=unused-import
+from .gateway import async_create_smile_session
+from .usb import AsyncStick
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -86,11 +92,10 @@ async def validate_usb_connection(self, device_path=None) -> Dict[str, str]:
         errors[CONF_BASE] = "already_configured"
         return errors, None
 
-    stick = await self.async_add_executor_job(plugwise.stick, device_path)
+    stick = AsyncStick(self, device_path)
     try:
-        await self.async_add_executor_job(stick.connect)
-        await self.async_add_executor_job(stick.initialize_stick)
-        await self.async_add_executor_job(stick.disconnect)
+        await stick.async_connect()
+        await stick.async_initialize_stick()
     except PortError:
         errors[CONF_BASE] = "cannot_connect"
     except StickInitError:
@@ -99,6 +104,9 @@ async def validate_usb_connection(self, device_path=None) -> Dict[str, str]:
         errors[CONF_BASE] = "network_down"
     except TimeoutException:
         errors[CONF_BASE] = "network_timeout"
+    finally:
+        if stick.connection:
+            stick.disconnect()
     return errors, stick
 
 
@@ -135,7 +143,7 @@ async def validate_gw_input(hass: core.HomeAssistant, data):
 
     Data has the keys from _base_gw_schema() with values provided by the user.
     """
-    websession = async_get_clientsession(hass, verify_ssl=False)
+    websession = async_create_smile_session(hass)
 
     api = Smile(
         host=data[CONF_HOST],
@@ -152,6 +160,9 @@ async def validate_gw_input(hass: core.HomeAssistant, data):
         raise InvalidAuth from err
     except PlugwiseException as err:
         raise CannotConnect from err
+    finally:
+        # The entry creates its own session once set up
+        await websession.close()
 
     return api
 
@@ -334,25 +345,65 @@ class PlugwiseOptionsFlowHandler(config_entries.OptionsFlow):
 
         return self.async_show_form(step_id="none")
 
+    async def async_step_usb(self, user_input=None):
+        """Manage the Plugwise USB options."""
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        data = {
+            vol.Optional(
+                CONF_STATE_WRITE_WINDOW,
+                default=self.config_entry.options.get(
+                    CONF_STATE_WRITE_WINDOW, DEFAULT_STATE_WRITE_WINDOW
+                ),
+            ): vol.All(vol.Coerce(float), vol.Range(min=0, max=10)),
+        }
+
+        return self.async_show_form(step_id="usb", data_schema=vol.Schema(data))
+
     async def async_step_init(self, user_input=None):
         """Manage the Plugwise options."""
+        if self.config_entry.data.get(CONF_USB_PATH):
+            return await self.async_step_usb(user_input)
+
         if not self.config_entry.data.get(CONF_HOST):
             return await self.async_step_none(user_input)
 
+        errors = {}
         if user_input is not None:
-            return self.async_create_entry(title="", data=user_input)
+            if (
+                user_input[CONF_ADAPTIVE_SCAN_INTERVAL]
+                and user_input[CONF_SCAN_INTERVAL] > user_input[CONF_MAX_SCAN_INTERVAL]
+            ):
+                errors[CONF_BASE] = "invalid_scan_interval"
+            else:
+                return self.async_create_entry(title="", data=user_input)
 
-        api = self.hass.data[DOMAIN][self.config_entry.entry_id][API]
-        interval = DEFAULT_SCAN_INTERVAL[api.smile_type]
+        # Set up from the stored topology the Smile may not be connected yet
+        coordinator = self.hass.data[DOMAIN][self.config_entry.entry_id][COORDINATOR]
+        smile_type = coordinator.topology.smile_type
+        interval = DEFAULT_SCAN_INTERVAL[smile_type]
+        max_interval = DEFAULT_MAX_SCAN_INTERVAL[smile_type]
+        options = self.config_entry.options
 
         data = {
             vol.Optional(
                 CONF_SCAN_INTERVAL,
-                default=self.config_entry.options.get(CONF_SCAN_INTERVAL, interval),
-            ): int
+                default=options.get(CONF_SCAN_INTERVAL, interval),
+            ): int,
+            vol.Optional(
+                CONF_ADAPTIVE_SCAN_INTERVAL,
+                default=options.get(CONF_ADAPTIVE_SCAN_INTERVAL, False),
+            ): bool,
+            vol.Optional(
+                CONF_MAX_SCAN_INTERVAL,
+                default=options.get(CONF_MAX_SCAN_INTERVAL, max_interval),
+            ): vol.All(vol.Coerce(int), vol.Range(min=1)),
         }
 
-        return self.async_show_form(step_id="init", data_schema=vol.Schema(data))
+        return self.async_show_form(
+            step_id="init", data_schema=vol.Schema(data), errors=errors
+        )
 
 
 class CannotConnect(exceptions.HomeAssistantError):
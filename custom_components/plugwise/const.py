@@ -29,7 +29,10 @@ API = "api"
 ATTR_ENABLED_DEFAULT = "enabled_default"
 DOMAIN = "plugwise"
 COORDINATOR = "coordinator"
+DIAGNOSTICS = "diagnostics"
 GATEWAY = "gateway"
+NOTIFICATIONS = "notifications"
+POLL_SCHEDULER = "plugwise_poll_scheduler"
 PW_CLASS = "class"
 PW_LOCATION = "location"
 PW_MODEL = "model"
@@ -50,9 +53,18 @@ FLOW_USB = "flow_usb"
 FLOW_SMILE = "smile (Adam/Anna/P1)"
 FLOW_STRETCH = "stretch (Stretch)"
 
+UNDO_CLOSE_LISTENER = "undo_close_listener"
+UNDO_REGISTRY_LISTENER = "undo_registry_listener"
 UNDO_UPDATE_LISTENER = "undo_update_listener"
 
+# Request priorities, lower values are sent first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_POLL = 1
+
 # Default directives
+DEFAULT_CONFIRM_DELAY = 2
+DEFAULT_DNS_CACHE_TTL = 300
+DEFAULT_KEEPALIVE_TIMEOUT = 75
 DEFAULT_MAX_TEMP = 30
 DEFAULT_MIN_TEMP = 4
 DEFAULT_NAME = "Smile"
@@ -62,15 +74,25 @@ DEFAULT_SCAN_INTERVAL = {
     "stretch": 60,
     "thermostat": 60,
 }
+DEFAULT_MAX_CONCURRENT_REQUESTS = 2
+DEFAULT_MAX_SCAN_INTERVAL = {
+    "power": 60,
+    "stretch": 300,
+    "thermostat": 300,
+}
 DEFAULT_TIMEOUT = 10
 DEFAULT_USERNAME = "smile"
 
 # Configuration directives
+CONF_ADAPTIVE_SCAN_INTERVAL = "adaptive_scan_interval"
+CONF_MAX_SCAN_INTERVAL = "max_scan_interval"
 CONF_MAX_TEMP = "max_temp"
 CONF_MIN_TEMP = "min_temp"
+CONF_STATE_WRITE_WINDOW = "state_write_window"
 
 # Icons
 COOL_ICON = "mdi:snowflake"
+DIAGNOSTICS_ICON = "mdi:information-outline"
 FLAME_ICON = "mdi:fire"
 FLOW_OFF_ICON = "mdi:water-pump-off"
 FLOW_ON_ICON = "mdi:water-pump"
@@ -85,6 +107,11 @@ SWITCH_ICON = "mdi:electric-switch"
 PLATFORMS_GATEWAY = ["binary_sensor", "climate", "sensor", "switch"]
 SENSOR_PLATFORMS = ["sensor", "switch"]
 SERVICE_DELETE = "delete_notification"
+SERVICE_SET_HVAC_MODES = "set_hvac_modes"
+TOPOLOGY_STORAGE_KEY = f"{DOMAIN}.smile_topology"
+TOPOLOGY_STORAGE_VERSION = 1
+
+ATTR_HVAC_MODES = "hvac_modes"
 
 # Climate const:
 THERMOSTAT_CLASSES = [
@@ -92,6 +119,14 @@ THERMOSTAT_CLASSES = [
     "zone_thermostat",
     "thermostatic_radiator_valve",
 ]
+THERMOSTAT_DATA_KEYS = [
+    "compressor_state",
+    "cooling_state",
+    "heating_state",
+    "schedule_temperature",
+    "setpoint",
+    "temperature",
+]
 
 # Config_flow const:
 ZEROCONF_MAP = {
@@ -362,11 +397,57 @@ ENERGY_SENSORS = {
 
 # Switch const:
 SWITCH_CLASSES = ["plug", "switch_group"]
+SWITCH_DATA_KEYS = ["relay"]
 
 # --- Const for Plugwise USB-stick.
 
 PLATFORMS_USB = ["binary_sensor", "sensor", "switch"]
 CONF_USB_PATH = "usb_path"
+DEFAULT_STATE_WRITE_WINDOW = 0
+DEFAULT_DISCOVERY_IN_FLIGHT = 4
+# Backoff between discovery attempts of unreachable nodes in seconds
+DISCOVERY_RETRY_MIN = 30
+DISCOVERY_RETRY_MAX = 3600
+DISCOVERY_SCAN_TIMEOUT = 120
+# Hourly energy log of the Circles, a log page holds four hours
+ENERGY_LOG_HOURS = 720
+ENERGY_LOG_INITIAL_PAGES = 12
+ENERGY_LOG_PAGE_HOURS = 4
+ENERGY_LOG_REQUEST_TIMEOUT = 300
+ENERGY_LOG_SAVE_DELAY = 60
+ENERGY_LOG_STORAGE_KEY = f"{DOMAIN}.energy_log"
+ENERGY_LOG_STORAGE_VERSION = 1
+# Upper bounds of the request latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+INVENTORY_SAVE_DELAY = 10
+INVENTORY_STORAGE_KEY = f"{DOMAIN}.usb_nodes"
+INVENTORY_STORAGE_VERSION = 1
+# Priority classes of the send queue in order, rate limits in requests per second
+MESSAGE_CONFIG = "config"
+MESSAGE_INTERACTIVE = "interactive"
+MESSAGE_TELEMETRY = "telemetry"
+MESSAGE_PRIORITIES = (MESSAGE_INTERACTIVE, MESSAGE_CONFIG, MESSAGE_TELEMETRY)
+MESSAGE_RATE_LIMITS = {
+    MESSAGE_INTERACTIVE: None,
+    MESSAGE_CONFIG: 5,
+    MESSAGE_TELEMETRY: 3,
+}
+NODE_DISCOVERY = "node_discovery"
+NODE_INVENTORY = "node_inventory"
+NODE_STATE_WRITER = "node_state_writer"
+# Power polling of the Circles, the budgets are in requests per second
+DEFAULT_BACKFILL_BUDGET = 0.1
+DEFAULT_POLL_BUDGET = 1.0
+POWER_POLL_IDLE = 300
+POWER_POLL_MAX = 60
+POWER_POLL_MIN = 5
+POWER_POLL_TICK = 1
+POWER_POLL_WINDOW = 60
+POWER_POLLER = "power_poller"
+# Standard deviation in W above which the power usage counts as varying
+POWER_STDDEV_THRESHOLD = 2
+POWER_VARIANCE_WEIGHT = 0.3
+STICK_BRIDGE = "stick_bridge"
 
 # Callback types
 CB_NEW_NODE = "NEW_NODE"
@@ -374,9 +455,26 @@ CB_NEW_NODE = "NEW_NODE"
 # Sensor IDs
 AVAILABLE_SENSOR_ID = "available"
 CURRENT_POWER_SENSOR_ID = "power_1s"
+PREVIOUS_HOUR_ENERGY_SENSOR_ID = "power_con_prev_hour"
 TODAY_ENERGY_SENSOR_ID = "power_con_today"
+YESTERDAY_ENERGY_SENSOR_ID = "power_con_yesterday"
 MOTION_SENSOR_ID = "motion"
 
+# Sensors read from the hourly energy log
+ENERGY_LOG_SENSORS = (
+    PREVIOUS_HOUR_ENERGY_SENSOR_ID,
+    TODAY_ENERGY_SENSOR_ID,
+    YESTERDAY_ENERGY_SENSOR_ID,
+)
+
+# Sensors updated by the power usage requests
+POWER_USAGE_SENSORS = (
+    CURRENT_POWER_SENSOR_ID,
+    "power_8s",
+    "power_con_cur_hour",
+    "power_prod_cur_hour",
+)
+
 # Sensor types
 USB_SENSORS = {
     AVAILABLE_SENSOR_ID: {
@@ -419,7 +517,7 @@ USB_SENSORS = {
         ATTR_STATE: "get_power_consumption_current_hour",
         ATTR_UNIT_OF_MEASUREMENT: ENERGY_KILO_WATT_HOUR,
     },
-    "power_con_prev_hour": {
+    PREVIOUS_HOUR_ENERGY_SENSOR_ID: {
         ATTR_DEVICE_CLASS: DEVICE_CLASS_POWER,
         ATTR_ENABLED_DEFAULT: True,
         ATTR_ICON: None,
@@ -435,7 +533,7 @@ USB_SENSORS = {
         ATTR_STATE: "get_power_consumption_today",
         ATTR_UNIT_OF_MEASUREMENT: ENERGY_KILO_WATT_HOUR,
     },
-    "power_con_yesterday": {
+    YESTERDAY_ENERGY_SENSOR_ID: {
         ATTR_DEVICE_CLASS: DEVICE_CLASS_POWER,
         ATTR_ENABLED_DEFAULT: True,
         ATTR_ICON: None,
@@ -1,12 +1,21 @@
 """Plugwise network/gateway platform."""
 
 import asyncio
+import hashlib
+import heapq
+import itertools
 import logging
+import re
+import time
+import zlib
 from datetime import timedelta
+from types import MappingProxyType
 from typing import Dict
 
+import aiohttp
 import async_timeout
 import voluptuous as vol
+from plugwise.constants import DEVICE_MEASUREMENTS, HOME_MEASUREMENTS
 from plugwise.smile import Smile
 from plugwise.exceptions import (
     InvalidAuthentication,
@@ -15,10 +24,13 @@ from plugwise.exceptions import (
 )
 
 from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import ATTR_NAME, EVENT_HOMEASSISTANT_CLOSE, __version__
 from homeassistant.core import HomeAssistant, callback
 from homeassistant.exceptions import ConfigEntryNotReady
-from homeassistant.helpers import device_registry as dr
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers import device_registry as dr, entity_registry as er
+from homeassistant.helpers.debounce import Debouncer
+from homeassistant.helpers.event import async_track_point_in_utc_time
+from homeassistant.helpers.storage import Store
 from homeassistant.helpers.update_coordinator import (
     CoordinatorEntity,
     DataUpdateCoordinator,
@@ -31,30 +43,91 @@ from homeassistant.const import (
     CONF_SCAN_INTERVAL,
     CONF_USERNAME,
 )
+from homeassistant.util import dt as dt_util
 
 from .const import (
     API,
+    AUX_DEV_SENSORS,
+    CONF_ADAPTIVE_SCAN_INTERVAL,
+    CONF_MAX_SCAN_INTERVAL,
     COORDINATOR,
+    DEFAULT_CONFIRM_DELAY,
+    DEFAULT_DNS_CACHE_TTL,
+    DEFAULT_KEEPALIVE_TIMEOUT,
+    DEFAULT_MAX_CONCURRENT_REQUESTS,
+    DEFAULT_MAX_SCAN_INTERVAL,
     DEFAULT_PORT,
     DEFAULT_SCAN_INTERVAL,
+    DEFAULT_TIMEOUT,
     DEFAULT_USERNAME,
     DOMAIN,
+    ENERGY_SENSORS,
     GATEWAY,
+    GW_BINARY_SENSORS,
+    NOTIFICATIONS,
     PLATFORMS_GATEWAY,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_POLL,
+    PW_LOCATION,
+    POLL_SCHEDULER,
     PW_TYPE,
     SENSOR_PLATFORMS,
     SERVICE_DELETE,
+    SERVICE_SET_HVAC_MODES,
+    SWITCH_DATA_KEYS,
+    THERMOSTAT_DATA_KEYS,
+    THERMOSTAT_SENSORS,
+    TOPOLOGY_STORAGE_KEY,
+    TOPOLOGY_STORAGE_VERSION,
+    UNDO_CLOSE_LISTENER,
+    UNDO_REGISTRY_LISTENER,
     UNDO_UPDATE_LISTENER,
 )
 
 CONFIG_SCHEMA = vol.Schema({DOMAIN: vol.Schema({})}, extra=vol.ALLOW_EXTRA)
 
+# The data keys read by the (binary) sensors and by all entities of a Smile
+GATEWAY_SENSOR_KEYS = {
+    *AUX_DEV_SENSORS,
+    *ENERGY_SENSORS,
+    *GW_BINARY_SENSORS,
+    *THERMOSTAT_SENSORS,
+}
+GATEWAY_DATA_KEYS = {*GATEWAY_SENSOR_KEYS, *SWITCH_DATA_KEYS, *THERMOSTAT_DATA_KEYS}
+# The unique ID of a (binary) sensor ends in the data key of its description
+SENSOR_KEY_SUFFIXES = {f"-{key}": key for key in GATEWAY_SENSOR_KEYS}
+
+# The measurement logs of the Smile XML and the type each of them logs
+LOG_ELEMENT = re.compile(
+    rb"<(point_log|interval_log|cumulative_log)(?:\s[^>]*)?(?<!/)>.*?</\1>", re.S
+)
+LOG_TYPE = re.compile(rb"<type>([^<]*)</type>")
+# The logs the library reads whatever the entities: the P1 meters, the heating
+# state, the Anna illuminance and the schedule state of a legacy Anna
+LIBRARY_LOG_TYPES = {
+    *HOME_MEASUREMENTS,
+    "boiler_state",
+    "compressor_state",
+    "flame_state",
+    "illuminance",
+    "intended_boiler_state",
+    "schedule_state",
+    "valve_position",
+}
+
 _LOGGER = logging.getLogger(__name__)
 
 
 async def async_setup_entry_gw(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up Plugwise Smiles from a config entry."""
-    websession = async_get_clientsession(hass, verify_ssl=False)
+    connection_stats = SmileConnectionStats()
+    keys, disabled_devices = await async_get_projection(hass, entry.entry_id)
+    content_tracker = SmileContentTracker(SmileContentFilter(keys), disabled_devices)
+    websession = async_create_smile_session(
+        hass,
+        [connection_stats.trace_config, content_tracker.trace_config],
+        response_class=content_tracker.response_class,
+    )
 
     # When migrating from Core to beta, add the username to ConfigEntry
     entry_updates = {}
@@ -78,39 +151,75 @@ async def async_setup_entry_gw(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         websession=websession,
     )
 
-    try:
-        connected = await api.connect()
+    # With a stored topology the entities are created right away, connecting
+    # to the Smile is left to the first update
+    topology = SmileTopology(hass, entry.entry_id)
+    connected = False
+    if not await topology.async_load():
+        try:
+            connected = await api.connect()
 
-        if not connected:
-            _LOGGER.error("Unable to connect to Smile %s", api.smile_name)
-            raise ConfigEntryNotReady
+            if not connected:
+                _LOGGER.error("Unable to connect to Smile %s", api.smile_name)
+                await websession.close()
+                raise ConfigEntryNotReady
+
+        except InvalidAuthentication:
+            _LOGGER.error("Invalid username or Smile ID")
+            await websession.close()
+            return False
 
-    except InvalidAuthentication:
-        _LOGGER.error("Invalid username or Smile ID")
-        return False
+        except PlugwiseException as err:
+            _LOGGER.error("Error while communicating to Smile %s", api.smile_name)
+            await websession.close()
+            raise ConfigEntryNotReady from err
 
-    except PlugwiseException as err:
-        _LOGGER.error("Error while communicating to Smile %s", api.smile_name)
-        raise ConfigEntryNotReady from err
+        except asyncio.TimeoutError as err:
+            _LOGGER.error("Timeout while connecting to Smile %s", api.smile_name)
+            await websession.close()
+            raise ConfigEntryNotReady from err
 
-    except asyncio.TimeoutError as err:
-        _LOGGER.error("Timeout while connecting to Smile %s", api.smile_name)
-        raise ConfigEntryNotReady from err
+        topology.async_update_gateway(api)
 
     update_interval = timedelta(
         seconds=entry.options.get(
-            CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL[api.smile_type]
+            CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL[topology.smile_type]
         )
     )
 
     async def async_update_data_gw():
         """Update data via API endpoint."""
-        _LOGGER.debug("Updating Smile %s", api.smile_name)
+        nonlocal connected
+        _LOGGER.debug("Updating Smile %s", topology.smile_name)
         try:
             async with async_timeout.timeout(update_interval.seconds):
-                await api.full_update_device()
+                if not connected:
+                    connected = await api.connect()
+                    if not connected:
+                        raise UpdateFailed("Unable to connect to Smile")
+                    topology.async_update_gateway(api)
+
+                changed = await coordinator.async_fetch()
                 _LOGGER.debug("Successfully updated Smile %s", api.smile_name)
-                return True
+                content_tracker.polls += 1
+                if coordinator.data is not None and not changed:
+                    # Same content as the snapshot was derived from, reuse it
+                    content_tracker.skipped += 1
+                    return coordinator.data
+
+                content_tracker.async_mark_derived()
+                # One immutable snapshot per update, shared by all platforms
+                data = MappingProxyType(coordinator.async_derive(api.get_all_devices()))
+                if not topology.confirmed and await topology.async_update(api, data):
+                    # The entities were created from an outdated topology
+                    _LOGGER.info("Devices of Smile %s changed", api.smile_name)
+                    hass.async_create_task(
+                        hass.config_entries.async_reload(entry.entry_id)
+                    )
+                return data
+        except InvalidAuthentication as err:
+            _LOGGER.error("Invalid username or Smile ID")
+            raise UpdateFailed("Smile update failed") from err
         except XMLDataMissingError as err:
             _LOGGER.debug(
                 "Updating Smile failed, expected XML data for %s", api.smile_name
@@ -122,55 +231,104 @@ async def async_setup_entry_gw(hass: HomeAssistant, entry: ConfigEntry) -> bool:
             )
             raise UpdateFailed("Smile update failed") from err
 
-    coordinator = DataUpdateCoordinator(
+    coordinator = SmileDataUpdateCoordinator(
         hass,
-        _LOGGER,
-        name=f"Smile {api.smile_name}",
+        api,
         update_method=async_update_data_gw,
         update_interval=update_interval,
+        entry_id=entry.entry_id,
+        websession=websession,
+        connection_stats=connection_stats,
+        content_tracker=content_tracker,
+        topology=topology,
     )
 
-    await coordinator.async_refresh()
+    _async_apply_scan_options(coordinator, entry)
+
+    if connected:
+        await coordinator.async_refresh()
 
-    if not coordinator.last_update_success:
-        raise ConfigEntryNotReady
+        if not coordinator.last_update_success:
+            await websession.close()
+            raise ConfigEntryNotReady
 
-    _LOGGER.debug("Async update interval %s", update_interval)
+    poll_scheduler = hass.data.setdefault(POLL_SCHEDULER, SmilePollScheduler())
+    poll_scheduler.async_register(coordinator)
 
-    api.get_all_devices()
+    _LOGGER.debug("Async update interval %s", coordinator.update_interval)
 
     undo_listener = entry.add_update_listener(_update_listener)
 
+    @callback
+    def _async_close_websession(event):
+        """Close the session when Home Assistant shuts down."""
+        hass.async_create_task(websession.close())
+
+    undo_close_listener = hass.bus.async_listen_once(
+        EVENT_HOMEASSISTANT_CLOSE, _async_close_websession
+    )
+
+    async def async_registry_updated(event):
+        """Project the data keys again when an entity is enabled or disabled."""
+        if event.data["action"] != "update":
+            return
+        registry = await er.async_get_registry(hass)
+        entity = registry.async_get(event.data["entity_id"])
+        if entity is None or entity.config_entry_id != entry.entry_id:
+            return
+
+        keys, disabled_devices = await async_get_projection(hass, entry.entry_id)
+        if not content_tracker.async_set_keys(keys, disabled_devices):
+            return
+
+        _LOGGER.debug("Projected data keys of %s changed", api.smile_name)
+        await coordinator.async_refresh()
+        if not coordinator.last_update_success or not topology.confirmed:
+            return
+
+        # The reload adding an enabled entity creates it from the stored keys
+        if await topology.async_update(api, coordinator.data):
+            hass.async_create_task(hass.config_entries.async_reload(entry.entry_id))
+
+    undo_registry_listener = hass.bus.async_listen(
+        er.EVENT_ENTITY_REGISTRY_UPDATED, async_registry_updated
+    )
+
     # Migrate to a valid unique_id when needed
     if entry.unique_id is None:
-        if api.smile_version[0] != "1.8.0":
-            hass.config_entries.async_update_entry(entry, unique_id=api.smile_hostname)
+        if topology.smile_version != "1.8.0":
+            hass.config_entries.async_update_entry(
+                entry, unique_id=topology.smile_hostname
+            )
 
     hass.data.setdefault(DOMAIN, {})[entry.entry_id] = {
         API: api,
         COORDINATOR: coordinator,
         PW_TYPE: GATEWAY,
+        UNDO_CLOSE_LISTENER: undo_close_listener,
+        UNDO_REGISTRY_LISTENER: undo_registry_listener,
         UNDO_UPDATE_LISTENER: undo_listener,
     }
 
-    _LOGGER.debug("Gateway is %s", api.gateway_id)
+    _LOGGER.debug("Gateway is %s", topology.gateway_id)
 
-    _LOGGER.debug("Gateway software version is %s", api.smile_version)
-    _LOGGER.debug("Appliances is %s", api.get_all_appliances())
-    _LOGGER.debug("Scan thermostats is %s", api.scan_thermostats())
-    _LOGGER.debug("Locations (matched) is %s", api.match_locations())
+    _LOGGER.debug("Gateway software version is %s", topology.smile_version)
+    if topology.confirmed:
+        _LOGGER.debug("Appliances is %s", api.get_all_appliances())
+        _LOGGER.debug("Scan thermostats is %s", api.scan_thermostats())
+        _LOGGER.debug("Locations (matched) is %s", api.match_locations())
 
     device_registry = await dr.async_get_registry(hass)
     device_registry.async_get_or_create(
         config_entry_id=entry.entry_id,
-        identifiers={(DOMAIN, api.gateway_id)},
+        identifiers={(DOMAIN, topology.gateway_id)},
         manufacturer="Plugwise",
         name=entry.title,
-        model=f"Smile {api.smile_name}",
-        sw_version=api.smile_version[0],
+        model=f"Smile {topology.smile_name}",
+        sw_version=topology.smile_version,
     )
 
-    single_master_thermostat = api.single_master_thermostat()
+    single_master_thermostat = topology.single_master_thermostat
     _LOGGER.debug("Single master thermostat = %s", single_master_thermostat)
 
     platforms = PLATFORMS_GATEWAY
@@ -181,7 +339,7 @@ async def async_setup_entry_gw(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         """Service: delete the Plugwise Notification."""
         _LOGGER.debug("Service delete PW Notification called for %s", api.smile_name)
         try:
-            deleted = await api.delete_notification()
+            deleted = await coordinator.async_command(api.delete_notification)
             _LOGGER.debug("PW Notification deleted: %s", deleted)
         except PlugwiseException:
             _LOGGER.debug(
@@ -197,6 +355,10 @@ async def async_setup_entry_gw(hass: HomeAssistant, entry: ConfigEntry) -> bool:
                 DOMAIN, SERVICE_DELETE, async_delete_notification, schema=vol.Schema({})
             )
 
+    if not topology.confirmed:
+        # The entities are unavailable until the first update confirms them
+        hass.async_create_task(coordinator.async_refresh())
+
     return True
 
 
@@ -212,19 +374,908 @@ async def async_unload_entry_gw(hass: HomeAssistant, entry: ConfigEntry):
     )
 
     hass.data[DOMAIN][entry.entry_id][UNDO_UPDATE_LISTENER]()
+    hass.data[DOMAIN][entry.entry_id][UNDO_REGISTRY_LISTENER]()
 
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id)
+        hass.data[DOMAIN][entry.entry_id][UNDO_CLOSE_LISTENER]()
+        coordinator = hass.data[DOMAIN].pop(entry.entry_id)[COORDINATOR]
+        hass.data[POLL_SCHEDULER].async_unregister(entry.entry_id)
+        await coordinator.websession.close()
+
+        # The service of the thermostats is shared by all gateways
+        if hass.services.has_service(DOMAIN, SERVICE_SET_HVAC_MODES) and not any(
+            entry_data[PW_TYPE] == GATEWAY for entry_data in hass.data[DOMAIN].values()
+        ):
+            hass.services.async_remove(DOMAIN, SERVICE_SET_HVAC_MODES)
 
     return unload_ok
 
 
+async def async_remove_entry_gw(hass: HomeAssistant, entry: ConfigEntry):
+    """Remove the stored topology of a removed config entry."""
+    await SmileTopology(hass, entry.entry_id).async_remove()
+
+
 async def _update_listener(hass: HomeAssistant, entry: ConfigEntry):
     """Handle options update."""
     coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    _async_apply_scan_options(coordinator, entry)
+
+
+@callback
+def _async_apply_scan_options(coordinator, entry: ConfigEntry):
+    """Apply the scan interval options to the coordinator."""
+    smile_type = coordinator.topology.smile_type
     coordinator.update_interval = timedelta(
-        seconds=entry.options.get(CONF_SCAN_INTERVAL)
+        seconds=entry.options.get(
+            CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL[smile_type]
+        )
+    )
+    coordinator.adaptive_interval = None
+
+    if entry.options.get(CONF_ADAPTIVE_SCAN_INTERVAL):
+        # Poll at the scan interval while values change, back off up to the maximum
+        floor = coordinator.update_interval
+        ceiling = timedelta(
+            seconds=entry.options.get(
+                CONF_MAX_SCAN_INTERVAL, DEFAULT_MAX_SCAN_INTERVAL[smile_type]
+            )
+        )
+        coordinator.adaptive_interval = (floor, max(floor, ceiling))
+
+
+async def async_get_projection(hass: HomeAssistant, entry_id):
+    """Return the data keys and devices of a Smile read by enabled entities.
+
+    Returns the data keys of the enabled sensors, and the climate and switch
+    keys, with the devices of which every entity is disabled.
+    """
+    registry = await er.async_get_registry(hass)
+    device_registry = await dr.async_get_registry(hass)
+    enabled = set()
+    disabled = set()
+    enabled_devices = set()
+    disabled_devices = set()
+    for entity in er.async_entries_for_config_entry(registry, entry_id):
+        is_enabled = entity.disabled_by is None
+        key = next(
+            (
+                key
+                for suffix, key in SENSOR_KEY_SUFFIXES.items()
+                if entity.unique_id.endswith(suffix)
+            ),
+            None,
+        )
+        if key is not None:
+            (enabled if is_enabled else disabled).add(key)
+
+        device = entity.device_id and device_registry.async_get(entity.device_id)
+        if device:
+            for domain, dev_id in device.identifiers:
+                if domain == DOMAIN:
+                    devices = enabled_devices if is_enabled else disabled_devices
+                    devices.add(dev_id)
+
+    # Only keys disabled for every device are left out, the climate and switch
+    # entities read their keys whichever sensors are disabled
+    keys = GATEWAY_DATA_KEYS - (disabled - enabled)
+    return (
+        keys.union(SWITCH_DATA_KEYS, THERMOSTAT_DATA_KEYS),
+        disabled_devices - enabled_devices,
+    )
+
+
+@callback
+def async_create_smile_session(
+    hass: HomeAssistant, trace_configs=None, response_class=None
+):
+    """Create a session with a dedicated, keep-alive connection pool for a Smile.
+
+    The caller closes the session when done with it.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=DEFAULT_MAX_CONCURRENT_REQUESTS,
+        keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=DEFAULT_DNS_CACHE_TTL,
+        ssl=False,
     )
+    websession = aiohttp.ClientSession(
+        connector=connector,
+        headers={"User-Agent": f"HomeAssistant/{__version__} plugwise"},
+        trace_configs=trace_configs,
+        response_class=response_class or aiohttp.ClientResponse,
+    )
+
+    return websession
+
+
+class SmileConnectionStats:
+    """Count the connections opened and reused by the session of a Smile."""
+
+    def __init__(self):
+        """Initialise the counters."""
+        self.created = 0
+        self.reused = 0
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_connection_create_end.append(self._on_create)
+        self.trace_config.on_connection_reuseconn.append(self._on_reuse)
+
+    async def _on_create(self, session, context, params):
+        """Count a new connection, i.e. a TCP handshake."""
+        self.created += 1
+
+    async def _on_reuse(self, session, context, params):
+        """Count a reused keep-alive connection, i.e. a handshake saved."""
+        self.reused += 1
+
+
+class SmileContentFilter:
+    """Drop the measurement logs no entity reads from the Smile content."""
+
+    def __init__(self, keys):
+        """Initialise the filter."""
+        self.dropped = 0
+        self.log_types = None
+        self._log_types = None
+        self.async_set_keys(keys)
+
+    @callback
+    def async_set_keys(self, keys):
+        """Keep the logs the data keys derive from, return whether that changed."""
+        log_types = set(LIBRARY_LOG_TYPES)
+        for measurement, attrs in DEVICE_MEASUREMENTS.items():
+            for name in (measurement, attrs.get(ATTR_NAME, measurement)):
+                if any(key == name or key.startswith(f"{name}_") for key in keys):
+                    log_types.add(measurement)
+
+        changed = log_types != self.log_types
+        self.log_types = log_types
+        self._log_types = {log_type.encode() for log_type in log_types}
+        return changed
+
+    def filter(self, body):
+        """Return the body without the unused logs, scanned without parsing it.
+
+        The library parses the smaller body only, building a tree to prune
+        it first costs more than the parse saves.
+        """
+        return LOG_ELEMENT.sub(self._filter_log, body)
+
+    def _filter_log(self, match):
+        """Return the log element when its type is in use, else nothing."""
+        log_type = LOG_TYPE.search(match.group(0))
+        if log_type is None or log_type.group(1) in self._log_types:
+            return match.group(0)
+        self.dropped += 1
+        return b""
+
+
+class SmileContentTracker:
+    """Fingerprint the Smile responses and request them conditionally."""
+
+    def __init__(self, content_filter=None, disabled_devices=frozenset()):
+        """Initialise the tracker."""
+        self.content_filter = content_filter
+        self.disabled_devices = disabled_devices
+        self.generation = 0
+        self.not_modified = 0
+        self.polls = 0
+        self.skipped = 0
+        self._derived_generation = None
+        self._fetched = 0
+        self._responses = {}
+
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_request_start.append(self._on_request_start)
+
+        tracker = self
+
+        class SmileResponse(aiohttp.ClientResponse):
+            """Response recording, or restoring, the body of the Smile content."""
+
+            async def read(self):
+                """Read the body, the previous one when it was not modified."""
+                if self._body is None and self.method == "GET":
+                    body = await super().read()
+                    self._body = tracker.async_process_body(self, body)
+                    return self._body
+                return await super().read()
+
+        self.response_class = SmileResponse
+
+    @callback
+    def async_set_keys(self, keys, disabled_devices=frozenset()):
+        """Project the data onto the keys and devices, return whether it changed."""
+        devices_changed = disabled_devices != self.disabled_devices
+        self.disabled_devices = disabled_devices
+        if self.content_filter is not None and self.content_filter.async_set_keys(
+            keys
+        ):
+            # The stored bodies were filtered for the previous keys, fetch them again
+            self._responses.clear()
+        elif not devices_changed:
+            return False
+
+        # Derive the device data again, also from content that did not change
+        self.generation += 1
+        return True
+
+    @property
+    def unchanged(self):
+        """Return whether the content fetched is the content the data is from."""
+        return bool(self._fetched) and self.generation == self._derived_generation
+
+    @callback
+    def async_start(self):
+        """Start tracking the responses of an update."""
+        self._fetched = 0
+
+    @callback
+    def async_mark_derived(self):
+        """Mark the current content as the source of the device data."""
+        self._derived_generation = self.generation
+
+    async def _on_request_start(self, session, context, params):
+        """Make the request conditional on the validators of the last response."""
+        if params.method != "GET" or str(params.url) not in self._responses:
+            return
+
+        etag, last_modified, _, _ = self._responses[str(params.url)]
+        if etag is not None:
+            params.headers["If-None-Match"] = etag
+        if last_modified is not None:
+            params.headers["If-Modified-Since"] = last_modified
+
+    @callback
+    def async_process_body(self, response, body):
+        """Compare the body with the previous one, return the body to use."""
+        url = str(response.url)
+        if response.status == 304 and url in self._responses:
+            self._fetched += 1
+            self.not_modified += 1
+            return self._responses[url][2]
+
+        if response.status != 200:
+            return body
+
+        self._fetched += 1
+
+        fingerprint = hashlib.blake2b(body, digest_size=16).digest()
+        previous = self._responses.get(url)
+        if previous is None or previous[3] != fingerprint:
+            self.generation += 1
+
+        if self.content_filter is not None and b"<logs" in body:
+            body = self.content_filter.filter(body)
+        # Not every firmware sends validators, then only the fingerprint is used
+        self._responses[url] = (
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            body,
+            fingerprint,
+        )
+        return body
+
+    @callback
+    def async_diagnostics(self):
+        """Return the conditional request and parse-skip statistics."""
+        return {
+            "polls": self.polls,
+            "skipped": self.skipped,
+            "skip_rate": round(self.skipped / self.polls, 3) if self.polls else 0.0,
+            "not_modified": self.not_modified,
+            "dropped_logs": self.content_filter.dropped
+            if self.content_filter
+            else 0,
+            "log_types": sorted(self.content_filter.log_types)
+            if self.content_filter
+            else None,
+            "disabled_devices": len(self.disabled_devices),
+        }
+
+
+class SmileTopology:
+    """Persist the devices of a Smile and their data keys for a fast startup.
+
+    Entities of the stored devices are created right away and are
+    unavailable until the first update of the Smile confirms them.
+    """
+
+    def __init__(self, hass, entry_id):
+        """Initialise the topology."""
+        self.active_device_present = False
+        self.confirmed = False
+        self.device_keys = {}
+        self.devices = {}
+        self.gateway_id = None
+        self.heater_id = None
+        self.single_master_thermostat = None
+        self.smile_hostname = None
+        self.smile_name = None
+        self.smile_type = None
+        self.smile_version = None
+        self._store = Store(
+            hass, TOPOLOGY_STORAGE_VERSION, f"{TOPOLOGY_STORAGE_KEY}.{entry_id}"
+        )
+        self._stored = None
+
+    async def async_load(self):
+        """Load the stored topology, return whether there was one."""
+        self._stored = await self._store.async_load()
+        if self._stored is None:
+            return False
+
+        self._async_restore(self._stored)
+        return True
+
+    async def async_remove(self):
+        """Remove the stored topology."""
+        await self._store.async_remove()
+
+    @callback
+    def async_update_gateway(self, api):
+        """Take the properties of the gateway from the connected Smile."""
+        self.gateway_id = api.gateway_id
+        self.heater_id = api.heater_id
+        self.smile_hostname = api.smile_hostname
+        self.smile_name = api.smile_name
+        self.smile_type = api.smile_type
+        self.smile_version = api.smile_version[0]
+
+    async def async_update(self, api, data):
+        """Take the devices from the first update, return whether they changed.
+
+        Only the devices of a topology loaded from storage can turn out to be
+        outdated. The data keys of the stored devices are kept, a value can be
+        missing for a while or no longer be fetched for a disabled entity.
+        """
+        structure = self._structure()
+        self.active_device_present = bool(api.active_device_present)
+        self.single_master_thermostat = api.single_master_thermostat()
+        self.devices = api.get_all_devices()
+        self.device_keys = {
+            dev_id: {key for key, value in dev_data.items() if value is not None}
+            | self.device_keys.get(dev_id, set())
+            for dev_id, dev_data in data.items()
+        }
+        self.confirmed = True
+
+        record = self._data_to_save()
+        if record == self._stored:
+            return False
+
+        # Saved right away, a reload has to find the current topology
+        await self._store.async_save(record)
+        outdated = self._stored is not None and self._structure() != structure
+        self._stored = record
+        return outdated
+
+    @callback
+    def _async_restore(self, record):
+        """Restore the topology from a stored record."""
+        self.active_device_present = record["active_device_present"]
+        self.device_keys = {
+            dev_id: set(keys) for dev_id, keys in record["device_keys"].items()
+        }
+        self.devices = {
+            dev_id: {**device, "types": set(device["types"])}
+            for dev_id, device in record["devices"].items()
+        }
+        self.gateway_id = record["gateway_id"]
+        self.heater_id = record["heater_id"]
+        self.single_master_thermostat = record["single_master_thermostat"]
+        self.smile_hostname = record["smile_hostname"]
+        self.smile_name = record["smile_name"]
+        self.smile_type = record["smile_type"]
+        self.smile_version = record["smile_version"]
+
+    @callback
+    def _structure(self):
+        """Return the class and model of every device."""
+        return {
+            dev_id: (device["class"], device["model"])
+            for dev_id, device in self.devices.items()
+        }
+
+    @callback
+    def _data_to_save(self):
+        """Return the topology to store."""
+        return {
+            "active_device_present": self.active_device_present,
+            "device_keys": {
+                dev_id: sorted(keys) for dev_id, keys in self.device_keys.items()
+            },
+            "devices": {
+                dev_id: {**device, "types": sorted(device["types"])}
+                for dev_id, device in self.devices.items()
+            },
+            "gateway_id": self.gateway_id,
+            "heater_id": self.heater_id,
+            "single_master_thermostat": self.single_master_thermostat,
+            "smile_hostname": self.smile_hostname,
+            "smile_name": self.smile_name,
+            "smile_type": self.smile_type,
+            "smile_version": self.smile_version,
+        }
+
+
+class SmilePollScheduler:
+    """Spread the refreshes of all Smile coordinators across their interval."""
+
+    def __init__(self):
+        """Initialise the scheduler."""
+        self._coordinators = {}
+
+    @callback
+    def async_register(self, coordinator):
+        """Add a coordinator to the staggered schedule."""
+        self._coordinators[coordinator.entry_id] = coordinator
+        coordinator.poll_scheduler = self
+
+    @callback
+    def async_unregister(self, entry_id):
+        """Remove a coordinator from the staggered schedule."""
+        coordinator = self._coordinators.pop(entry_id, None)
+        if coordinator is not None:
+            coordinator.poll_scheduler = None
+
+    @callback
+    def async_phase(self, entry_id, update_interval):
+        """Return the offset in seconds of the refreshes within the interval."""
+        entry_ids = sorted(self._coordinators)
+        if entry_id not in entry_ids:
+            return 0.0
+
+        # Each gateway gets its own slot, shifted by a deterministic jitter
+        # within the first half of that slot to avoid lining up with others
+        slot = update_interval.total_seconds() / len(entry_ids)
+        jitter = (zlib.crc32(entry_id.encode()) % 1000) / 1000 * slot / 2
+        return entry_ids.index(entry_id) * slot + jitter
+
+    @callback
+    def async_diagnostics(self):
+        """Return the phase offsets of all registered coordinators."""
+        return {
+            entry_id: {
+                "name": coordinator.name,
+                "update_interval": coordinator.update_interval.total_seconds(),
+                "phase_offset": round(
+                    self.async_phase(entry_id, coordinator.update_interval), 3
+                ),
+            }
+            for entry_id, coordinator in self._coordinators.items()
+        }
+
+
+class SmileRequestScheduler:
+    """Order the requests to a Smile by priority and cap the requests in flight."""
+
+    def __init__(self, max_requests=DEFAULT_MAX_CONCURRENT_REQUESTS):
+        """Initialise the scheduler."""
+        self.max_requests = max_requests
+        self._in_flight = {PRIORITY_INTERACTIVE: 0, PRIORITY_POLL: 0}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._stats = {
+            priority: {"requests": 0, "queued": 0, "wait_total": 0.0, "wait_max": 0.0}
+            for priority in self._in_flight
+        }
+        self._max_queue_depth = 0
+
+    async def async_run(self, priority, job, *args):
+        """Run the request job once a slot for its priority is available."""
+        await self._async_acquire(priority)
+        try:
+            return await job(*args)
+        finally:
+            self._in_flight[priority] -= 1
+            self._async_start_queued()
+
+    @callback
+    def _async_can_start(self, priority):
+        """Return whether a request of the priority may be sent now."""
+        if sum(self._in_flight.values()) >= self.max_requests:
+            return False
+        # Polls never take the last slot, keeping it free for user commands
+        return (
+            priority == PRIORITY_INTERACTIVE
+            or self._in_flight[PRIORITY_POLL] < max(1, self.max_requests - 1)
+        )
+
+    async def _async_acquire(self, priority):
+        """Wait for a slot, requests of the same priority are served in order."""
+        stats = self._stats[priority]
+        stats["requests"] += 1
+        queued_first = self._queue and self._queue[0][0] <= priority
+        if not queued_first and self._async_can_start(priority):
+            self._in_flight[priority] += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._sequence), waiter)
+        heapq.heappush(self._queue, entry)
+        self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+        stats["queued"] += 1
+        start = time.monotonic()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just before the cancellation, pass it on
+                self._in_flight[priority] -= 1
+                self._async_start_queued()
+            else:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+            raise
+        finally:
+            waited = time.monotonic() - start
+            stats["wait_total"] += waited
+            stats["wait_max"] = max(stats["wait_max"], waited)
+
+    @callback
+    def _async_start_queued(self):
+        """Grant the free slots to the queued requests in order of priority."""
+        while self._queue and self._async_can_start(self._queue[0][0]):
+            priority, _, waiter = heapq.heappop(self._queue)
+            if waiter.done():
+                continue
+            self._in_flight[priority] += 1
+            waiter.set_result(None)
+
+    @callback
+    def async_diagnostics(self):
+        """Return the queue depth and wait times of the requests."""
+        return {
+            "max_requests": self.max_requests,
+            "in_flight": sum(self._in_flight.values()),
+            "queue_depth": len(self._queue),
+            "max_queue_depth": self._max_queue_depth,
+            **{
+                name: {
+                    "requests": stats["requests"],
+                    "queued": stats["queued"],
+                    "wait_avg": round(stats["wait_total"] / stats["queued"], 3)
+                    if stats["queued"]
+                    else 0.0,
+                    "wait_max": round(stats["wait_max"], 3),
+                }
+                for name, stats in (
+                    ("interactive", self._stats[PRIORITY_INTERACTIVE]),
+                    ("poll", self._stats[PRIORITY_POLL]),
+                )
+            },
+        }
+
+
+class SmileDataUpdateCoordinator(DataUpdateCoordinator):
+    """Smile coordinator keeping track of the device values changed per update."""
+
+    def __init__(
+        self,
+        hass,
+        api,
+        update_method,
+        update_interval,
+        entry_id=None,
+        websession=None,
+        connection_stats=None,
+        content_tracker=None,
+        topology=None,
+    ):
+        """Initialise the coordinator."""
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=f"Smile {topology.smile_name if topology else api.smile_name}",
+            update_method=update_method,
+            update_interval=update_interval,
+        )
+
+        self.adaptive_interval = None
+        self.api = api
+        self.changed = None
+        self.confirmations = 0
+        self.connection_stats = connection_stats
+        self.content_tracker = content_tracker
+        self.entry_id = entry_id
+        self.handshakes_saved = None
+        self.poll_scheduler = None
+        self.request_scheduler = SmileRequestScheduler()
+        self.skipped_writes = 0
+        self.topology = topology
+        self.websession = websession
+        self._confirm_debouncer = Debouncer(
+            hass,
+            _LOGGER,
+            cooldown=DEFAULT_CONFIRM_DELAY,
+            immediate=False,
+            function=self._async_confirm,
+        )
+        self._confirm_devices = set()
+        self._confirm_locations = set()
+        self._device_listeners = {}
+        self._notifications = None
+        self._stale = set()
+        self._subscribers = {}
+        self._unsub_dispatch = None
+
+    async def _async_update_data(self):
+        """Fetch the device data and determine the changed (dev_id, key) pairs."""
+        # Until proven otherwise, e.g. when the update fails, everything changed
+        self.changed = None
+        reused = self.connection_stats.reused if self.connection_stats else 0
+        data = await super()._async_update_data()
+        if self.connection_stats is not None:
+            self.handshakes_saved = self.connection_stats.reused - reused
+        self.changed = self._async_diff(data)
+        self._async_adapt_interval()
+
+        _LOGGER.debug(
+            "Smile %s changed values: %s, skipped state writes: %s, "
+            "handshakes saved: %s",
+            self.api.smile_name,
+            "all" if self.changed is None else len(self.changed),
+            self.skipped_writes,
+            self.handshakes_saved,
+        )
+        return data
+
+    async def async_command(self, command, *args):
+        """Send a command to the Smile ahead of the queued polls."""
+        return await self.request_scheduler.async_run(
+            PRIORITY_INTERACTIVE, command, *args
+        )
+
+    async def async_request_confirmation(self, dev_id, loc_id=None):
+        """Request a debounced update confirming a command sent to a device."""
+        self._confirm_devices.add(dev_id)
+        if loc_id is not None:
+            self._confirm_locations.add(loc_id)
+        await self._confirm_debouncer.async_call()
+
+    async def async_fetch(self):
+        """Fetch the Smile content, return whether the data must be derived again.
+
+        Polls and confirmations share the poll slot, so the content tracked is
+        always that of a single fetch.
+        """
+
+        async def async_fetch():
+            if self.content_tracker is None:
+                await self.api.full_update_device()
+                return True
+            self.content_tracker.async_start()
+            await self.api.full_update_device()
+            return not self.content_tracker.unchanged
+
+        return await self.request_scheduler.async_run(PRIORITY_POLL, async_fetch)
+
+    @callback
+    def async_derive(self, dev_ids):
+        """Return the device data of the devices from the content fetched."""
+        skipped = set()
+        if self.content_tracker is not None:
+            # The climates read the heater, the gateway has the notifications
+            skipped = self.content_tracker.disabled_devices
+            if self.topology is not None:
+                skipped = skipped - {self.topology.gateway_id, self.topology.heater_id}
+        return {
+            dev_id: MappingProxyType(
+                {} if dev_id in skipped else self.api.get_device_data(dev_id)
+            )
+            for dev_id in dev_ids
+        }
+
+    async def _async_confirm(self):
+        """Update the devices, or locations, commands were sent to."""
+        dev_ids = self._confirm_devices
+        loc_ids = self._confirm_locations
+        self._confirm_devices = set()
+        self._confirm_locations = set()
+
+        if self.data is None:
+            return
+
+        _LOGGER.debug("Confirming commands to Smile %s", self.api.smile_name)
+        try:
+            async with async_timeout.timeout(DEFAULT_TIMEOUT):
+                changed = await self.async_fetch()
+        except (asyncio.TimeoutError, PlugwiseException):
+            _LOGGER.debug(
+                "Confirming commands failed for %s, awaiting next update",
+                self.api.smile_name,
+            )
+            return
+
+        self.confirmations += 1
+        if not changed:
+            # The data is already derived from this content
+            return
+
+        if loc_ids:
+            for dev_id, device in self.api.get_all_devices().items():
+                if device.get(PW_LOCATION) in loc_ids:
+                    dev_ids.add(dev_id)
+
+        # Only the devices commanded are derived again, the others keep their
+        # data. The content is not marked derived, so the next poll derives all.
+        data = MappingProxyType({**self.data, **self.async_derive(dev_ids)})
+
+        self.changed = self._async_diff(data)
+        self._async_adapt_interval()
+        self.async_set_updated_data(data)
+
+    @callback
+    def _schedule_refresh(self):
+        """Schedule the next refresh at the phase assigned by the poll scheduler."""
+        if self.poll_scheduler is None or self.update_interval is None:
+            super()._schedule_refresh()
+            return
+
+        if self._unsub_refresh:
+            self._unsub_refresh()
+            self._unsub_refresh = None
+
+        interval = self.update_interval.total_seconds()
+        phase = self.poll_scheduler.async_phase(self.entry_id, self.update_interval)
+
+        # First point in time on the phase, at least half an interval from now
+        earliest = dt_util.utcnow().timestamp() + interval / 2
+        next_refresh = earliest + (phase - earliest) % interval
+
+        self._unsub_refresh = async_track_point_in_utc_time(
+            self.hass,
+            self._handle_refresh_interval,
+            dt_util.utc_from_timestamp(next_refresh),
+        )
+
+    @callback
+    def _async_adapt_interval(self):
+        """Poll at the floor while values move, back off exponentially when idle."""
+        if self.adaptive_interval is None:
+            return
+
+        floor, ceiling = self.adaptive_interval
+        if self.changed is None or self.changed:
+            self.update_interval = floor
+            return
+
+        self.update_interval = min(max(self.update_interval, floor) * 2, ceiling)
+
+    @callback
+    def _async_diff(self, data):
+        """Return the (dev_id, key) pairs changed since the previous update."""
+        notifications = dict(self.api.notifications)
+        if self.data is None or not self.last_update_success:
+            self._notifications = notifications
+            self._stale.clear()
+            return None
+
+        changed = set(self._stale)
+        self._stale.clear()
+
+        if data is self.data:
+            # The content did not change, only invalidated values are reported
+            self._notifications = notifications
+            return changed
+
+        for dev_id in self.data.keys() - data.keys():
+            changed.add((dev_id, None))
+
+        for dev_id, dev_data in data.items():
+            previous = self.data.get(dev_id)
+            if previous is None:
+                changed.add((dev_id, None))
+                continue
+            for key in dev_data.keys() | previous.keys():
+                if dev_data.get(key) != previous.get(key):
+                    changed.add((dev_id, key))
+
+        if notifications != self._notifications:
+            changed.add((self.api.gateway_id, NOTIFICATIONS))
+        self._notifications = notifications
+
+        return changed
+
+    @callback
+    def async_add_device_listener(self, update_callback, dev_id, keys=None):
+        """Listen for changes of the device data, optionally limited to keys."""
+        listeners = self._device_listeners.setdefault(dev_id, {})
+        for key in keys or (None,):
+            listeners.setdefault(key, []).append(update_callback)
+        self._subscribers[update_callback] = (
+            self._subscribers.get(update_callback, 0) + 1
+        )
+
+        if self._unsub_dispatch is None:
+            self._unsub_dispatch = self.async_add_listener(self._async_dispatch)
+
+        @callback
+        def remove_device_listener():
+            """Remove the device listener."""
+            for key in keys or (None,):
+                listeners[key].remove(update_callback)
+                if not listeners[key]:
+                    listeners.pop(key)
+            if not listeners:
+                self._device_listeners.pop(dev_id, None)
+
+            self._subscribers[update_callback] -= 1
+            if not self._subscribers[update_callback]:
+                self._subscribers.pop(update_callback)
+
+            if not self._subscribers and self._unsub_dispatch is not None:
+                self._unsub_dispatch()
+                self._unsub_dispatch = None
+
+        return remove_device_listener
+
+    @callback
+    def _async_dispatch(self):
+        """Call the device listeners interested in the changed values."""
+        if self.data is None:
+            # Started from the stored topology, nothing to process until an update
+            return
+
+        if self.changed is None:
+            update_callbacks = list(self._subscribers)
+        else:
+            update_callbacks = {}
+            for dev_id, key in self.changed:
+                listeners = self._device_listeners.get(dev_id)
+                if not listeners:
+                    continue
+                if key is None:
+                    for key_listeners in listeners.values():
+                        update_callbacks.update(dict.fromkeys(key_listeners))
+                    continue
+                update_callbacks.update(dict.fromkeys(listeners.get(None, ())))
+                update_callbacks.update(dict.fromkeys(listeners.get(key, ())))
+
+        self.skipped_writes += len(self._subscribers) - len(update_callbacks)
+
+        for update_callback in update_callbacks:
+            update_callback()
+
+    @callback
+    def async_diagnostics(self):
+        """Return the update statistics of the coordinator."""
+        return {
+            "update_interval": self.update_interval.total_seconds(),
+            "adaptive_interval": [
+                interval.total_seconds() for interval in self.adaptive_interval
+            ]
+            if self.adaptive_interval
+            else None,
+            "last_update_success": self.last_update_success,
+            "changed_values": None if self.changed is None else len(self.changed),
+            "confirmations": self.confirmations,
+            "device_listeners": len(self._subscribers),
+            "skipped_writes": self.skipped_writes,
+            "requests": self.request_scheduler.async_diagnostics(),
+            "connections": {
+                "created": self.connection_stats.created,
+                "reused": self.connection_stats.reused,
+                "handshakes_saved_last_update": self.handshakes_saved,
+            }
+            if self.connection_stats
+            else None,
+            "content": self.content_tracker.async_diagnostics()
+            if self.content_tracker
+            else None,
+            "topology": {
+                "confirmed": self.topology.confirmed,
+                "devices": len(self.topology.devices),
+            }
+            if self.topology
+            else None,
+        }
+
+    @callback
+    def async_invalidate(self, dev_id, key=None):
+        """Force the next update to report the device value as changed."""
+        self._stale.add((dev_id, key))
 
 
 class SmileGateway(CoordinatorEntity):
@@ -239,6 +1290,8 @@ class SmileGateway(CoordinatorEntity):
 
         self._api = api
         self._dev_id = dev_id
+        # Data keys read by this entity per device, None meaning all keys
+        self._device_keys = {dev_id: None}
         self._entity_name = self._name
         self._model = None
         self._unique_id = None
@@ -251,7 +1304,10 @@ class SmileGateway(CoordinatorEntity):
     @property
     def available(self):
         """Return True if entity is available."""
-        return self.coordinator.last_update_success
+        # Entities created from the stored topology wait for the first update
+        return (
+            self.coordinator.data is not None and self.coordinator.last_update_success
+        )
 
     @property
     def name(self):
@@ -270,17 +1326,22 @@ class SmileGateway(CoordinatorEntity):
         if self._model is not None:
             device_information["model"] = self._model.replace("_", " ").title()
 
-        if self._dev_id != self._api.gateway_id:
-            device_information["via_device"] = (DOMAIN, self._api.gateway_id)
+        gateway_id = self.coordinator.topology.gateway_id
+        if self._dev_id != gateway_id:
+            device_information["via_device"] = (DOMAIN, gateway_id)
 
         return device_information
 
     async def async_added_to_hass(self):
         """Subscribe to updates."""
-        self._async_process_data()
-        self.async_on_remove(
-            self.coordinator.async_add_listener(self._async_process_data)
-        )
+        if self.coordinator.data is not None:
+            self._async_process_data()
+        for dev_id, keys in self._device_keys.items():
+            self.async_on_remove(
+                self.coordinator.async_add_device_listener(
+                    self._async_process_data, dev_id, keys
+                )
+            )
 
     @callback
     def _async_process_data(self):
@@ -7,7 +7,7 @@ from homeassistant.const import (
     ATTR_DEVICE_CLASS,
     ATTR_ICON,
     ATTR_NAME,
-    ATTR_STATE,
+    TIME_SECONDS,
 )
 from homeassistant.components.climate.const import (
     CURRENT_HVAC_COOL,
@@ -18,7 +18,7 @@ from homeassistant.core import callback
 from homeassistant.helpers.entity import Entity
 
 from .gateway import SmileGateway
-from .usb import NodeEntity
+from .usb import USB_SENSOR_DESCRIPTIONS, NodeEntity
 from .const import (
     API,
     ATTR_ENABLED_DEFAULT,
@@ -28,17 +28,23 @@ from .const import (
     COOL_ICON,
     COORDINATOR,
     DEVICE_STATE,
+    DIAGNOSTICS,
+    DIAGNOSTICS_ICON,
     DOMAIN,
     ENERGY_SENSORS,
     HEATING_ICON,
     IDLE_ICON,
+    NODE_DISCOVERY,
+    NODE_INVENTORY,
+    NODE_STATE_WRITER,
     PW_CLASS,
     PW_MODEL,
+    POWER_POLLER,
     PW_TYPE,
     STICK,
+    STICK_BRIDGE,
     THERMOSTAT_SENSORS,
     USB,
-    USB_SENSORS,
 )
 
 PARALLEL_UPDATES = 0
@@ -57,20 +63,31 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
 async def async_setup_entry_usb(hass, config_entry, async_add_entities):
     """Set up Plugwise sensor based on config_entry."""
     stick = hass.data[DOMAIN][config_entry.entry_id][STICK]
+    bridge = hass.data[DOMAIN][config_entry.entry_id][STICK_BRIDGE]
+    inventory = hass.data[DOMAIN][config_entry.entry_id][NODE_INVENTORY]
 
     async def async_add_sensor(mac):
         """Add plugwise sensor."""
-        node = stick.node(mac)
-        for sensor_type in node.get_sensors():
-            if sensor_type in USB_SENSORS and sensor_type != AVAILABLE_SENSOR_ID:
-                async_add_entities([USBSensor(node, mac, sensor_type)])
+        node = stick.node(mac) or inventory.async_cached_node(mac)
+        entities = [
+            USBSensor(node, mac, sensor_type)
+            for sensor_type in node.get_sensors()
+            if sensor_type in USB_SENSOR_DESCRIPTIONS
+            and sensor_type != AVAILABLE_SENSOR_ID
+        ]
+        # Entities created from the inventory move over to the discovered node
+        async_add_entities(inventory.async_unknown(entities))
+
+    entry_data = hass.data[DOMAIN][config_entry.entry_id]
+    async_add_entities([USBStickDiagnostics(entry_data)], True)
 
     for mac in hass.data[DOMAIN][config_entry.entry_id]["sensor"]:
-        hass.async_create_task(async_add_sensor(mac))
+        await async_add_sensor(mac)
 
     def discoved_sensor(mac):
         """Add newly discovered sensor."""
-        hass.async_create_task(async_add_sensor(mac))
+        # Called on the stick thread, add the entities on the event loop
+        bridge.call(hass.async_create_task, async_add_sensor(mac))
 
     # Listen for discovered nodes
     stick.subscribe_stick_callback(discoved_sensor, CB_NEW_NODE)
@@ -81,19 +98,20 @@ async def async_setup_entry_gateway(hass, config_entry, async_add_entities):
     _LOGGER.debug("Plugwise hass data %s", hass.data[DOMAIN])
     api = hass.data[DOMAIN][config_entry.entry_id][API]
     coordinator = hass.data[DOMAIN][config_entry.entry_id][COORDINATOR]
+    topology = coordinator.topology
 
-    _LOGGER.debug("Plugwise sensor type %s", api.smile_type)
+    _LOGGER.debug("Plugwise sensor type %s", topology.smile_type)
 
     entities = []
-    devices = api.get_all_devices()
-    single_thermostat = api.single_master_thermostat()
+    devices = topology.devices
+    single_thermostat = topology.single_master_thermostat
     _LOGGER.debug("Plugwise all devices (not just sensor) %s", devices)
     for dev_id in devices:
-        data = api.get_device_data(dev_id)
-        _LOGGER.debug("Plugwise all device data (not just sensor) %s", data)
+        keys = topology.device_keys.get(dev_id, ())
+        _LOGGER.debug("Plugwise all device keys (not just sensor) %s", keys)
         _LOGGER.debug("Plugwise sensor Dev %s", devices[dev_id][ATTR_NAME])
         for sensor in ENERGY_SENSORS:
-            if data.get(sensor) is None:
+            if sensor not in keys:
                 continue
 
             entities.append(
@@ -110,7 +128,7 @@ async def async_setup_entry_gateway(hass, config_entry, async_add_entities):
             _LOGGER.info("Added sensor.%s", devices[dev_id][ATTR_NAME])
 
         for sensor in THERMOSTAT_SENSORS:
-            if data.get(sensor) is None:
+            if sensor not in keys:
                 continue
 
             entities.append(
@@ -127,7 +145,7 @@ async def async_setup_entry_gateway(hass, config_entry, async_add_entities):
             _LOGGER.info("Added sensor.%s", devices[dev_id][ATTR_NAME])
 
         for sensor in AUX_DEV_SENSORS:
-            if data.get(sensor) is None or not api.active_device_present:
+            if sensor not in keys or not topology.active_device_present:
                 continue
 
             entities.append(
@@ -158,7 +176,11 @@ async def async_setup_entry_gateway(hass, config_entry, async_add_entities):
                 )
                 _LOGGER.info("Added auxiliary sensor %s", devices[dev_id][ATTR_NAME])
 
-    async_add_entities(entities, True)
+    entities.append(
+        GwDiagnosticSensor(api, coordinator, topology.smile_name, topology.gateway_id)
+    )
+
+    async_add_entities(entities)
 
 
 class SmileSensor(SmileGateway):
@@ -176,10 +198,10 @@ class SmileSensor(SmileGateway):
         self._state = None
         self._unit_of_measurement = None
 
-        if dev_id == self._api.heater_id:
+        if dev_id == coordinator.topology.heater_id:
             self._entity_name = "Auxiliary"
 
-        if dev_id == self._api.gateway_id:
+        if dev_id == coordinator.topology.gateway_id:
             self._entity_name = f"Smile {self._entity_name}"
 
         self._unique_id = f"{dev_id}-{sensor}"
@@ -228,12 +250,13 @@ class GWSensor(SmileSensor, Entity):
         if "Auxiliary" in key[ATTR_NAME]:
             self._name = key[ATTR_NAME]
         self._unit_of_measurement = key[ATTR_UNIT_OF_MEASUREMENT]
+        self._device_keys = {dev_id: (sensor,)}
 
     @callback
     def _async_process_data(self):
         """Update the entity."""
         _LOGGER.debug("Update sensor called")
-        data = self._api.get_device_data(self._dev_id)
+        data = self.coordinator.data.get(self._dev_id, {})
 
         if self._sensor not in data:
             self.async_write_ha_state()
@@ -257,12 +280,13 @@ class GwAuxDeviceSensor(SmileSensor, Entity):
         self._heating_state = False
         self._icon = None
         self._name = "Auxiliary Device State"
+        self._device_keys = {dev_id: ("heating_state", "cooling_state")}
 
     @callback
     def _async_process_data(self):
         """Update the entity."""
         _LOGGER.debug("Update aux dev sensor called")
-        data = self._api.get_device_data(self._dev_id)
+        data = self.coordinator.data.get(self._dev_id, {})
 
         self._heating_state = data.get("heating_state")
         self._cooling_state = data.get("cooling_state")
@@ -279,40 +303,167 @@ class GwAuxDeviceSensor(SmileSensor, Entity):
         self.async_write_ha_state()
 
 
+class GwDiagnosticSensor(SmileSensor, Entity):
+    """Representation of the update statistics of a Smile."""
+
+    def __init__(self, api, coordinator, name, dev_id):
+        """Set up the Plugwise API."""
+        super().__init__(api, coordinator, name, dev_id, False, DIAGNOSTICS)
+
+        self._attributes = {}
+        self._icon = DIAGNOSTICS_ICON
+        self._name = f"{name} Diagnostics"
+        self._unit_of_measurement = TIME_SECONDS
+
+    @property
+    def available(self):
+        """Return True, the statistics include the failed updates."""
+        return True
+
+    @property
+    def device_state_attributes(self):
+        """Return the state attributes."""
+        return self._attributes
+
+    async def async_added_to_hass(self):
+        """Subscribe to every update, also those without changed values."""
+        self._async_process_data()
+        self.async_on_remove(
+            self.coordinator.async_add_listener(self._async_process_data)
+        )
+
+    @callback
+    def _async_process_data(self):
+        """Update the entity when the summary of the statistics changed.
+
+        The counters grow on every update, only the values describing the
+        state of the connection are recorded.
+        """
+        diagnostics = self.coordinator.async_diagnostics()
+        content = diagnostics["content"] or {}
+        topology = diagnostics["topology"] or {}
+        attributes = {
+            "adaptive_interval": diagnostics["adaptive_interval"],
+            "last_update_success": diagnostics["last_update_success"],
+            "skip_rate": round(content.get("skip_rate", 0.0), 2),
+            "disabled_devices": content.get("disabled_devices", 0),
+            "topology_confirmed": topology.get("confirmed"),
+        }
+        poll_scheduler = self.coordinator.poll_scheduler
+        if poll_scheduler is not None:
+            attributes["phase_offset"] = poll_scheduler.async_diagnostics()[
+                self.coordinator.entry_id
+            ]["phase_offset"]
+
+        state = diagnostics["update_interval"]
+        if (state, attributes) == (self._state, self._attributes):
+            return
+        self._state = state
+        self._attributes = attributes
+        self.async_write_ha_state()
+
+
+class USBStickDiagnostics(Entity):
+    """Representation of the statistics of a USB-stick, polled."""
+
+    def __init__(self, entry_data):
+        """Initialize the entity."""
+        self._entry_data = entry_data
+        self._mac = entry_data[STICK].get_mac_stick()
+        self._attributes = {}
+        self._state = None
+
+    @property
+    def device_info(self):
+        """Return the device info."""
+        return {
+            "identifiers": {(DOMAIN, self._mac)},
+            "name": f"Stick ({self._mac})",
+            "manufacturer": "Plugwise",
+            "model": "Stick",
+        }
+
+    @property
+    def device_state_attributes(self):
+        """Return the state attributes."""
+        return self._attributes
+
+    @property
+    def entity_registry_enabled_default(self):
+        """Return the sensor registration state."""
+        return False
+
+    @property
+    def icon(self):
+        """Icon to use in the frontend, if any."""
+        return DIAGNOSTICS_ICON
+
+    @property
+    def name(self):
+        """Return the display name of this sensor."""
+        return f"Stick {self._mac[-5:]} Diagnostics"
+
+    @property
+    def state(self):
+        """Return the number of discovered nodes."""
+        return self._state
+
+    @property
+    def unique_id(self):
+        """Get unique ID."""
+        return f"{self._mac}-{DIAGNOSTICS}"
+
+    async def async_update(self):
+        """Collect the statistics of the stick."""
+        stick = self._entry_data[STICK]
+        discovery = self._entry_data[NODE_DISCOVERY].async_diagnostics()
+        self._state = discovery["discovered"]
+        self._attributes = {
+            "discovery": discovery,
+            "stick_bridge": self._entry_data[STICK_BRIDGE].async_diagnostics(),
+            "state_writes": self._entry_data[NODE_STATE_WRITER].async_diagnostics(),
+            "request_latency": stick.latency.async_diagnostics(),
+            "message_queue": stick.message_queue.async_diagnostics(),
+            "power_polling": self._entry_data[POWER_POLLER].async_diagnostics(),
+            "energy_log": stick.energy_log.async_diagnostics(),
+        }
+
+
 class USBSensor(NodeEntity):
     """Representation of a Stick Node sensor."""
 
     def __init__(self, node, mac, sensor_id):
         """Initialize a Node entity."""
-        super().__init__(node, mac)
+        super().__init__(node, mac, USB_SENSOR_DESCRIPTIONS[sensor_id])
         self.sensor_id = sensor_id
-        self.sensor_type = USB_SENSORS[sensor_id]
         self.node_callbacks = (AVAILABLE_SENSOR_ID, sensor_id)
+        self._name = f"{self.description.name} ({mac[-5:]})"
+        self._unique_id = f"{mac}-{sensor_id}"
 
     @property
     def device_class(self):
         """Return the device class of the sensor."""
-        return self.sensor_type[ATTR_DEVICE_CLASS]
+        return self.description.device_class
 
     @property
     def entity_registry_enabled_default(self):
         """Return the sensor registration state."""
-        return self.sensor_type[ATTR_ENABLED_DEFAULT]
+        return self.description.enabled_default
 
     @property
     def icon(self):
         """Icon to use in the frontend, if any."""
-        return self.sensor_type[ATTR_ICON]
+        return self.description.icon
 
     @property
     def name(self):
         """Return the display name of this sensor."""
-        return f"{self.sensor_type[ATTR_NAME]} ({self._mac[-5:]})"
+        return self._name
 
     @property
     def state(self):
         """Return the state of the sensor."""
-        state_value = getattr(self._node, self.sensor_type[ATTR_STATE])()
+        state_value = self._get_state()
         if state_value is not None:
             return float(round(state_value, 3))
         return None
@@ -320,9 +471,9 @@ class USBSensor(NodeEntity):
     @property
     def unique_id(self):
         """Get unique ID."""
-        return f"{self._mac}-{self.sensor_id}"
+        return self._unique_id
 
     @property
     def unit_of_measurement(self):
         """Return the unit this state is expressed in."""
-        return self.sensor_type[ATTR_UNIT_OF_MEASUREMENT]
+        return self.description.unit_of_measurement
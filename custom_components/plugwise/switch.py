@@ -5,10 +5,7 @@ import logging
 from plugwise.exceptions import PlugwiseException
 
 from homeassistant.const import (
-    ATTR_DEVICE_CLASS,
-    ATTR_ICON,
     ATTR_NAME,
-    ATTR_STATE,
     STATE_OFF,
     STATE_ON,
 )
@@ -16,22 +13,21 @@ from homeassistant.components.switch import SwitchEntity
 from homeassistant.core import callback
 
 from .gateway import SmileGateway
-from .usb import NodeEntity
+from .usb import SWITCH_DESCRIPTIONS, USB_SENSOR_DESCRIPTIONS, NodeEntity
 from .const import (
     API,
-    ATTR_ENABLED_DEFAULT,
     AVAILABLE_SENSOR_ID,
     CB_NEW_NODE,
     COORDINATOR,
     CURRENT_POWER_SENSOR_ID,
     DOMAIN,
+    NODE_INVENTORY,
     PW_MODEL,
     PW_TYPE,
-    USB_SENSORS,
     STICK,
+    STICK_BRIDGE,
     SWITCH_CLASSES,
     SWITCH_ICON,
-    SWITCHES,
     TODAY_ENERGY_SENSOR_ID,
     USB,
 )
@@ -50,20 +46,27 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
 async def async_setup_entry_usb(hass, config_entry, async_add_entities):
     """Set up the USB switches from a config entry."""
     stick = hass.data[DOMAIN][config_entry.entry_id][STICK]
+    bridge = hass.data[DOMAIN][config_entry.entry_id][STICK_BRIDGE]
+    inventory = hass.data[DOMAIN][config_entry.entry_id][NODE_INVENTORY]
 
     async def async_add_switch(mac):
         """Add plugwise switch."""
-        node = stick.node(mac)
-        for switch_type in node.get_switches():
-            if switch_type in SWITCHES:
-                async_add_entities([USBSwitch(node, mac, switch_type)])
+        node = stick.node(mac) or inventory.async_cached_node(mac)
+        entities = [
+            USBSwitch(node, mac, switch_type)
+            for switch_type in node.get_switches()
+            if switch_type in SWITCH_DESCRIPTIONS
+        ]
+        # Entities created from the inventory move over to the discovered node
+        async_add_entities(inventory.async_unknown(entities))
 
     for mac in hass.data[DOMAIN][config_entry.entry_id]["switch"]:
-        hass.async_create_task(async_add_switch(mac))
+        await async_add_switch(mac)
 
     def discoved_switch(mac):
         """Add newly discovered switch."""
-        hass.async_create_task(async_add_switch(mac))
+        # Called on the stick thread, add the entities on the event loop
+        bridge.call(hass.async_create_task, async_add_switch(mac))
 
     # Listen for discovered nodes
     stick.subscribe_stick_callback(discoved_switch, CB_NEW_NODE)
@@ -75,7 +78,7 @@ async def async_setup_entry_gateway(hass, config_entry, async_add_entities):
     coordinator = hass.data[DOMAIN][config_entry.entry_id][COORDINATOR]
 
     entities = []
-    devices = api.get_all_devices()
+    devices = coordinator.topology.devices
 
     for dev_id in devices:
         members = None
@@ -93,7 +96,7 @@ async def async_setup_entry_gateway(hass, config_entry, async_add_entities):
             )
             _LOGGER.info("Added switch.%s", "{}".format(devices[dev_id][ATTR_NAME]))
 
-    async_add_entities(entities, True)
+    async_add_entities(entities)
 
 
 class GwSwitch(SmileGateway, SwitchEntity):
@@ -110,6 +113,7 @@ class GwSwitch(SmileGateway, SwitchEntity):
         self._model = model
         self._name = f"{name}"
 
+        self._device_keys = {dev_id: ("relay",)}
         self._unique_id = f"{dev_id}-plug"
 
     @property
@@ -126,12 +130,14 @@ class GwSwitch(SmileGateway, SwitchEntity):
         """Turn the device on."""
         _LOGGER.debug("Turn switch.%s on.", self._name)
         try:
-            state_on = await self._api.set_relay_state(
-                self._dev_id, self._members, STATE_ON
+            state_on = await self._coordinator.async_command(
+                self._api.set_relay_state, self._dev_id, self._members, STATE_ON
             )
             if state_on:
                 self._is_on = True
+                self._coordinator.async_invalidate(self._dev_id, "relay")
                 self.async_write_ha_state()
+                await self._coordinator.async_request_confirmation(self._dev_id)
         except PlugwiseException:
             _LOGGER.error("Error while communicating to device")
 
@@ -139,12 +145,14 @@ class GwSwitch(SmileGateway, SwitchEntity):
         """Turn the device off."""
         _LOGGER.debug("Turn switch.%s off.", self._name)
         try:
-            state_off = await self._api.set_relay_state(
-                self._dev_id, self._members, STATE_OFF
+            state_off = await self._coordinator.async_command(
+                self._api.set_relay_state, self._dev_id, self._members, STATE_OFF
             )
             if state_off:
                 self._is_on = False
+                self._coordinator.async_invalidate(self._dev_id, "relay")
                 self.async_write_ha_state()
+                await self._coordinator.async_request_confirmation(self._dev_id)
         except PlugwiseException:
             _LOGGER.error("Error while communicating to device")
 
@@ -153,7 +161,7 @@ class GwSwitch(SmileGateway, SwitchEntity):
         """Update the data from the Plugs."""
         _LOGGER.debug("Update switch called")
 
-        data = self._api.get_device_data(self._dev_id)
+        data = self.coordinator.data.get(self._dev_id, {})
 
         if "relay" not in data:
             self.async_write_ha_state()
@@ -170,9 +178,8 @@ class USBSwitch(NodeEntity, SwitchEntity):
 
     def __init__(self, node, mac, switch_id):
         """Initialize a Node entity."""
-        super().__init__(node, mac)
+        super().__init__(node, mac, SWITCH_DESCRIPTIONS[switch_id])
         self.switch_id = switch_id
-        self.switch_type = SWITCHES[self.switch_id]
         if (CURRENT_POWER_SENSOR_ID in node.get_sensors()) and (
             TODAY_ENERGY_SENSOR_ID in node.get_sensors()
         ):
@@ -184,11 +191,23 @@ class USBSwitch(NodeEntity, SwitchEntity):
             )
         else:
             self.node_callbacks = (AVAILABLE_SENSOR_ID, self.switch_id)
+        self._unique_id = f"{mac}-{switch_id}"
+
+    def _bind_node(self, node):
+        """Bind the accessors of the node, the power usage and the relay."""
+        super()._bind_node(node)
+        self._get_power_usage = getattr(
+            node, USB_SENSOR_DESCRIPTIONS[CURRENT_POWER_SENSOR_ID].state
+        )
+        self._get_today_energy = self._node_accessor(
+            node, USB_SENSOR_DESCRIPTIONS[TODAY_ENERGY_SENSOR_ID]
+        )
+        self._set_state = getattr(node, self.description.switch)
 
     @property
     def current_power_w(self):
         """Return the current power usage in W."""
-        current_power = getattr(self._node, USB_SENSORS[CURRENT_POWER_SENSOR_ID][ATTR_STATE])()
+        current_power = self._get_power_usage()
         if current_power:
             return float(round(current_power, 2))
         return None
@@ -196,40 +215,40 @@ class USBSwitch(NodeEntity, SwitchEntity):
     @property
     def device_class(self):
         """Return the device class of this switch."""
-        return self.switch_type[ATTR_DEVICE_CLASS]
+        return self.description.device_class
 
     @property
     def entity_registry_enabled_default(self):
         """Return the switch registration state."""
-        return self.switch_type[ATTR_ENABLED_DEFAULT]
+        return self.description.enabled_default
 
     @property
     def icon(self):
         """Return the icon."""
-        return None if self.switch_type[ATTR_DEVICE_CLASS] else self.switch_type[ATTR_ICON]
+        return None if self.description.device_class else self.description.icon
 
     @property
     def is_on(self):
         """Return true if the switch is on."""
-        return getattr(self._node, self.switch_type[ATTR_STATE])()
+        return self._get_state()
 
     @property
     def today_energy_kwh(self):
         """Return the today total energy usage in kWh."""
-        today_energy = getattr(self._node, USB_SENSORS[TODAY_ENERGY_SENSOR_ID][ATTR_STATE])()
+        today_energy = self._get_today_energy()
         if today_energy:
             return float(round(today_energy, 3))
         return None
 
     def turn_off(self, **kwargs):
         """Instruct the switch to turn off."""
-        getattr(self._node, self.switch_type["switch"])(False)
+        self._set_state(False)
 
     def turn_on(self, **kwargs):
         """Instruct the switch to turn on."""
-        getattr(self._node, self.switch_type["switch"])(True)
+        self._set_state(True)
 
     @property
     def unique_id(self):
         """Get unique ID."""
-        return f"{self._mac}-{self.switch_id}"
+        return self._unique_id
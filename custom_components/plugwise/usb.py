@@ -1,9 +1,37 @@
 """Support for Plugwise devices connected to a Plugwise USB-stick."""
+from array import array
 import asyncio
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from functools import partial
 import logging
+import math
+import os
+import queue
+import threading
+import time
+import serial
 import voluptuous as vol
 
 import plugwise
+from plugwise.constants import (
+    ACK_ERROR,
+    ACK_TIMEOUT,
+    BAUD_RATE,
+    BYTE_SIZE,
+    MESSAGE_FOOTER,
+    MESSAGE_HEADER,
+    MESSAGE_RETRY,
+    MESSAGE_TIME_OUT,
+    NACK_ON_OFF,
+    NACK_REAL_TIME_CLOCK_SET,
+    NACK_SCAN_PARAMETERS_SET,
+    NACK_SLEEP_SET,
+    SLEEP_TIME,
+    STOPBITS,
+    UTF8_DECODE,
+)
 from plugwise.exceptions import (
     CirclePlusError,
     NetworkDown,
@@ -11,89 +39,185 @@ from plugwise.exceptions import (
     StickInitError,
     TimeoutException,
 )
+from plugwise.messages.requests import (
+    CircleClockGetRequest,
+    CirclePlusRealTimeClockGetRequest,
+    CirclePowerBufferRequest,
+    CirclePowerUsageRequest,
+    CircleSwitchRelayRequest,
+    NodePingRequest,
+    StickInitRequest,
+)
+from plugwise.messages.responses import CirclePowerBufferResponse
+from plugwise.nodes.circle import PlugwiseCircle
+from plugwise.util import inc_seq_id
 
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import ATTR_STATE, EVENT_HOMEASSISTANT_STOP
-from homeassistant.core import HomeAssistant
+from homeassistant.const import (
+    ATTR_DEVICE_CLASS,
+    ATTR_ICON,
+    ATTR_NAME,
+    ATTR_STATE,
+    ATTR_UNIT_OF_MEASUREMENT,
+    EVENT_HOMEASSISTANT_STOP,
+)
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.exceptions import ConfigEntryNotReady
 from homeassistant.helpers import config_validation as cv
 from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.event import async_call_later, async_track_time_interval
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
 
 from .const import (
+    ATTR_ENABLED_DEFAULT,
     ATTR_MAC_ADDRESS,
     AVAILABLE_SENSOR_ID,
+    CONF_STATE_WRITE_WINDOW,
+    CB_NEW_NODE,
     CONF_USB_PATH,
+    DEFAULT_DISCOVERY_IN_FLIGHT,
+    DEFAULT_BACKFILL_BUDGET,
+    DEFAULT_POLL_BUDGET,
+    DEFAULT_STATE_WRITE_WINDOW,
+    DISCOVERY_RETRY_MAX,
+    DISCOVERY_RETRY_MIN,
+    DISCOVERY_SCAN_TIMEOUT,
     DOMAIN,
+    ENERGY_LOG_HOURS,
+    ENERGY_LOG_INITIAL_PAGES,
+    ENERGY_LOG_PAGE_HOURS,
+    ENERGY_LOG_REQUEST_TIMEOUT,
+    ENERGY_LOG_SAVE_DELAY,
+    ENERGY_LOG_SENSORS,
+    ENERGY_LOG_STORAGE_KEY,
+    ENERGY_LOG_STORAGE_VERSION,
+    INVENTORY_SAVE_DELAY,
+    INVENTORY_STORAGE_KEY,
+    INVENTORY_STORAGE_VERSION,
+    LATENCY_BUCKETS,
+    MESSAGE_CONFIG,
+    MESSAGE_INTERACTIVE,
+    MESSAGE_PRIORITIES,
+    MESSAGE_RATE_LIMITS,
+    MESSAGE_TELEMETRY,
+    NODE_DISCOVERY,
+    NODE_INVENTORY,
+    NODE_STATE_WRITER,
     PLATFORMS_USB,
+    POWER_POLL_IDLE,
+    POWER_POLL_MAX,
+    POWER_POLL_MIN,
+    POWER_POLL_TICK,
+    POWER_POLL_WINDOW,
+    POWER_POLLER,
+    POWER_STDDEV_THRESHOLD,
+    POWER_USAGE_SENSORS,
+    POWER_VARIANCE_WEIGHT,
     PW_TYPE,
     SERVICE_DEVICE_ADD,
     SERVICE_DEVICE_REMOVE,
     UNDO_UPDATE_LISTENER,
     STICK,
+    STICK_BRIDGE,
+    SWITCHES,
+    TODAY_ENERGY_SENSOR_ID,
     USB,
+    USB_BINARY_SENSORS,
     USB_SENSORS,
+    YESTERDAY_ENERGY_SENSOR_ID,
 )
 
 _LOGGER = logging.getLogger(__name__)
 
+# Answers of the stick and nodes to requests they did not carry out
+FAILED_ACKS = (
+    ACK_ERROR,
+    ACK_TIMEOUT,
+    NACK_ON_OFF,
+    NACK_REAL_TIME_CLOCK_SET,
+    NACK_SCAN_PARAMETERS_SET,
+    NACK_SLEEP_SET,
+)
+READ_SIZE = 1024
+# Seconds the stick takes at most to acknowledge a request
+STICK_ACK_TIMEOUT = 1
+# Priority class of the requests, all others configure the nodes
+REQUEST_PRIORITIES = {
+    CircleSwitchRelayRequest: MESSAGE_INTERACTIVE,
+    CircleClockGetRequest: MESSAGE_TELEMETRY,
+    CirclePlusRealTimeClockGetRequest: MESSAGE_TELEMETRY,
+    CirclePowerBufferRequest: MESSAGE_TELEMETRY,
+    CirclePowerUsageRequest: MESSAGE_TELEMETRY,
+    NodePingRequest: MESSAGE_TELEMETRY,
+}
+
 
 async def async_setup_entry_usb(hass: HomeAssistant, config_entry: ConfigEntry):
     """Establish connection with plugwise USB-stick."""
     hass.data.setdefault(DOMAIN, {})
 
-    def discover_finished():
-        """Create entities for all discovered nodes."""
-        nodes = stick.nodes()
-        _LOGGER.debug(
-            "Successfully discovered %s out of %s registered nodes",
-            str(len(nodes)),
-            str(stick.registered_nodes()),
-        )
-        for component in PLATFORMS_USB:
-            hass.data[DOMAIN][config_entry.entry_id][component] = []
-            for mac in nodes:
-                if component in stick.node(mac).get_categories():
-                    hass.data[DOMAIN][config_entry.entry_id][component].append(mac)
-            hass.async_create_task(
-                hass.config_entries.async_forward_entry_setup(config_entry, component)
-            )
-        stick.auto_update()
-        # Enable reception of join request and automatically accept new node join requests
-        stick.allow_join_requests(True, True)
-
+    @callback
     def shutdown(event):
-        hass.async_add_executor_job(stick.disconnect)
+        poller.async_stop()
+        bridge.async_stop()
+        stick.disconnect()
+
+    def node_discovered(mac):
+        """Move the entities of a discovered node over from the inventory."""
+        bridge.call(inventory.async_node_discovered, mac)
 
-    stick = plugwise.stick(config_entry.data[CONF_USB_PATH])
-    hass.data[DOMAIN][config_entry.entry_id] = {PW_TYPE: USB, STICK: stick}
+    stick = AsyncStick(hass, config_entry.data[CONF_USB_PATH])
+    bridge = StickBridge(hass)
+    inventory = NodeInventory(hass, stick)
+    discovery = NodeDiscovery(hass, stick, inventory)
+    poller = PowerPollScheduler(hass, stick, inventory)
+    state_writer = NodeStateWriter(
+        hass,
+        config_entry.options.get(CONF_STATE_WRITE_WINDOW, DEFAULT_STATE_WRITE_WINDOW),
+    )
+    hass.data[DOMAIN][config_entry.entry_id] = {
+        PW_TYPE: USB,
+        STICK: stick,
+        STICK_BRIDGE: bridge,
+        NODE_DISCOVERY: discovery,
+        NODE_INVENTORY: inventory,
+        NODE_STATE_WRITER: state_writer,
+        POWER_POLLER: poller,
+    }
     try:
         _LOGGER.debug("Connect to USB-Stick")
-        await hass.async_add_executor_job(stick.connect)
+        await stick.async_connect()
         _LOGGER.debug("Initialize USB-stick")
-        await hass.async_add_executor_job(stick.initialize_stick)
+        await stick.async_initialize_stick()
         _LOGGER.debug("Discover Circle+ node")
-        await hass.async_add_executor_job(stick.initialize_circle_plus)
+        await stick.async_initialize_circle_plus()
     except PortError:
         _LOGGER.error("Connecting to Plugwise USBstick communication failed")
         raise ConfigEntryNotReady
     except StickInitError:
         _LOGGER.error("Initializing of Plugwise USBstick communication failed")
-        await hass.async_add_executor_job(stick.disconnect)
+        stick.disconnect()
         raise ConfigEntryNotReady
     except NetworkDown:
         _LOGGER.warning("Plugwise zigbee network down")
-        await hass.async_add_executor_job(stick.disconnect)
+        stick.disconnect()
         raise ConfigEntryNotReady
     except CirclePlusError:
         _LOGGER.warning("Failed to connect to Circle+ node")
-        await hass.async_add_executor_job(stick.disconnect)
+        stick.disconnect()
         raise ConfigEntryNotReady
     except TimeoutException:
         _LOGGER.warning("Timeout")
-        await hass.async_add_executor_job(stick.disconnect)
+        stick.disconnect()
         raise ConfigEntryNotReady
+    await inventory.async_load()
+    await stick.energy_log.async_load()
+    stick.subscribe_stick_callback(node_discovered, CB_NEW_NODE)
     _LOGGER.debug("Start discovery of registered nodes")
-    stick.scan(discover_finished)
+    discovery.async_start(config_entry)
+    # Nodes are polled as soon as they are discovered
+    poller.async_start()
 
     # Listen when EVENT_HOMEASSISTANT_STOP is fired
     hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, shutdown)
@@ -125,6 +249,8 @@ async def async_setup_entry_usb(hass: HomeAssistant, config_entry: ConfigEntry):
 
 async def async_unload_entry_usb(hass: HomeAssistant, config_entry: ConfigEntry):
     """Unload the Plugwise stick connection."""
+    hass.data[DOMAIN][config_entry.entry_id][NODE_DISCOVERY].async_stop()
+    hass.data[DOMAIN][config_entry.entry_id][POWER_POLLER].async_stop()
     unload_ok = all(
         await asyncio.gather(
             *[
@@ -135,8 +261,9 @@ async def async_unload_entry_usb(hass: HomeAssistant, config_entry: ConfigEntry)
     )
     hass.data[DOMAIN][config_entry.entry_id][UNDO_UPDATE_LISTENER]()
     if unload_ok:
+        hass.data[DOMAIN][config_entry.entry_id][STICK_BRIDGE].async_stop()
         stick = hass.data[DOMAIN][config_entry.entry_id]["stick"]
-        await hass.async_add_executor_job(stick.disconnect)
+        stick.disconnect()
         hass.data[DOMAIN].pop(config_entry.entry_id)
     return unload_ok
 
@@ -146,17 +273,1629 @@ async def _async_update_listener(hass: HomeAssistant, config_entry: ConfigEntry)
     await hass.config_entries.async_reload(config_entry.entry_id)
 
 
+@callback
+def _async_set_result(future, result=None):
+    """Resolve the future unless it timed out already."""
+    if not future.done():
+        future.set_result(result)
+
+
+class AsyncStick(plugwise.stick):
+    """Plugwise stick connected through the event loop.
+
+    Sends the queued requests, waits for their acknowledgement and times out
+    unanswered requests on the event loop, in place of the threads of the
+    library.
+    """
+
+    def __init__(self, hass, port):
+        """Initialize the stick."""
+        super().__init__(port)
+        self.hass = hass
+        self.energy_log = EnergyLogCollector(hass, self)
+        self.latency = RequestLatencyHistogram()
+        self.message_queue = StickMessageQueue()
+        self._send_message_queue = self.message_queue
+        self._loop_thread = None
+        self._queued = None
+        self._sender = None
+        self._acknowledged = None
+        self._timeouts = {}
+
+    def _resolve(self, future):
+        """Return a library callback resolving the future."""
+
+        def resolve(*_):
+            _async_set_result(future)
+
+        return resolve
+
+    async def async_connect(self):
+        """Open the connection to the stick and start sending requests."""
+        loop = self.hass.loop
+        protocol = StickProtocol(self)
+        if ":" in self.port:
+            host, port = self.port.split(":")
+            try:
+                await loop.create_connection(lambda: protocol, host, int(port))
+            except OSError as err:
+                raise PortError(err) from err
+        else:
+            SerialTransport.open(loop, protocol, self.port)
+        self.connection = protocol
+
+        self._loop_thread = threading.get_ident()
+        self._queued = asyncio.Event()
+        self._sender = loop.create_task(self._async_send_loop())
+        # Created like the library does, the power poll scheduler replaces it
+        self._run_update_thread = False
+        self._auto_update_timer = 0
+        self._update_thread = threading.Thread(
+            None, self._update_loop, "update_thread", (), {}
+        )
+        self._update_thread.daemon = True
+
+    def disconnect(self):
+        """Stop sending requests and close the connection."""
+        super().disconnect()
+        if self._sender is not None:
+            self._sender.cancel()
+            self._sender = None
+        for timeout in self._timeouts.values():
+            timeout.cancel()
+        self._timeouts = {}
+
+    def send(self, request, callback=None, retry_counter=0):
+        """Queue a request, safe from any thread."""
+        super().send(request, callback, retry_counter)
+        if self._queued is None:
+            return
+        if threading.get_ident() == self._loop_thread:
+            self._queued.set()
+        else:
+            self.hass.loop.call_soon_threadsafe(self._queued.set)
+
+    async def _async_send_loop(self):
+        """Send the queued requests in order of priority and rate."""
+        while True:
+            request_set, wait = self.message_queue.get_ready()
+            if request_set is None:
+                self._queued.clear()
+                try:
+                    await asyncio.wait_for(self._queued.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._async_send(request_set)
+
+    async def _async_send(self, request_set):
+        """Write the request and wait until the stick acknowledges it."""
+        request = request_set[1]
+        if self.last_ack_seq_id:
+            seq_id = inc_seq_id(self.last_ack_seq_id)
+        else:
+            # The first request, the library picks up the sequence ID of its ack
+            seq_id = b"0000"
+        self.expected_responses[seq_id] = request_set
+        if request.mac:
+            node = self._plugwise_nodes.get(request.mac.decode(UTF8_DECODE))
+            if node:
+                node.last_request = datetime.now()
+        request_set[4] = datetime.now()
+        self._timeouts[id(request_set)] = self.hass.loop.call_later(
+            MESSAGE_TIME_OUT, self._async_time_out, request_set
+        )
+        self.connection.send(request)
+        await asyncio.sleep(SLEEP_TIME)
+        if self._is_acknowledged(seq_id):
+            return
+
+        self._acknowledged = (seq_id, self.hass.loop.create_future())
+        try:
+            await asyncio.wait_for(self._acknowledged[1], STICK_ACK_TIMEOUT)
+        except asyncio.TimeoutError:
+            if self.expected_responses.get(seq_id) is request_set:
+                _LOGGER.info(
+                    "Stick did not acknowledge %s with sequence ID %s",
+                    request.__class__.__name__,
+                    seq_id,
+                )
+                del self.expected_responses[seq_id]
+                self._async_failed(request_set)
+        finally:
+            self._acknowledged = None
+
+    def _is_acknowledged(self, seq_id):
+        """Return if the stick acknowledged the request of the sequence ID."""
+        if seq_id == b"0000":
+            # The acknowledgement of the first request sets the sequence ID
+            return self.last_ack_seq_id is not None
+        return self.last_ack_seq_id == seq_id
+
+    @callback
+    def _async_time_out(self, request_set):
+        """Resend or drop a request which was not answered in time."""
+        self._timeouts.pop(id(request_set), None)
+        for seq_id, expected in self.expected_responses.items():
+            if expected is request_set:
+                _LOGGER.debug("Timeout expired for sequence ID %s", seq_id)
+                del self.expected_responses[seq_id]
+                self._async_failed(request_set)
+                return
+
+    @callback
+    def _async_failed(self, request_set):
+        """Count the failed request and resend it while retries are left."""
+        request = request_set[1]
+        self.latency.async_record_failure(request.__class__.__name__)
+        if request_set[3] <= MESSAGE_RETRY:
+            self.send(request, request_set[2], request_set[3] + 1)
+        else:
+            _LOGGER.info(
+                "Drop %s because max (%s) retries reached",
+                request.__class__.__name__,
+                MESSAGE_RETRY,
+            )
+
+    async def async_initialize_stick(self, timeout=MESSAGE_TIME_OUT):
+        """Initialize the stick without blocking the event loop."""
+        if not self.connection.is_connected():
+            raise StickInitError
+
+        initialized = self.hass.loop.create_future()
+
+        def stick_initialized():
+            self._stick_initialized = True
+            _async_set_result(initialized)
+
+        self.send(StickInitRequest(), stick_initialized)
+        try:
+            await asyncio.wait_for(initialized, timeout)
+        except asyncio.TimeoutError as err:
+            raise StickInitError from err
+        if not self.network_online:
+            raise NetworkDown
+
+    async def async_initialize_circle_plus(self, timeout=MESSAGE_TIME_OUT):
+        """Discover the Circle+ without blocking the event loop."""
+        if (
+            not self.connection.is_connected()
+            or not self._stick_initialized
+            or not self.circle_plus_mac
+        ):
+            raise StickInitError
+
+        if not self._circle_plus_discovered:
+            discovered = self.hass.loop.create_future()
+            self.discover_node(self.circle_plus_mac, self._resolve(discovered))
+            try:
+                await asyncio.wait_for(discovered, timeout)
+            except asyncio.TimeoutError:
+                pass
+        if not self._circle_plus_discovered:
+            raise CirclePlusError
+
+    async def async_scan_for_nodes(self, timeout=DISCOVERY_SCAN_TIMEOUT):
+        """Return the nodes registered at the Circle+ by MAC address.
+
+        Returns None when the Circle+ did not finish the scan in time.
+        """
+        registered = self.hass.loop.create_future()
+
+        self.node(self.circle_plus_mac).scan_for_nodes(
+            partial(_async_set_result, registered)
+        )
+        try:
+            nodes = await asyncio.wait_for(registered, timeout)
+        except asyncio.TimeoutError:
+            _LOGGER.warning("Scan for nodes registered at the Circle+ timed out")
+            return None
+
+        self.async_expect_nodes(nodes)
+        return nodes
+
+    @callback
+    def async_expect_nodes(self, nodes):
+        """Let the library add the nodes, by MAC address, once they answer."""
+        # The library only adds the nodes it expects
+        self._nodes_to_discover = dict(nodes)
+        self._nodes_registered = len(nodes)
+
+    async def async_discover_node(self, mac, timeout):
+        """Discover the node, return if it answered."""
+        if mac not in self._plugwise_nodes:
+            discovered = self.hass.loop.create_future()
+            self.discover_node(mac, self._resolve(discovered), True)
+            try:
+                await asyncio.wait_for(discovered, timeout)
+            except asyncio.TimeoutError:
+                pass
+        return mac in self._plugwise_nodes
+
+    def new_message(self, message):
+        """Process a response, keeping the energy log pages of the Circles."""
+        # The parser runs on the event loop
+        if isinstance(message, CirclePowerBufferResponse):
+            self.energy_log.async_record(message)
+        super().new_message(message)
+        if self._acknowledged and self._is_acknowledged(self._acknowledged[0]):
+            _async_set_result(self._acknowledged[1])
+
+    def message_processed(self, seq_id, ack_response=None, ack_small=False):
+        """Process the answer to a request, counting its response time."""
+        request_set = self.expected_responses.get(seq_id)
+        super().message_processed(seq_id, ack_response, ack_small)
+        if request_set is None or self.expected_responses.get(seq_id) is request_set:
+            return
+
+        # The request is answered, or resent by the library
+        timeout = self._timeouts.pop(id(request_set), None)
+        if timeout:
+            timeout.cancel()
+        request = request_set[1].__class__.__name__
+        if ack_response in FAILED_ACKS:
+            self.latency.async_record_failure(request)
+        else:
+            latency = (datetime.now() - request_set[4]).total_seconds()
+            self.latency.async_record(request, latency)
+
+    @callback
+    def async_announce_node(self, mac):
+        """Announce a discovered node to the platforms once."""
+        # The library announces the nodes it rediscovers itself the same way
+        if mac not in self._nodes_not_discovered:
+            return
+        del self._nodes_not_discovered[mac]
+        if self.node(mac):
+            self.do_callback(CB_NEW_NODE, mac)
+
+
+class SerialTransport(asyncio.Transport):
+    """Non-blocking serial port transport driven by the event loop."""
+
+    def __init__(self, loop, protocol, serial_instance):
+        """Initialize the transport."""
+        super().__init__()
+        self._loop = loop
+        self._protocol = protocol
+        self._serial = serial_instance
+        self._fd = serial_instance.fileno()
+        self._write_buffer = bytearray()
+        self._closing = False
+        loop.add_reader(self._fd, self._read_ready)
+        protocol.connection_made(self)
+
+    @classmethod
+    def open(cls, loop, protocol, port):
+        """Open the serial port of the stick and return its transport."""
+        try:
+            serial_instance = serial.Serial(
+                port=port,
+                baudrate=BAUD_RATE,
+                bytesize=BYTE_SIZE,
+                parity=serial.PARITY_NONE,
+                stopbits=STOPBITS,
+                timeout=0,
+            )
+        except serial.SerialException as err:
+            raise PortError(err) from err
+        return cls(loop, protocol, serial_instance)
+
+    def _read_ready(self):
+        """Pass the available data to the protocol."""
+        try:
+            data = os.read(self._fd, READ_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as err:
+            self._close(err)
+            return
+        if data:
+            self._protocol.data_received(data)
+
+    def write(self, data):
+        """Write the data, buffer what the port does not accept yet."""
+        if self._closing:
+            return
+        if not self._write_buffer:
+            try:
+                written = os.write(self._fd, data)
+            except (BlockingIOError, InterruptedError):
+                written = 0
+            except OSError as err:
+                self._close(err)
+                return
+            data = data[written:]
+            if not data:
+                return
+            self._loop.add_writer(self._fd, self._write_ready)
+        self._write_buffer += data
+
+    def _write_ready(self):
+        """Write buffered data once the port accepts it."""
+        try:
+            written = os.write(self._fd, self._write_buffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as err:
+            self._close(err)
+            return
+        del self._write_buffer[:written]
+        if not self._write_buffer:
+            self._loop.remove_writer(self._fd)
+
+    def get_write_buffer_size(self):
+        """Return the number of buffered bytes."""
+        return len(self._write_buffer)
+
+    def is_closing(self):
+        """Return if the transport is closing or closed."""
+        return self._closing
+
+    def close(self):
+        """Close the serial port."""
+        self._close(None)
+
+    def _close(self, exc):
+        """Close the serial port and inform the protocol."""
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._fd)
+        self._loop.remove_writer(self._fd)
+        self._write_buffer.clear()
+        self._serial.close()
+        self._loop.call_soon(self._protocol.connection_lost, exc)
+
+
+class StickProtocol(asyncio.Protocol):
+    """Frame the messages of the stick on the event loop.
+
+    Stands in for the connection of the library, so the stick writes its
+    requests and parses the responses on the event loop.
+    """
+
+    def __init__(self, stick):
+        """Initialize the protocol."""
+        self.stick = stick
+        self._buffer = b""
+        self._transport = None
+
+    def connection_made(self, transport):
+        """Store the transport of the connection."""
+        self._transport = transport
+
+    def connection_lost(self, exc):
+        """Forget the transport of the closed connection."""
+        self._transport = None
+        if exc:
+            _LOGGER.error("Connection to Plugwise USB-stick lost: %s", exc)
+
+    def data_received(self, data):
+        """Pass every complete message to the parser of the stick."""
+        self._buffer += data
+        while True:
+            header = self._buffer.find(MESSAGE_HEADER)
+            if header == -1:
+                # Keep what could be the start of a header
+                start = 1 - len(MESSAGE_HEADER)
+                self._buffer = self._buffer[start:]
+                return
+            footer = self._buffer.find(MESSAGE_FOOTER, header)
+            if footer == -1:
+                self._buffer = self._buffer[header:]
+                return
+
+            end = footer + len(MESSAGE_FOOTER)
+            frame = self._buffer[header:end]
+            self._buffer = self._buffer[end:]
+            self.stick.feed_parser(frame)
+
+    @callback
+    def send(self, message):
+        """Write a request of the stick."""
+        if self._transport is not None:
+            self._transport.write(message.serialize())
+
+    def is_connected(self):
+        """Return connection state."""
+        return self._transport is not None and not self._transport.is_closing()
+
+    def read_thread_alive(self):
+        """Return if data is read, the event loop reads for the stick."""
+        return self.is_connected()
+
+    def write_thread_alive(self):
+        """Return if data is written, the event loop writes for the stick."""
+        return self.is_connected()
+
+    @callback
+    def disconnect(self):
+        """Close the connection."""
+        if self._transport is not None:
+            self._transport.close()
+
+
+class RequestLatencyHistogram:
+    """Histogram of the response times of the stick per request type."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """Initialize the histogram."""
+        self.buckets = buckets
+        self._requests = {}
+
+    def _counts(self, request):
+        """Return the counts of the request type."""
+        counts = self._requests.get(request)
+        if counts is None:
+            counts = self._requests[request] = {
+                "count": 0,
+                "failed": 0,
+                "sum": 0.0,
+                "buckets": [0] * (len(self.buckets) + 1),
+            }
+        return counts
+
+    @callback
+    def async_record(self, request, latency):
+        """Count the response time of a request."""
+        counts = self._counts(request)
+        counts["count"] += 1
+        counts["sum"] += latency
+        counts["buckets"][bisect_left(self.buckets, latency)] += 1
+
+    @callback
+    def async_record_failure(self, request):
+        """Count a request which was not answered."""
+        self._counts(request)["failed"] += 1
+
+    @callback
+    def async_diagnostics(self):
+        """Return the latency histogram of every request type."""
+        labels = [f"<={bucket}" for bucket in self.buckets] + ["+Inf"]
+        return {
+            request: {
+                "count": counts["count"],
+                "failed": counts["failed"],
+                "mean": round(counts["sum"] / counts["count"], 4)
+                if counts["count"]
+                else 0.0,
+                "buckets": dict(zip(labels, counts["buckets"])),
+            }
+            for request, counts in self._requests.items()
+        }
+
+
+class StickMessageQueue(queue.Queue):
+    """Send queue of the stick with a priority class per request type.
+
+    Stands in for the FIFO queue of the library, so switching a relay never
+    waits behind pending telemetry. The classes can be rate limited, a
+    telemetry request without callback is not queued twice.
+    """
+
+    def __init__(self, rate_limits=MESSAGE_RATE_LIMITS):
+        """Initialize the queue."""
+        self.rate_limits = rate_limits
+        super().__init__()
+
+    def _init(self, maxsize):
+        """Initialize a queue per priority class."""
+        self._queues = {priority: deque() for priority in MESSAGE_PRIORITIES}
+        self._queued = set()
+        self._next = dict.fromkeys(MESSAGE_PRIORITIES, 0.0)
+        self._stats = {
+            priority: {
+                "sent": 0,
+                "dropped": 0,
+                "retries": 0,
+                "wait_sum": 0.0,
+                "wait_max": 0.0,
+            }
+            for priority in MESSAGE_PRIORITIES
+        }
+
+    def _qsize(self):
+        """Return the number of queued requests."""
+        return sum(len(requests) for requests in self._queues.values())
+
+    def _put(self, item):
+        """Queue the request set of the stick in its priority class."""
+        request = item[1]
+        priority = REQUEST_PRIORITIES.get(type(request), MESSAGE_CONFIG)
+        stats = self._stats[priority]
+        if item[3]:
+            stats["retries"] += 1
+        key = None
+        if priority == MESSAGE_TELEMETRY and item[2] is None:
+            key = request.serialize()
+            if key in self._queued:
+                stats["dropped"] += 1
+                return
+            self._queued.add(key)
+        self._queues[priority].append((time.monotonic(), key, item))
+
+    def get(self, block=True, timeout=None):
+        """Return the request set of the highest priority class within its rate."""
+        with self.not_empty:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                now = time.monotonic()
+                item, wait = self._select(now)
+                if item is not None:
+                    return item
+                if not block:
+                    raise queue.Empty
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise queue.Empty
+                    wait = remaining if wait is None else min(wait, remaining)
+                self.not_empty.wait(wait)
+
+    def get_ready(self):
+        """Return the next request set within its rate and None, or the wait.
+
+        Never blocks, the wait is None while the queue is empty.
+        """
+        with self.mutex:
+            return self._select(time.monotonic())
+
+    def _select(self, now):
+        """Take the next request set within its rate, holding the mutex."""
+        wait = None
+        for priority in MESSAGE_PRIORITIES:
+            if not self._queues[priority]:
+                continue
+            delay = self._next[priority] - now
+            if delay <= 0:
+                return self._get_from(priority, now), None
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _get_from(self, priority, now):
+        """Take the oldest request set of the class, holding the mutex."""
+        queued, key, item = self._queues[priority].popleft()
+        self._queued.discard(key)
+        rate_limit = self.rate_limits.get(priority)
+        if rate_limit:
+            self._next[priority] = now + 1 / rate_limit
+        stats = self._stats[priority]
+        stats["sent"] += 1
+        stats["wait_sum"] += now - queued
+        stats["wait_max"] = max(stats["wait_max"], now - queued)
+        return item
+
+    def async_diagnostics(self):
+        """Return the queue length, latency and counters per priority class."""
+        with self.mutex:
+            return {
+                priority: {
+                    "rate_limit": self.rate_limits.get(priority),
+                    "queued": len(self._queues[priority]),
+                    "sent": stats["sent"],
+                    "dropped": stats["dropped"],
+                    "retries": stats["retries"],
+                    "wait_mean": round(stats["wait_sum"] / stats["sent"], 4)
+                    if stats["sent"]
+                    else 0.0,
+                    "wait_max": round(stats["wait_max"], 4),
+                }
+                for priority, stats in self._stats.items()
+            }
+
+
+class CachedNode:
+    """Stand-in for a node known from the inventory but not yet discovered."""
+
+    def __init__(self, mac, record):
+        """Initialize the cached node."""
+        self.mac = mac
+        self._record = record
+
+    def __getattr__(self, name):
+        """Return no state and ignore commands until the node is discovered."""
+        return self._unavailable
+
+    @staticmethod
+    def _unavailable(*args):
+        """Return nothing, the node did not answer yet."""
+        return None
+
+    def get_available(self):
+        """Return the availability, unavailable until discovered."""
+        return False
+
+    def get_categories(self):
+        """Return the cached categories."""
+        return self._record["categories"]
+
+    def get_firmware_version(self):
+        """Return the cached firmware version."""
+        return self._record["firmware_version"]
+
+    def get_node_type(self):
+        """Return the cached node type."""
+        return self._record["node_type"]
+
+    def get_sensors(self):
+        """Return the cached sensors."""
+        return self._record["sensors"]
+
+    def get_switches(self):
+        """Return the cached switches."""
+        return self._record["switches"]
+
+    def subscribe_callback(self, callback, sensor):
+        """Ignore subscriptions, the entity subscribes again once discovered."""
+
+    def unsubscribe_callback(self, callback, sensor):
+        """Ignore unsubscriptions."""
+
+
+class NodeInventory:
+    """Persist the discovered nodes of a stick for a fast startup.
+
+    Entities of known nodes are created from the inventory right away and
+    move over to the node once it is discovered.
+    """
+
+    def __init__(self, hass, stick):
+        """Initialize the inventory."""
+        self.hass = hass
+        self.stick = stick
+        self.nodes = {}
+        self._entities = {}
+        self._store = None
+        self._unique_ids = set()
+
+    async def async_load(self):
+        """Load the inventory of the stick."""
+        self._store = Store(
+            self.hass,
+            INVENTORY_STORAGE_VERSION,
+            f"{INVENTORY_STORAGE_KEY}.{self.stick.get_mac_stick()}",
+        )
+        self.nodes = await self._store.async_load() or {}
+        for mac in self.stick.nodes():
+            self.async_update(mac)
+
+    @callback
+    def async_cached_node(self, mac):
+        """Return the stand-in of an inventory node."""
+        return CachedNode(mac, self.nodes[mac])
+
+    @callback
+    def async_update(self, mac):
+        """Store the properties of a discovered node."""
+        node = self.stick.node(mac)
+        record = {
+            "node_type": node.get_node_type(),
+            "firmware_version": str(node.get_firmware_version()),
+            "categories": list(node.get_categories()),
+            "sensors": list(node.get_sensors()),
+            "switches": list(node.get_switches()),
+        }
+        if self.nodes.get(mac) != record:
+            self.nodes[mac] = record
+            self._store.async_delay_save(self._data_to_save, INVENTORY_SAVE_DELAY)
+
+    @callback
+    def async_retain(self, macs):
+        """Forget the nodes no longer registered at the Circle+."""
+        removed = set(self.nodes) - set(macs)
+        for mac in removed:
+            del self.nodes[mac]
+        if removed:
+            self._store.async_delay_save(self._data_to_save, INVENTORY_SAVE_DELAY)
+
+    @callback
+    def async_node_discovered(self, mac):
+        """Move the entities of the node over from the inventory."""
+        if self.stick.node(mac) is None:
+            return
+        self.async_update(mac)
+        node = self.stick.node(mac)
+        for entity in self._entities.get(mac, {}).values():
+            entity.async_set_node(node)
+
+    @callback
+    def async_add_entity(self, mac, entity):
+        """Track an entity of a node."""
+        self._entities.setdefault(mac, {})[entity.unique_id] = entity
+        self._unique_ids.add(entity.unique_id)
+
+    @callback
+    def async_remove_entity(self, mac, entity):
+        """Stop tracking an entity of a node."""
+        self._entities.get(mac, {}).pop(entity.unique_id, None)
+        self._unique_ids.discard(entity.unique_id)
+
+    @callback
+    def async_has_entity(self, mac, sensor_ids):
+        """Return whether an entity of the node shows one of the sensors."""
+        entities = self._entities.get(mac, {})
+        return any(f"{mac}-{sensor_id}" in entities for sensor_id in sensor_ids)
+
+    @callback
+    def async_unknown(self, entities):
+        """Return the entities which are not created yet."""
+        return [
+            entity for entity in entities if entity.unique_id not in self._unique_ids
+        ]
+
+    @callback
+    def _data_to_save(self):
+        """Return the inventory to store."""
+        return self.nodes
+
+
+class NodeDiscovery:
+    """Discover the registered nodes progressively.
+
+    Nodes are queried with a bounded number of requests in flight and
+    announced to the platforms as soon as they answer. Nodes which do not
+    answer are retried in the background with an increasing delay.
+    """
+
+    def __init__(
+        self, hass, stick, inventory, max_in_flight=DEFAULT_DISCOVERY_IN_FLIGHT
+    ):
+        """Initialize the discovery."""
+        self.hass = hass
+        self.stick = stick
+        self.inventory = inventory
+        self.max_in_flight = max_in_flight
+        self.registered = set()
+        self.retries = 0
+        self.scan_retries = 0
+        self.time_to_first_entity = None
+        self.time_to_all_entities = None
+        self._attempts = {}
+        self._in_flight = None
+        self._retry_listeners = {}
+        self._retry_tasks = set()
+        self._scanned = False
+        self._started = time.monotonic()
+        self._task = None
+        self._unsupported = set()
+        self._with_entities = set()
+
+    @callback
+    def async_start(self, config_entry):
+        """Start discovering the nodes in the background."""
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._task = self.hass.async_create_task(self._async_discover(config_entry))
+
+    @callback
+    def async_stop(self):
+        """Stop discovering and retrying nodes."""
+        if self._task:
+            self._task.cancel()
+        for task in self._retry_tasks:
+            task.cancel()
+        for remove_listener in self._retry_listeners.values():
+            remove_listener()
+        self._retry_listeners = {}
+
+    async def _async_discover(self, config_entry):
+        """Set up the platforms and discover the nodes registered at the Circle+."""
+        await self._async_forward_platforms(config_entry)
+
+        circle_plus_mac = self.stick.circle_plus_mac
+        nodes = await self.stick.async_scan_for_nodes()
+        if nodes is None:
+            # A slow Circle+ does not unregister nodes, keep those of the inventory
+            # while the scan is retried
+            inventory = dict.fromkeys(set(self.inventory.nodes) - {circle_plus_mac})
+            self.registered = {circle_plus_mac, *inventory}
+            self.stick.async_expect_nodes(inventory)
+            await self._async_discover_nodes(inventory)
+            nodes = await self._async_retry_scan()
+
+        self.registered = {circle_plus_mac, *nodes}
+        self.inventory.async_retain(self.registered)
+        self._scanned = True
+        self._async_check_complete()
+        await self._async_discover_nodes(nodes)
+
+        _LOGGER.debug(
+            "Discovered %s out of %s registered nodes, "
+            "%s are retried in the background",
+            str(len(self.stick.nodes())),
+            str(len(self.registered)),
+            str(len(self._retry_listeners)),
+        )
+        # Enable reception of join requests and accept new nodes automatically
+        self.stick.allow_join_requests(True, True)
+
+    async def _async_retry_scan(self):
+        """Scan for the registered nodes again until the Circle+ answers."""
+        attempts = 0
+        while True:
+            delay = min(DISCOVERY_RETRY_MIN * 2 ** attempts, DISCOVERY_RETRY_MAX)
+            _LOGGER.debug("Retry the scan for registered nodes in %s seconds", delay)
+            await asyncio.sleep(delay)
+            attempts += 1
+            self.scan_retries += 1
+            nodes = await self.stick.async_scan_for_nodes()
+            if nodes is not None:
+                return nodes
+
+    async def _async_discover_nodes(self, macs):
+        """Discover the nodes, leaving those already retried in the background."""
+        await asyncio.gather(
+            *[
+                self._async_discover_node(mac)
+                for mac in macs
+                if mac not in self._retry_listeners
+            ]
+        )
+
+    async def _async_forward_platforms(self, config_entry):
+        """Set up the platforms for the nodes discovered so far or in the inventory."""
+        entry_data = self.hass.data[DOMAIN][config_entry.entry_id]
+        nodes = {
+            mac: self.stick.node(mac) or self.inventory.async_cached_node(mac)
+            for mac in {*self.stick.nodes(), *self.inventory.nodes}
+        }
+        for component in PLATFORMS_USB:
+            entry_data[component] = [
+                mac for mac, node in nodes.items() if component in node.get_categories()
+            ]
+        # Platforms listen for new nodes once they are set up
+        await asyncio.gather(
+            *[
+                self.hass.config_entries.async_forward_entry_setup(
+                    config_entry, component
+                )
+                for component in PLATFORMS_USB
+            ]
+        )
+
+    async def _async_discover_node(self, mac):
+        """Discover the node, retry later if it does not answer."""
+        self._retry_listeners.pop(mac, None)
+        async with self._in_flight:
+            discovered = await self.stick.async_discover_node(
+                mac, MESSAGE_TIME_OUT * (MESSAGE_RETRY + 1)
+            )
+        if not discovered:
+            attempts = self._attempts.get(mac, 0)
+            self._attempts[mac] = attempts + 1
+            delay = min(DISCOVERY_RETRY_MIN * 2 ** attempts, DISCOVERY_RETRY_MAX)
+            _LOGGER.debug("Node %s did not answer, retry in %s seconds", mac, delay)
+            self._retry_listeners[mac] = async_call_later(
+                self.hass, delay, partial(self._async_retry, mac)
+            )
+            return
+
+        self._attempts.pop(mac, None)
+        if self.stick.node(mac) is None:
+            self._unsupported.add(mac)
+            self._async_check_complete()
+        self.stick.async_announce_node(mac)
+
+    @callback
+    def _async_retry(self, mac, _now):
+        """Retry the discovery of an unreachable node."""
+        self.retries += 1
+        task = self.hass.async_create_task(self._async_discover_node(mac))
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+
+    @callback
+    def async_entity_added(self, mac):
+        """Track the time until the nodes have their entities."""
+        if mac in self._with_entities:
+            return
+        self._with_entities.add(mac)
+        if self.time_to_first_entity is None:
+            self.time_to_first_entity = time.monotonic() - self._started
+        self._async_check_complete()
+
+    @callback
+    def _async_check_complete(self):
+        """Track the time until every registered node has its entities."""
+        if (
+            self._scanned
+            and self.time_to_all_entities is None
+            and self.registered <= self._with_entities | self._unsupported
+        ):
+            self.time_to_all_entities = time.monotonic() - self._started
+
+    @callback
+    def async_diagnostics(self):
+        """Return the progress and duration of the discovery."""
+        return {
+            "registered": len(self.registered),
+            "discovered": len(self.stick.nodes()),
+            "unreachable": len(self._attempts),
+            "retries": self.retries,
+            "scanned": self._scanned,
+            "scan_retries": self.scan_retries,
+            "max_in_flight": self.max_in_flight,
+            "time_to_first_entity": self.time_to_first_entity,
+            "time_to_all_entities": self.time_to_all_entities,
+        }
+
+
+class EnergyLogBuffer:
+    """Ring buffer of the hourly energy log of a Circle.
+
+    The hours since the epoch and their energy in kWh are kept in arrays
+    indexed by the hour modulo the capacity, the addresses of the complete
+    log pages held by the address modulo the number of pages.
+    """
+
+    def __init__(self, capacity=ENERGY_LOG_HOURS):
+        """Initialize an empty buffer."""
+        self.hours = array("l", [-1]) * capacity
+        self.energy = array("d", [0.0]) * capacity
+        self.pages = array("l", [-1]) * (capacity // ENERGY_LOG_PAGE_HOURS)
+
+    def __len__(self):
+        """Return the number of hours held."""
+        return sum(1 for hour in self.hours if hour >= 0)
+
+    def add(self, hour, energy):
+        """Store the energy of the hour, replacing the oldest hour."""
+        slot = hour % len(self.hours)
+        self.hours[slot] = hour
+        self.energy[slot] = energy
+
+    def get(self, hour):
+        """Return the energy of the hour, None if not held."""
+        slot = hour % len(self.hours)
+        if self.hours[slot] != hour:
+            return None
+        return self.energy[slot]
+
+    def items(self, start=0):
+        """Return the hours from the start with their energy in order."""
+        return sorted(
+            (hour, self.energy[slot])
+            for slot, hour in enumerate(self.hours)
+            if hour >= start
+        )
+
+    def add_page(self, address):
+        """Mark the log page as complete."""
+        self.pages[address % len(self.pages)] = address
+
+    def has_page(self, address):
+        """Return whether the complete log page is held."""
+        return self.pages[address % len(self.pages)] == address
+
+    def total(self, start, end):
+        """Return the energy of the hours held from the start until the end."""
+        return sum(
+            energy
+            for hour, energy in zip(self.hours, self.energy)
+            if start <= hour < end
+        )
+
+    @classmethod
+    def from_record(cls, record, capacity=ENERGY_LOG_HOURS):
+        """Return the buffer restored from storage."""
+        buffer = cls(capacity)
+        for hour, energy in zip(record["hours"], record["energy"]):
+            buffer.add(hour, energy)
+        for address in record["pages"]:
+            buffer.add_page(address)
+        return buffer
+
+    def as_record(self):
+        """Return the buffer to store."""
+        hours = self.items()
+        return {
+            "hours": [hour for hour, _ in hours],
+            "energy": [energy for _, energy in hours],
+            "pages": sorted(address for address in self.pages if address >= 0),
+        }
+
+
+class EnergyLogCollector:
+    """Collect the hourly energy logs of the Circles of a stick.
+
+    The pages of the on-device logs are requested in bulk. Complete pages
+    already held are not requested again, so after downtime only the pages
+    logged since are retrieved. Only the page being written is refreshed.
+    The energy sensors of the previous hour, today and yesterday read the
+    logs held, which survive a restart unlike those of the library.
+    """
+
+    def __init__(self, hass, stick, capacity=ENERGY_LOG_HOURS):
+        """Initialize the collector."""
+        self.hass = hass
+        self.stick = stick
+        self.capacity = capacity
+        self.buffers = {}
+        self.pages_received = 0
+        self.pages_requested = 0
+        self._requested = {}
+        self._store = None
+
+    async def async_load(self):
+        """Load the energy logs of the stick."""
+        self._store = Store(
+            self.hass,
+            ENERGY_LOG_STORAGE_VERSION,
+            f"{ENERGY_LOG_STORAGE_KEY}.{self.stick.get_mac_stick()}",
+        )
+        for mac, record in (await self._store.async_load() or {}).items():
+            self.buffers[mac] = EnergyLogBuffer.from_record(record, self.capacity)
+
+    @callback
+    def async_collect(self, mac, limit=None):
+        """Request the log pages of the node not held yet, return the count.
+
+        With a limit only the latest pages missing are requested, the older
+        ones follow on the next calls.
+        """
+        node = self.stick.node(mac)
+        # pylint: disable=protected-access
+        last = node._last_log_address
+        if last is None or not node.calibration:
+            return 0
+
+        now = time.monotonic()
+        requested = {
+            address: sent
+            for address, sent in self._requested.get(mac, {}).items()
+            if now - sent < ENERGY_LOG_REQUEST_TIMEOUT
+        }
+        buffer = self.buffers.get(mac)
+        held = [] if buffer is None else [page for page in buffer.pages if page >= 0]
+        if held:
+            # Fill the gaps since the oldest page held
+            first = max(min(held), last - len(buffer.pages) + 1)
+        else:
+            first = last - ENERGY_LOG_INITIAL_PAGES + 1
+        addresses = [
+            address
+            for address in range(max(first, 0), last + 1)
+            if address not in requested
+            and (address == last or buffer is None or not buffer.has_page(address))
+        ]
+        if limit is not None:
+            del addresses[:max(len(addresses) - limit, 0)]
+        for address in addresses:
+            requested[address] = now
+            self.stick.send(CirclePowerBufferRequest(node.mac, address))
+        self._requested[mac] = requested
+        self.pages_requested += len(addresses)
+        return len(addresses)
+
+    @callback
+    def async_record(self, message):
+        """Store the hours of a log page received."""
+        mac = message.mac.decode()
+        node = self.stick.node(mac)
+        if node is None or not node.calibration:
+            return
+        address = message.logaddr.value
+        self._requested.get(mac, {}).pop(address, None)
+        buffer = self.buffers.get(mac)
+        if buffer is None:
+            buffer = self.buffers[mac] = EnergyLogBuffer(self.capacity)
+        for index in range(1, ENERGY_LOG_PAGE_HOURS + 1):
+            logged = getattr(message, f"logdate{index}").value
+            if logged is None:
+                continue
+            # Logged in UTC at the end of the hour
+            hour = int(logged.replace(tzinfo=timezone.utc).timestamp()) // 3600 - 1
+            buffer.add(
+                hour, node.pulses_to_kWs(getattr(message, f"pulses{index}").value, 3600)
+            )
+        # pylint: disable=protected-access
+        if node._last_log_address is not None and address < node._last_log_address:
+            buffer.add_page(address)
+        self.pages_received += 1
+        self._store.async_delay_save(self._data_to_save, ENERGY_LOG_SAVE_DELAY)
+        for sensor_id in ENERGY_LOG_SENSORS:
+            node.do_callback(sensor_id)
+
+    @callback
+    def async_energy(self, mac, sensor_id):
+        """Return the energy in kWh the node logged for the sensor, None if not held."""
+        buffer = self.buffers.get(mac)
+        if buffer is None:
+            return None
+        hour = int(time.time()) // 3600
+        today = dt_util.start_of_local_day()
+        midnight = int(today.timestamp()) // 3600
+        if sensor_id == TODAY_ENERGY_SENSOR_ID:
+            return buffer.total(midnight, hour)
+        if sensor_id == YESTERDAY_ENERGY_SENSOR_ID:
+            yesterday = dt_util.start_of_local_day(today.date() - timedelta(days=1))
+            return buffer.total(int(yesterday.timestamp()) // 3600, midnight)
+        return buffer.get(hour - 1)
+
+    @callback
+    def async_diagnostics(self):
+        """Return the number of pages requested and the hours held per node."""
+        return {
+            "pages_requested": self.pages_requested,
+            "pages_received": self.pages_received,
+            "nodes": {
+                mac: {
+                    "hours": len(buffer),
+                    "pages": sum(1 for address in buffer.pages if address >= 0),
+                }
+                for mac, buffer in self.buffers.items()
+            },
+        }
+
+    @callback
+    def _data_to_save(self):
+        """Return the energy logs to store."""
+        return {mac: buffer.as_record() for mac, buffer in self.buffers.items()}
+
+
+class NodePollState:
+    """Recent power usage and polling interval of a Circle."""
+
+    def __init__(self, due, day):
+        """Initialize the state, polling at the floor until known better."""
+        self.clock_day = day
+        self.due = due
+        self.interval = POWER_POLL_MIN
+        self.mean = None
+        self.variance = 0.0
+
+    @callback
+    def async_sample(self, power):
+        """Update the exponentially weighted mean and variance."""
+        if self.mean is None:
+            self.mean = power
+            return
+        delta = power - self.mean
+        self.mean += POWER_VARIANCE_WEIGHT * delta
+        self.variance = (1 - POWER_VARIANCE_WEIGHT) * (
+            self.variance + POWER_VARIANCE_WEIGHT * delta * delta
+        )
+
+
+class PowerPollScheduler:
+    """Poll the power usage of every Circle at a rate of its own.
+
+    Replaces the fixed cadence of the library. A node is polled at the
+    floor while its power usage varies and backs off to the ceiling while it
+    is steady. Nodes without enabled power entities are only polled to keep
+    track of their availability. When the rates exceed the airtime budget of
+    the network, all of them are scaled down alike. The energy log pages are
+    requested within a budget of their own, so a backfill of many Circles
+    does not hold up the power polls.
+    """
+
+    def __init__(
+        self,
+        hass,
+        stick,
+        inventory,
+        budget=DEFAULT_POLL_BUDGET,
+        backfill_budget=DEFAULT_BACKFILL_BUDGET,
+    ):
+        """Initialize the scheduler."""
+        self.hass = hass
+        self.stick = stick
+        self.inventory = inventory
+        self.budget = budget
+        self.backfill_budget = backfill_budget
+        self.backfill_requests = 0
+        self.requests = 0
+        self.scale = 1.0
+        self._backfill = {}
+        self._backfill_tokens = 0.0
+        self._last_tick = None
+        self._nodes = {}
+        self._sent = deque()
+        self._started = None
+        self._tokens = 1.0
+        self._unsub_tick = None
+
+    @callback
+    def async_start(self):
+        """Start polling the discovered nodes."""
+        self._started = self._last_tick = time.monotonic()
+        self._unsub_tick = async_track_time_interval(
+            self.hass, self._async_tick, timedelta(seconds=POWER_POLL_TICK)
+        )
+
+    @callback
+    def async_stop(self):
+        """Stop polling."""
+        if self._unsub_tick:
+            self._unsub_tick()
+            self._unsub_tick = None
+
+    @callback
+    def _async_tick(self, _now=None):
+        """Poll the nodes which are due as far as the budget allows."""
+        now = time.monotonic()
+        # Token bucket, a request costs a token and idle time saves at most one
+        elapsed = now - self._last_tick
+        self._tokens = min(self._tokens + elapsed * self.budget, max(self.budget, 1))
+        self._backfill_tokens = min(
+            self._backfill_tokens + elapsed * self.backfill_budget,
+            max(self.backfill_budget, 1),
+        )
+        self._last_tick = now
+        while self._sent and now - self._sent[0] > POWER_POLL_WINDOW:
+            self._sent.popleft()
+
+        today = datetime.now().day
+        nodes = {}
+        for mac in self.stick.nodes():
+            node = self.stick.node(mac)
+            if node.is_sed():
+                self._async_check_sed(node)
+            elif isinstance(node, PlugwiseCircle):
+                nodes[mac] = self._nodes.get(mac) or NodePollState(now, today)
+        self._nodes = nodes
+        if not nodes:
+            return
+
+        demand = sum(1 / state.interval for state in nodes.values())
+        self.scale = max(1.0, demand / self.budget)
+        for _, mac in sorted(
+            (state.due, mac) for mac, state in nodes.items() if state.due <= now
+        ):
+            if self._tokens < 1:
+                break
+            self._async_poll(mac, self.stick.node(mac), nodes[mac], now, today)
+        self._async_backfill()
+
+    @callback
+    def _async_poll(self, mac, node, state, now, today):
+        """Request the power usage and adapt the interval of the node."""
+        # The power usage of the previous request is the latest sample
+        power = node.get_power_usage()
+        if power is not None and node.get_available():
+            state.async_sample(power)
+        state.interval = self._async_interval(mac, node, state)
+        state.due = now + state.interval * self.scale
+
+        if self._async_request_open(mac):
+            return
+        node.update_power_usage()
+        self._async_count(now)
+        if not node.get_available():
+            return
+
+        # Refresh the node info once per hour, it brings the energy log along
+        if node.last_info_message is not None and node.last_info_message < (
+            datetime.now().replace(minute=0, second=0, microsecond=0)
+        ):
+            node.request_info(partial(self._async_collect, mac))
+            self._async_count(now)
+        if not node.last_log_collected:
+            self._async_collect(mac)
+        if state.clock_day != today:
+            state.clock_day = today
+            node.sync_clock()
+            self._async_count(now)
+
+    @callback
+    def _async_interval(self, mac, node, state):
+        """Return the polling interval of the node."""
+        if not node.get_available() or not self.inventory.async_has_entity(
+            mac, POWER_USAGE_SENSORS
+        ):
+            return POWER_POLL_IDLE
+        if state.variance > POWER_STDDEV_THRESHOLD ** 2:
+            return POWER_POLL_MIN
+        return min(max(state.interval, POWER_POLL_MIN) * 2, POWER_POLL_MAX)
+
+    @callback
+    def _async_request_open(self, mac):
+        """Return whether a power usage request of the node is not answered yet."""
+        for seq_id in list(self.stick.expected_responses):
+            request_set = self.stick.expected_responses.get(seq_id)
+            if (
+                request_set is not None
+                and isinstance(request_set[1], CirclePowerUsageRequest)
+                and request_set[1].mac.decode() == mac
+            ):
+                return True
+        return False
+
+    @callback
+    def _async_collect(self, mac, *_):
+        """Queue the node to request the energy log pages not held yet."""
+        self._backfill[mac] = None
+
+    @callback
+    def _async_backfill(self):
+        """Request the energy log pages of the queued nodes within their budget."""
+        while self._backfill and self._backfill_tokens >= 1:
+            mac = next(iter(self._backfill))
+            del self._backfill[mac]
+            node = self.stick.node(mac)
+            if node is None or not node.get_available():
+                continue
+            limit = int(self._backfill_tokens)
+            count = self.stick.energy_log.async_collect(mac, limit)
+            self._backfill_tokens -= count
+            self.backfill_requests += count
+            if count == limit:
+                # More pages may be missing, the other nodes go first
+                self._backfill[mac] = None
+
+    @callback
+    def _async_count(self, now):
+        """Charge a request sent to the budget."""
+        self._tokens -= 1
+        self.requests += 1
+        self._sent.append(now)
+
+    @callback
+    def _async_check_sed(self, node):
+        """Mark a sleeping node unavailable once it misses its maintenance."""
+        if (
+            node.get_available()
+            and node.last_update is not None
+            and node.last_update
+            < datetime.now() - timedelta(minutes=node.maintenance_interval + 1)
+        ):
+            node.set_available(False)
+
+    @callback
+    def async_diagnostics(self):
+        """Return the effective polling rates and the network utilisation."""
+        elapsed = time.monotonic() - (self._started or 0)
+        window = min(max(elapsed, 1), POWER_POLL_WINDOW)
+        return {
+            "budget": self.budget,
+            "requests": self.requests,
+            "backfill_budget": self.backfill_budget,
+            "backfill_pending": len(self._backfill),
+            "backfill_requests": self.backfill_requests,
+            "scale": round(self.scale, 3),
+            "demand": round(
+                sum(1 / state.interval for state in self._nodes.values())
+                / self.budget,
+                3,
+            ),
+            "utilisation": round(len(self._sent) / window / self.budget, 3),
+            "nodes": {
+                mac: {
+                    "interval": round(state.interval * self.scale, 1),
+                    "rate_per_minute": round(60 / (state.interval * self.scale), 2),
+                    "stddev": round(math.sqrt(state.variance), 2),
+                }
+                for mac, state in self._nodes.items()
+            },
+        }
+
+
+class StickBridge:
+    """Hand the callbacks of the stick thread over to the event loop."""
+
+    def __init__(self, hass):
+        """Initialize the bridge."""
+        self.hass = hass
+        self.drains = 0
+        self.events = 0
+        self.max_batch = 0
+        # Appending and popping are atomic, the stick thread needs no lock
+        self._queue = deque()
+        self._drain_scheduled = False
+        self._stopped = False
+
+    def call(self, target, *args):
+        """Queue a callback to run on the event loop, safe from any thread."""
+        if self._stopped:
+            # The stick thread reports until it is joined, nobody listens anymore
+            return
+        self._queue.append((target, args))
+        if not self._drain_scheduled:
+            self._drain_scheduled = True
+            self.hass.loop.call_soon_threadsafe(self._async_drain)
+
+    @callback
+    def _async_drain(self):
+        """Run all callbacks queued until now in this event loop cycle."""
+        # Reset first, events queued while draining schedule another drain
+        self._drain_scheduled = False
+        batch = 0
+        while self._queue and not self._stopped:
+            target, args = self._queue.popleft()
+            target(*args)
+            batch += 1
+
+        self.drains += 1
+        self.events += batch
+        self.max_batch = max(self.max_batch, batch)
+
+    @callback
+    def async_stop(self):
+        """Drop the callbacks queued and those reported from now on."""
+        self._stopped = True
+        self._queue.clear()
+
+    @callback
+    def async_diagnostics(self):
+        """Return the number of events and event loop hand-overs."""
+        return {
+            "events": self.events,
+            "drains": self.drains,
+            "events_per_drain": round(self.events / self.drains, 2)
+            if self.drains
+            else 0.0,
+            "max_batch": self.max_batch,
+        }
+
+
+class NodeStateWriter:
+    """Coalesce the state writes of the node entities of a stick."""
+
+    def __init__(self, hass, window=DEFAULT_STATE_WRITE_WINDOW):
+        """Initialize the state writer."""
+        self.hass = hass
+        self.window = window
+        self.callbacks = 0
+        self.writes = 0
+        self._dirty = {}
+        self._entities = set()
+        self._flush_scheduled = False
+        self._started = time.monotonic()
+
+    @callback
+    def async_mark_dirty(self, entity):
+        """Mark the entity for the next flush."""
+        self.callbacks += 1
+        self._dirty[entity] = None
+        if self._flush_scheduled:
+            return
+
+        # Flush after the callbacks of this event loop cycle or the window
+        self._flush_scheduled = True
+        if self.window:
+            self.hass.loop.call_later(self.window, self._async_flush)
+        else:
+            self.hass.loop.call_soon(self._async_flush)
+
+    @callback
+    def _async_flush(self):
+        """Write the state of every entity marked dirty once."""
+        dirty = self._dirty
+        self._dirty = {}
+        self._flush_scheduled = False
+
+        for entity in dirty:
+            # Skip entities removed since they were marked
+            if entity in self._entities:
+                entity.async_write_ha_state()
+                self.writes += 1
+
+    @callback
+    def async_add(self, entity):
+        """Start writing the state of an entity."""
+        self._entities.add(entity)
+
+    @callback
+    def async_discard(self, entity):
+        """Stop writing the state of an entity being removed."""
+        self._entities.discard(entity)
+        self._dirty.pop(entity, None)
+
+    @callback
+    def async_diagnostics(self):
+        """Return the number of callbacks and state writes per second."""
+        elapsed = max(time.monotonic() - self._started, 1)
+        return {
+            "window": self.window,
+            "callbacks": self.callbacks,
+            "writes": self.writes,
+            "callbacks_per_second": round(self.callbacks / elapsed, 2),
+            "writes_per_second": round(self.writes / elapsed, 2),
+        }
+
+
+class NodeEntityDescription:
+    """Immutable description of a node entity, compiled from a const.py table."""
+
+    __slots__ = (
+        "key",
+        "device_class",
+        "enabled_default",
+        "icon",
+        "name",
+        "state",
+        "switch",
+        "unit_of_measurement",
+    )
+
+    def __init__(self, key, entity_type):
+        """Initialize the description from the entity type of the table."""
+        for attribute, value in (
+            ("key", key),
+            ("device_class", entity_type[ATTR_DEVICE_CLASS]),
+            ("enabled_default", entity_type[ATTR_ENABLED_DEFAULT]),
+            ("icon", entity_type[ATTR_ICON]),
+            ("name", entity_type[ATTR_NAME]),
+            ("state", entity_type[ATTR_STATE]),
+            ("switch", entity_type.get("switch")),
+            ("unit_of_measurement", entity_type[ATTR_UNIT_OF_MEASUREMENT]),
+        ):
+            object.__setattr__(self, attribute, value)
+
+    def __setattr__(self, name, value):
+        """Refuse changes, the descriptions are shared by all entities."""
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        """Refuse deleting attributes, like changing them."""
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self):
+        """Return the representation of the description."""
+        return f"<{type(self).__name__} {self.key}>"
+
+
+def _compile_descriptions(entity_types):
+    """Return the descriptions of the entity types of a const.py table."""
+    return {
+        key: NodeEntityDescription(key, entity_type)
+        for key, entity_type in entity_types.items()
+    }
+
+
+USB_SENSOR_DESCRIPTIONS = _compile_descriptions(USB_SENSORS)
+USB_BINARY_SENSOR_DESCRIPTIONS = _compile_descriptions(USB_BINARY_SENSORS)
+SWITCH_DESCRIPTIONS = _compile_descriptions(SWITCHES)
+
+
 class NodeEntity(Entity):
-    """Base class for a Plugwise entities."""
+    """Base class for a Plugwise entities.
+
+    The accessors of the node are looked up once per node, not on every
+    state write.
+    """
 
-    def __init__(self, node, mac):
+    def __init__(self, node, mac, description=None):
         """Initialize a Node entity."""
-        self._node = node
+        self.description = description
         self._mac = mac
+        self._bridge = None
+        self._inventory = None
+        self._state_writer = None
         self.node_callbacks = (AVAILABLE_SENSOR_ID,)
+        self._bind_node(node)
+
+    def _bind_node(self, node):
+        """Bind the accessors of the node."""
+        self._node = node
+        self._get_available = getattr(
+            node, USB_SENSOR_DESCRIPTIONS[AVAILABLE_SENSOR_ID].state
+        )
+        if self.description is not None:
+            self._get_state = self._node_accessor(node, self.description)
+
+    def _node_accessor(self, node, description):
+        """Return the accessor of the node, the energy log first if held."""
+        get_state = getattr(node, description.state)
+        energy_log = getattr(getattr(node, "stick", None), "energy_log", None)
+        if description.key not in ENERGY_LOG_SENSORS or energy_log is None:
+            return get_state
+
+        def get_logged_state():
+            energy = energy_log.async_energy(self._mac, description.key)
+            return get_state() if energy is None else energy
+
+        return get_logged_state
 
     async def async_added_to_hass(self):
         """Subscribe to updates."""
+        entry_data = self.hass.data[DOMAIN][self.platform.config_entry.entry_id]
+        self._bridge = entry_data[STICK_BRIDGE]
+        self._state_writer = entry_data[NODE_STATE_WRITER]
+        self._state_writer.async_add(self)
+        self._inventory = entry_data[NODE_INVENTORY]
+        self._inventory.async_add_entity(self._mac, self)
+        entry_data[NODE_DISCOVERY].async_entity_added(self._mac)
         for node_callback in self.node_callbacks:
             self._node.subscribe_callback(self.sensor_update, node_callback)
 
@@ -164,11 +1903,23 @@ class NodeEntity(Entity):
         """Unsubscribe to updates."""
         for node_callback in self.node_callbacks:
             self._node.unsubscribe_callback(self.sensor_update, node_callback)
+        self._state_writer.async_discard(self)
+        self._inventory.async_remove_entity(self._mac, self)
+
+    @callback
+    def async_set_node(self, node):
+        """Move over to the discovered node from its inventory stand-in."""
+        for node_callback in self.node_callbacks:
+            self._node.unsubscribe_callback(self.sensor_update, node_callback)
+        self._bind_node(node)
+        for node_callback in self.node_callbacks:
+            self._node.subscribe_callback(self.sensor_update, node_callback)
+        self._state_writer.async_mark_dirty(self)
 
     @property
     def available(self):
         """Return the availability of this entity."""
-        return getattr(self._node, USB_SENSORS[AVAILABLE_SENSOR_ID][ATTR_STATE])()
+        return self._get_available()
 
     @property
     def device_info(self):
@@ -188,7 +1939,8 @@ class NodeEntity(Entity):
 
     def sensor_update(self, state):
         """Handle status update of Entity."""
-        self.schedule_update_ha_state()
+        # Called on the stick thread, bursts result in one state write
+        self._bridge.call(self._state_writer.async_mark_dirty, self)
 
     @property
     def should_poll(self):
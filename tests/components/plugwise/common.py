@@ -1,9 +1,13 @@
 """Common initialisation for the Plugwise integration."""
 
+import os
+
+import jsonpickle
+
 from homeassistant.components.plugwise.const import DOMAIN
 from homeassistant.core import HomeAssistant
 
-from tests.common import MockConfigEntry
+from tests.common import MockConfigEntry, load_fixture
 from tests.test_util.aiohttp import AiohttpClientMocker
 
 
@@ -11,11 +15,12 @@ async def async_init_integration(
     hass: HomeAssistant,
     aioclient_mock: AiohttpClientMocker,
     skip_setup: bool = False,
+    data: dict = None,
 ):
     """Initialize the Smile integration."""
 
     entry = MockConfigEntry(
-        domain=DOMAIN, data={"host": "1.1.1.1", "password": "test-password"}
+        domain=DOMAIN, data=data or {"host": "1.1.1.1", "password": "test-password"}
     )
     entry.add_to_hass(hass)
 
@@ -24,3 +29,151 @@ async def async_init_integration(
         await hass.async_block_till_done()
 
     return entry
+
+
+def _device_id(kind, index):
+    """Return a deterministic Plugwise device ID."""
+    return f"{kind:08x}{index:024x}"
+
+
+def generate_installation(zones, plugs, valves):
+    """Generate an Adam installation in the format of the fixture environments.
+
+    Every zone has a zone thermostat, the plugs and the valves are spread
+    over the zones. Returns the gateway and heater IDs, the notifications
+    and the results of get_all_devices and get_device_data per device.
+    """
+    home = _device_id(0, 0)
+    gateway_id = _device_id(1, 0)
+    heater_id = _device_id(2, 0)
+    devices = {
+        gateway_id: {
+            "name": "Adam",
+            "model": "Smile Adam",
+            "types": {"temperature", "thermostat", "home"},
+            "class": "gateway",
+            "location": home,
+        },
+        heater_id: {
+            "name": "Adam",
+            "model": "Heater Central",
+            "types": {"temperature", "thermostat", "home"},
+            "class": "heater_central",
+            "location": home,
+        },
+    }
+    device_data = {
+        gateway_id: {"outdoor_temperature": 7.81},
+        heater_id: {
+            "water_temperature": 70.0,
+            "intended_boiler_temperature": 70.0,
+            "modulation_level": 1,
+            "heating_state": True,
+        },
+    }
+    presets = {
+        "home": [20.0, 22.0],
+        "away": [12.0, 25.0],
+        "vacation": [12.0, 28.0],
+        "no_frost": [8.0, 30.0],
+        "asleep": [15.0, 24.0],
+    }
+
+    for zone in range(zones):
+        dev_id = _device_id(3, zone)
+        devices[dev_id] = {
+            "name": f"Zone Thermostat {zone}",
+            "model": "Zone Thermostat",
+            "types": {"thermostat"},
+            "class": "zone_thermostat",
+            "location": _device_id(4, zone),
+        }
+        device_data[dev_id] = {
+            "temperature": 18.0 + zone % 5,
+            "setpoint": 20.0,
+            "battery": 50 + zone % 50,
+            "active_preset": "home",
+            "presets": presets,
+            "schedule_temperature": 20.0,
+            "available_schedules": [f"Schedule {zone}"],
+            "selected_schedule": f"Schedule {zone}",
+            "last_used": f"Schedule {zone}",
+        }
+
+    for valve in range(valves):
+        dev_id = _device_id(5, valve)
+        devices[dev_id] = {
+            "name": f"Thermostatic Radiator Valve {valve}",
+            "model": "Thermostatic Radiator Valve",
+            "types": {"thermostat"},
+            "class": "thermo_sensor",
+            "location": _device_id(4, valve % max(zones, 1)),
+        }
+        device_data[dev_id] = {
+            "temperature": 18.0 + valve % 5,
+            "setpoint": 20.0,
+            "battery": 50 + valve % 50,
+            "temperature_difference": round(0.1 * (valve % 10), 1),
+            "valve_position": float(valve % 100),
+        }
+
+    plug_classes = ("vcr", "router", "settop", "game_console")
+    for plug in range(plugs):
+        dev_id = _device_id(6, plug)
+        devices[dev_id] = {
+            "name": f"Plug {plug}",
+            "model": "Plug",
+            "types": {"plug", "power"},
+            "class": plug_classes[plug % len(plug_classes)],
+            "location": _device_id(4, plug % max(zones, 1)),
+        }
+        device_data[dev_id] = {
+            "electricity_consumed": 10.0 + plug % 90,
+            "electricity_consumed_interval": 1.0 + plug % 9,
+            "electricity_produced": 0.0,
+            "electricity_produced_interval": 0.0,
+            "relay": True,
+        }
+
+    return {
+        "gateway_id": gateway_id,
+        "heater_id": heater_id,
+        "notifications": {},
+        "get_all_devices": devices,
+        "get_device_data": device_data,
+    }
+
+
+def load_installation(environment):
+    """Load a fixture environment in the format of the generated installations."""
+
+    def read(call):
+        return jsonpickle.decode(load_fixture(f"plugwise/{environment}/{call}.json"))
+
+    devices = read("get_all_devices")
+    classes = {details["class"]: dev_id for dev_id, details in devices.items()}
+    return {
+        "gateway_id": classes.get("gateway"),
+        "heater_id": classes.get("heater_central"),
+        "notifications": read("notifications"),
+        "get_all_devices": devices,
+        "get_device_data": {
+            dev_id: read(f"get_device_data/{dev_id}") for dev_id in devices
+        },
+    }
+
+
+def write_installation(path, installation):
+    """Write a generated installation as a fixture environment directory."""
+    os.makedirs(os.path.join(path, "get_device_data"), exist_ok=True)
+    files = {
+        "get_all_devices": installation["get_all_devices"],
+        "notifications": installation["notifications"],
+        **{
+            f"get_device_data/{dev_id}": data
+            for dev_id, data in installation["get_device_data"].items()
+        },
+    }
+    for name, content in files.items():
+        with open(os.path.join(path, f"{name}.json"), "w") as fixture:
+            fixture.write(jsonpickle.encode(content))
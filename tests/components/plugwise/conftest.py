@@ -14,6 +14,9 @@ from plugwise.exceptions import (
 import pytest
 
 from tests.common import load_fixture
+from tests.components.plugwise.common import generate_installation
+from tests.components.plugwise.simulator import SmileSimulator
+from tests.components.plugwise.stick_emulator import StickEmulator
 from tests.test_util.aiohttp import AiohttpClientMocker
 
 
@@ -35,18 +38,30 @@ def mock_smile():
         yield smile_mock.return_value
 
 
+@pytest.fixture(name="mock_smile_session")
+def mock_smile_session(aioclient_mock: AiohttpClientMocker):
+    """Route the dedicated Smile sessions through the aiohttp client mocker."""
+    with patch(
+        "homeassistant.components.plugwise.gateway.async_create_smile_session",
+        side_effect=lambda hass, *args, **kwargs: aioclient_mock.create_session(
+            hass.loop
+        ),
+    ):
+        yield aioclient_mock
+
+
 @pytest.fixture(name="mock_smile_unauth")
-def mock_smile_unauth(aioclient_mock: AiohttpClientMocker) -> None:
+def mock_smile_unauth(mock_smile_session: AiohttpClientMocker) -> None:
     """Mock the Plugwise Smile unauthorized for Home Assistant."""
-    aioclient_mock.get(re.compile(".*"), status=401)
-    aioclient_mock.put(re.compile(".*"), status=401)
+    mock_smile_session.get(re.compile(".*"), status=401)
+    mock_smile_session.put(re.compile(".*"), status=401)
 
 
 @pytest.fixture(name="mock_smile_error")
-def mock_smile_error(aioclient_mock: AiohttpClientMocker) -> None:
+def mock_smile_error(mock_smile_session: AiohttpClientMocker) -> None:
     """Mock the Plugwise Smile server failure for Home Assistant."""
-    aioclient_mock.get(re.compile(".*"), status=500)
-    aioclient_mock.put(re.compile(".*"), status=500)
+    mock_smile_session.get(re.compile(".*"), status=500)
+    mock_smile_session.put(re.compile(".*"), status=500)
 
 
 @pytest.fixture(name="mock_smile_notconnect")
@@ -79,6 +94,7 @@ def mock_smile_adam():
         smile_mock.return_value.smile_version = "3.0.15"
         smile_mock.return_value.smile_type = "thermostat"
         smile_mock.return_value.smile_hostname = "smile98765"
+        smile_mock.return_value.smile_name = "Adam"
 
         smile_mock.return_value.notifications = _read_json(chosen_env, "notifications")
 
@@ -124,6 +140,7 @@ def mock_smile_anna():
         smile_mock.return_value.smile_version = "4.0.15"
         smile_mock.return_value.smile_type = "thermostat"
         smile_mock.return_value.smile_hostname = "smile98765"
+        smile_mock.return_value.smile_name = "Anna"
 
         smile_mock.return_value.notifications = _read_json(chosen_env, "notifications")
 
@@ -169,6 +186,7 @@ def mock_smile_p1():
         smile_mock.return_value.smile_version = "3.3.9"
         smile_mock.return_value.smile_type = "power"
         smile_mock.return_value.smile_hostname = "smile98765"
+        smile_mock.return_value.smile_name = "P1"
 
         smile_mock.return_value.notifications = _read_json(chosen_env, "notifications")
 
@@ -205,6 +223,7 @@ def mock_stretch():
         smile_mock.return_value.smile_version = "3.1.11"
         smile_mock.return_value.smile_type = "stretch"
         smile_mock.return_value.smile_hostname = "stretch98765"
+        smile_mock.return_value.smile_name = "Stretch"
 
         smile_mock.return_value.connect.side_effect = AsyncMock(return_value=True)
         smile_mock.return_value.full_update_device.side_effect = AsyncMock(
@@ -222,3 +241,77 @@ def mock_stretch():
         )
 
         yield smile_mock.return_value
+
+
+@pytest.fixture(name="mock_smile_synthetic")
+def mock_smile_synthetic():
+    """Create a Mock Adam of a generated installation, sized by the test."""
+    with patch("homeassistant.components.plugwise.gateway.Smile") as smile_mock:
+        smile_mock.InvalidAuthentication = InvalidAuthentication
+        smile_mock.ConnectionFailedError = ConnectionFailedError
+        smile_mock.XMLDataMissingError = XMLDataMissingError
+
+        smile_mock.return_value.smile_version = "3.0.15"
+        smile_mock.return_value.smile_type = "thermostat"
+        smile_mock.return_value.smile_hostname = "smile98765"
+        smile_mock.return_value.smile_name = "Adam"
+
+        smile_mock.return_value.connect.side_effect = AsyncMock(return_value=True)
+        smile_mock.return_value.full_update_device.side_effect = AsyncMock(
+            return_value=True
+        )
+        smile_mock.return_value.single_master_thermostat.side_effect = Mock(
+            return_value=False
+        )
+
+        def generate(zones, plugs, valves):
+            """Set up the mock for an installation of the size, return it."""
+            installation = generate_installation(zones, plugs, valves)
+            device_data = installation["get_device_data"]
+            smile_mock.return_value.gateway_id = installation["gateway_id"]
+            smile_mock.return_value.heater_id = installation["heater_id"]
+            smile_mock.return_value.notifications = installation["notifications"]
+            smile_mock.return_value.get_all_devices.return_value = installation[
+                "get_all_devices"
+            ]
+            smile_mock.return_value.get_device_data.side_effect = lambda dev_id: dict(
+                device_data[dev_id]
+            )
+            return installation
+
+        yield generate
+
+
+@pytest.fixture(name="smile_simulator")
+async def smile_simulator():
+    """Start simulated Smiles serving an installation, stopped after the test."""
+    simulators = []
+
+    async def start(installation, **kwargs):
+        """Start a simulator of the installation, return it."""
+        simulator = SmileSimulator(installation, **kwargs)
+        await simulator.async_start()
+        simulators.append(simulator)
+        return simulator
+
+    yield start
+
+    for simulator in simulators:
+        await simulator.async_close()
+
+
+@pytest.fixture(name="stick_emulator")
+def stick_emulator(hass):
+    """Start emulated USB-sticks behind a pty, closed after the test."""
+    emulators = []
+
+    def start(**kwargs):
+        """Start an emulated stick, return it."""
+        emulator = StickEmulator(hass.loop, **kwargs)
+        emulators.append(emulator)
+        return emulator
+
+    yield start
+
+    for emulator in emulators:
+        emulator.close()
@@ -0,0 +1,509 @@
+"""In-process simulator of a Smile or Stretch for the Plugwise tests.
+
+The simulator serves the domain objects, appliances and locations XML of an
+installation in the format of the fixture environments, so the library and
+the integration can be exercised over real HTTP requests. Latency, jitter and
+errors are injected per request.
+"""
+
+import asyncio
+from collections import Counter
+import hashlib
+import random
+import re
+from xml.etree import ElementTree
+from xml.etree.ElementTree import Element, SubElement
+
+from aiohttp import BasicAuth, web
+from aiohttp.test_utils import TestServer
+from plugwise.constants import (
+    ATTR_NAME,
+    ATTR_UNIT_OF_MEASUREMENT,
+    DEFAULT_USERNAME,
+    DEVICE_MEASUREMENTS,
+    HOME_MEASUREMENTS,
+    PERCENTAGE,
+    SWITCH_GROUP_TYPES,
+)
+
+# The vendor model and firmware announced for the gateway models
+GATEWAY_FIRMWARE = {
+    "Smile Adam": ("smile_open_therm", "3.0.15"),
+    "Smile Anna": ("smile_thermo", "4.0.15"),
+    "Smile P1": ("smile", "3.3.9"),
+}
+# Installations without a gateway device are served as a legacy Stretch
+STRETCH_FIRMWARE = ("stretch", "3.1.11")
+
+# The measurement of the appliance logs a device data key is read from
+LOG_MEASUREMENTS = {
+    attrs.get(ATTR_NAME, measurement): measurement
+    for measurement, attrs in DEVICE_MEASUREMENTS.items()
+}
+# Device data keys the library reads from the domain objects of the appliance
+OBJECT_MEASUREMENTS = ("illuminance",)
+# The P1 data keys, read from the logs of the home location
+HOME_KEY = re.compile(
+    r"(?P<measurement>[a-z_]+?)_(?:(?P<peak>off_peak|peak)_)?"
+    r"(?P<log>point|cumulative|interval)$"
+)
+TARIFFS = {"peak": "nl_peak", "off_peak": "nl_offpeak", None: None}
+
+PRESET_TAG = "zone_setpoint_and_state_based_on_preset"
+SCHEDULE_TAG = "zone_preset_based_on_time_and_presence_with_override"
+# Selected schedules are the last modified ones
+MODIFIED_DATES = ("2020-01-01T00:00:00+01:00", "2020-10-01T00:00:00+02:00")
+# The selected schedule keeps its temperature around the clock, in two halves
+# of every day as the library reads a period within a single day
+SCHEDULE_PERIODS = [
+    f"[{day} {start},{day} {end})"
+    for day in ("mo", "tu", "we", "th", "fr", "sa", "su")
+    for start, end in (("00:00", "12:00"), ("12:00", "00:00"))
+]
+
+ERROR_BODY = b"<error><message>Simulated error</message></error>"
+# The object IDs of the commands, e.g. /core/appliances;id=<id>/relay;id=<id>
+COMMAND_ID = re.compile(r";id=([0-9a-f]+)")
+
+
+def _object_id(*parts):
+    """Return a deterministic ID for a simulated object."""
+    key = "-".join(map(str, parts)).encode()
+    return hashlib.blake2b(key, digest_size=16).hexdigest()
+
+
+def _format(measurement, value):
+    """Return the value as the Smile logs it, the inverse of format_measure."""
+    if isinstance(value, bool):
+        return "on" if value else "off"
+    unit = DEVICE_MEASUREMENTS.get(measurement, {}).get(ATTR_UNIT_OF_MEASUREMENT)
+    if unit == PERCENTAGE:
+        return str(value / 100)
+    return str(value)
+
+
+def _add_log(logs, tag, measurement, values, meter=None):
+    """Add a measurement log with a value per tariff."""
+    log = SubElement(logs, tag, id=_object_id(tag, measurement, len(logs)))
+    SubElement(log, "type").text = measurement
+    if meter is not None:
+        SubElement(log, "electricity_point_meter", id=meter)
+    period = SubElement(log, "period")
+    for tariff, value in values:
+        element = SubElement(period, "measurement")
+        if tariff is not None:
+            element.set("tariff", tariff)
+        element.text = value
+
+
+class SmileSimulator:
+    """Serve an installation like a Smile or Stretch on the local host.
+
+    ``latency`` and ``jitter`` delay every response by a uniformly
+    distributed number of seconds, ``error_rate`` is the fraction of
+    requests answered with ``error_status``. All can be changed while
+    the simulator runs. Commands sent to the simulator change the served
+    device data.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+        self,
+        installation,
+        smile_id="abcdefgh",
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        error_status=500,
+        validators=False,
+        seed=None,
+    ):
+        """Initialise the simulator."""
+        self.installation = installation
+        self.smile_id = smile_id
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.validators = validators
+        self.requests = Counter()
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        self._random = random.Random(seed)
+        self._bodies = {}
+        self._server = None
+
+        devices = installation["get_all_devices"]
+        gateway = devices.get(installation["gateway_id"])
+        self.legacy = gateway is None or gateway["model"] not in GATEWAY_FIRMWARE
+        if self.legacy:
+            self.gateway_id = installation["gateway_id"] or _object_id("gateway")
+            self.home_id = None
+            self.vendor_model, self.firmware = STRETCH_FIRMWARE
+            self.hostname = "stretch98765"
+        else:
+            self.gateway_id = installation["gateway_id"]
+            self.home_id = gateway["location"]
+            self.vendor_model, self.firmware = GATEWAY_FIRMWARE[gateway["model"]]
+            self.hostname = "smile98765"
+
+        self._routes = {
+            "/core/appliances": self._render_appliances,
+            "/core/domain_objects": self._render_domain_objects,
+            "/core/locations": self._render_locations,
+            "/system": self._render_system,
+        }
+
+    @property
+    def host(self):
+        """Return the host the simulator listens on."""
+        return self._server.host
+
+    @property
+    def port(self):
+        """Return the port the simulator listens on."""
+        return self._server.port
+
+    @property
+    def entry_data(self):
+        """Return the config entry data to connect to the simulator."""
+        return {
+            "host": self.host,
+            "port": self.port,
+            "username": DEFAULT_USERNAME,
+            "password": self.smile_id,
+        }
+
+    async def async_start(self):
+        """Start serving the installation."""
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self._async_handle)
+        self._server = TestServer(app, host="127.0.0.1")
+        await self._server.start_server()
+
+    async def async_close(self):
+        """Stop serving the installation."""
+        if self._server is not None:
+            await self._server.close()
+            self._server = None
+
+    def update_device(self, dev_id, **values):
+        """Change the data served for a device."""
+        self.installation["get_device_data"][dev_id].update(values)
+        self._bodies.clear()
+
+    def _devices_at(self, loc_id):
+        """Return the IDs of the devices at the location."""
+        return [
+            dev_id
+            for dev_id, details in self.installation["get_all_devices"].items()
+            if details["location"] == loc_id
+        ]
+
+    async def _async_handle(self, request):
+        """Answer a request after the simulated latency."""
+        path = COMMAND_ID.sub("", request.path)
+        self.requests[request.method, path] += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+            await asyncio.sleep(max(0.0, delay))
+
+            auth = BasicAuth.decode(request.headers.get("Authorization", "Basic Og=="))
+            if auth.login != DEFAULT_USERNAME or auth.password != self.smile_id:
+                return web.Response(status=401)
+
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors += 1
+                return web.Response(status=self.error_status, body=ERROR_BODY)
+
+            if request.method == "PUT":
+                body = await request.text()
+                if not self._apply_command(request.path, body):
+                    return web.Response(status=404, body=ERROR_BODY)
+                self._bodies.clear()
+                return web.Response(status=202)
+
+            if request.method != "GET" or path not in self._routes:
+                return web.Response(status=404, body=ERROR_BODY)
+            return self._respond(request, path)
+        finally:
+            self.in_flight -= 1
+
+    def _respond(self, request, path):
+        """Return the content of the path, conditionally when validators are on."""
+        if path not in self._bodies:
+            root = self._routes[path]()
+            self._bodies[path] = ElementTree.tostring(root, encoding="utf-8")
+        body = self._bodies[path]
+        if not self.validators:
+            return web.Response(body=body, content_type="application/xml")
+
+        etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(
+            body=body, content_type="application/xml", headers={"ETag": etag}
+        )
+
+    def _apply_command(self, path, body):
+        """Change the device data as the command does, return whether it is known."""
+        ids = COMMAND_ID.findall(path)
+        command = ElementTree.fromstring(body)
+        device_data = self.installation["get_device_data"]
+        if path.startswith("/core/appliances") and ids[0] in device_data:
+            device_data[ids[0]]["relay"] = command.findtext("state") == "on"
+            return True
+
+        if path.startswith("/core/locations") and ids:
+            setpoint = command.findtext(".//setpoint")
+            preset = command.findtext(".//preset")
+            for dev_id in self._devices_at(ids[0]):
+                if setpoint is not None and "setpoint" in device_data[dev_id]:
+                    device_data[dev_id]["setpoint"] = float(setpoint)
+                if preset is not None and "presets" in device_data[dev_id]:
+                    device_data[dev_id]["active_preset"] = preset
+            return True
+
+        if path.startswith("/core/rules") and ids:
+            name = command.findtext(".//name")
+            active = command.findtext(".//active").lower() == "true"
+            for data in device_data.values():
+                if name in data.get("available_schedules", ()):
+                    data["selected_schedule"] = name if active else None
+                    if active:
+                        data["last_used"] = name
+            return True
+
+        return False
+
+    def _add_appliance(self, parent, dev_id, details, groups):
+        """Add the appliance of a device with its logs and functionalities."""
+        data = self.installation["get_device_data"][dev_id]
+        appliance_class = details["class"]
+        if appliance_class == "thermo_sensor":
+            # A thermostat demoted by the library for sharing its zone
+            appliance_class = "thermostatic_radiator_valve"
+
+        appliance = SubElement(parent, "appliance", id=dev_id)
+        SubElement(appliance, "name").text = details["name"]
+        SubElement(appliance, "description").text = details["model"]
+        SubElement(appliance, "type").text = appliance_class
+        if appliance_class not in ("gateway", "heater_central") and not self.legacy:
+            SubElement(appliance, "location", id=details["location"])
+        if dev_id in groups:
+            SubElement(SubElement(appliance, "groups"), "group", id=groups[dev_id])
+
+        functionalities = SubElement(appliance, "actuator_functionalities")
+        if "relay" in data:
+            SubElement(
+                functionalities, "relay_functionality", id=_object_id("relay", dev_id)
+            )
+        elif "setpoint" in data:
+            SubElement(
+                functionalities,
+                "thermostat_functionality",
+                id=_object_id("thermostat", dev_id),
+            )
+
+        logs = SubElement(appliance, "logs")
+        meter = _object_id("meter", dev_id)
+        for key, value in data.items():
+            if value is None:
+                continue
+            if key in OBJECT_MEASUREMENTS:
+                _add_log(logs, "point_log", key, [(None, str(value))])
+            elif key in LOG_MEASUREMENTS:
+                measurement = LOG_MEASUREMENTS[key]
+                _add_log(
+                    logs,
+                    "point_log",
+                    measurement,
+                    [(None, _format(measurement, value))],
+                    meter if measurement in HOME_MEASUREMENTS else None,
+                )
+            elif key.endswith("_interval") and key[:-9] in LOG_MEASUREMENTS:
+                _add_log(logs, "interval_log", key[:-9], [(None, str(value))])
+
+    def _add_home_logs(self, location):
+        """Add the logs of the gateway data the library reads from the home."""
+        logs = SubElement(location, "logs")
+        meter = _object_id("meter", self.home_id)
+        values = {}
+        for key, value in self.installation["get_device_data"][self.gateway_id].items():
+            match = HOME_KEY.match(key)
+            if key == "outdoor_temperature":
+                _add_log(logs, "point_log", key, [(None, str(value))])
+            elif match and match["measurement"] in HOME_MEASUREMENTS:
+                log = (f"{match['log']}_log", match["measurement"])
+                values.setdefault(log, []).append((TARIFFS[match["peak"]], str(value)))
+
+        for (tag, measurement), tariffs in values.items():
+            _add_log(logs, tag, measurement, tariffs, meter)
+
+    def _add_rules(self, parent, loc_id, data):
+        """Add the preset and schedule rules of the thermostat of a location."""
+        context = Element("contexts")
+        zone = SubElement(SubElement(context, "context"), "zone")
+        SubElement(zone, "location", id=loc_id)
+
+        rule = SubElement(parent, "rule", id=_object_id("presets", loc_id))
+        SubElement(rule, "name").text = "Thermostat presets"
+        SubElement(rule, "active").text = "true"
+        SubElement(rule, "template", id=_object_id(PRESET_TAG), tag=PRESET_TAG)
+        directives = SubElement(rule, "directives")
+        for preset, (heating, cooling) in data.get("presets", {}).items():
+            directive = SubElement(directives, "directive", preset=preset)
+            if cooling:
+                SubElement(
+                    directive,
+                    "then",
+                    heating_setpoint=str(heating),
+                    cooling_setpoint=str(cooling),
+                )
+            else:
+                SubElement(directive, "then", setpoint=str(heating))
+        rule.append(context)
+
+        for name in data.get("available_schedules", ()):
+            rule = SubElement(parent, "rule", id=_object_id("schedule", loc_id, name))
+            SubElement(rule, "name").text = name
+            SubElement(rule, "active").text = str(
+                name == data.get("selected_schedule")
+            ).lower()
+            SubElement(rule, "modified_date").text = MODIFIED_DATES[
+                name == data.get("last_used")
+            ]
+            SubElement(rule, "template", id=_object_id(SCHEDULE_TAG), tag=SCHEDULE_TAG)
+            directives = SubElement(rule, "directives")
+            setpoint = data.get("schedule_temperature")
+            if name == data.get("selected_schedule") and setpoint is not None:
+                for period in SCHEDULE_PERIODS:
+                    directive = SubElement(directives, "directive", time=period)
+                    SubElement(directive, "then", setpoint=str(setpoint))
+            rule.append(context)
+
+    def _switch_groups(self):
+        """Return the switch groups and the group of each member."""
+        groups = {
+            dev_id: details
+            for dev_id, details in self.installation["get_all_devices"].items()
+            if details["class"] in SWITCH_GROUP_TYPES
+        }
+        members = {
+            member: group_id
+            for group_id, details in groups.items()
+            for member in details.get("members", ())
+        }
+        return groups, members
+
+    def _locations(self):
+        """Return the locations with their devices, the home first."""
+        locations = {self.home_id: []}
+        for dev_id, details in self.installation["get_all_devices"].items():
+            if details["class"] not in SWITCH_GROUP_TYPES:
+                locations.setdefault(details["location"], []).append(dev_id)
+        return locations
+
+    def _render_appliances(self):
+        """Return the appliances."""
+        root = Element("appliances")
+        groups, members = self._switch_groups()
+        for dev_id, details in self.installation["get_all_devices"].items():
+            if dev_id not in groups:
+                self._add_appliance(root, dev_id, details, members)
+        return root
+
+    def _render_locations(self, root=None):
+        """Return the locations, or add them to the domain objects."""
+        if root is None:
+            root = Element("locations")
+        if self.legacy:
+            return root
+
+        device_data = self.installation["get_device_data"]
+        for loc_id, dev_ids in self._locations().items():
+            location = SubElement(root, "location", id=loc_id)
+            home = loc_id == self.home_id
+            SubElement(location, "name").text = "Home" if home else f"Zone {loc_id[:6]}"
+            SubElement(location, "type").text = "building" if home else "area"
+            appliances = SubElement(location, "appliances")
+            for dev_id in dev_ids:
+                SubElement(appliances, "appliance", id=dev_id)
+
+            thermostats = [
+                dev_id for dev_id in dev_ids if "presets" in device_data[dev_id]
+            ]
+            if thermostats:
+                functionalities = SubElement(location, "actuator_functionalities")
+                SubElement(
+                    functionalities,
+                    "thermostat_functionality",
+                    id=_object_id("thermostat", loc_id),
+                )
+                preset = device_data[thermostats[0]].get("active_preset")
+                if preset is not None:
+                    SubElement(location, "preset").text = preset
+            if home:
+                self._add_home_logs(location)
+        return root
+
+    def _render_domain_objects(self):
+        """Return the domain objects."""
+        root = Element("domain_objects")
+        if not self.legacy:
+            gateway = SubElement(
+                root, "gateway", id=_object_id("gateway", self.gateway_id)
+            )
+            SubElement(gateway, "hostname").text = self.hostname
+            SubElement(gateway, "vendor_model").text = self.vendor_model
+            SubElement(gateway, "firmware_version").text = self.firmware
+
+        module = SubElement(root, "module", id=_object_id("module", self.gateway_id))
+        SubElement(module, "vendor_name").text = "Plugwise"
+        protocols = SubElement(module, "protocols")
+        if self.legacy:
+            router = SubElement(protocols, "network_router")
+            SubElement(router, "network", id=self.gateway_id)
+
+        groups, members = self._switch_groups()
+        device_data = self.installation["get_device_data"]
+        for dev_id, details in self.installation["get_all_devices"].items():
+            if dev_id not in groups:
+                self._add_appliance(root, dev_id, details, members)
+        self._render_locations(root)
+
+        if not self.legacy:
+            for loc_id, dev_ids in self._locations().items():
+                for dev_id in dev_ids:
+                    if "presets" in device_data[dev_id]:
+                        self._add_rules(root, loc_id, device_data[dev_id])
+                        break
+
+        for group_id, details in groups.items():
+            group = SubElement(root, "group", id=group_id)
+            SubElement(group, "name").text = details["name"]
+            SubElement(group, "type").text = details["class"]
+            appliances = SubElement(group, "appliances")
+            for member in details.get("members", ()):
+                SubElement(appliances, "appliance", id=member)
+
+        for msg_id, messages in self.installation["notifications"].items():
+            for msg_type, message in messages.items():
+                notification = SubElement(root, "notification", id=msg_id)
+                SubElement(notification, "type").text = msg_type
+                SubElement(notification, "message").text = message
+        return root
+
+    def _render_system(self):
+        """Return the system status of a legacy Stretch."""
+        root = Element("system")
+        gateway = SubElement(root, "gateway")
+        SubElement(gateway, "firmware").text = self.firmware
+        SubElement(gateway, "product").text = self.vendor_model
+        SubElement(gateway, "hostname").text = self.hostname
+        return root
@@ -0,0 +1,352 @@
+"""Emulated Plugwise USB-stick and zigbee network for the Plugwise tests.
+
+The emulator answers the requests written to the master side of a
+pseudo-terminal like a stick with a Circle+ and a network of Circles, Scans
+and Senses behind it, so the integration connects to it as to a serial port.
+Latency, jitter and packet loss are injected per node response.
+"""
+
+from datetime import datetime, timedelta, timezone
+import os
+import random
+import tty
+
+from plugwise.constants import (
+    ACK_OFF,
+    ACK_ON,
+    ACK_SUCCESS,
+    ACK_TIMEOUT,
+    LOGADDR_OFFSET,
+    MESSAGE_FOOTER,
+    MESSAGE_HEADER,
+    NODE_TYPE_CIRCLE,
+    NODE_TYPE_CIRCLE_PLUS,
+    NODE_TYPE_SCAN,
+    NODE_TYPE_SENSE,
+    NODE_TYPE_SWITCH,
+    SED_AWAKE_MAINTENANCE,
+    SENSE_HUMIDITY_MULTIPLIER,
+    SENSE_HUMIDITY_OFFSET,
+    SENSE_TEMPERATURE_MULTIPLIER,
+    SENSE_TEMPERATURE_OFFSET,
+)
+from plugwise.util import crc_fun
+
+STICK_MAC = b"000D6F0001234567"
+CIRCLE_PLUS_MAC = b"000D6F0000ABCDEF"
+# The Circle+ registers up to 64 nodes, the library scans every address
+CIRCLE_PLUS_ADDRESSES = 64
+# Battery powered nodes only answer while they are awake
+SED_TYPES = (NODE_TYPE_SCAN, NODE_TYPE_SENSE, NODE_TYPE_SWITCH)
+
+# Fixed sequence IDs of the messages sent by the nodes unsolicited
+SEQ_ID_AWAKE = b"FFFE"
+SEQ_ID_SWITCH_GROUP = b"FFFF"
+# Hardware, firmware and calibration reported by every node
+HARDWARE_VERSION = b"000000070140"
+FIRMWARE_VERSION = b"4E0843A9"
+CALIBRATION = b"3F800000" + b"00000000" * 3
+# The energy log of the Circles starts at this hour
+LOG_START = datetime(2020, 11, 1)
+
+
+def _frame(body):
+    """Return a message as sent by the stick."""
+    return MESSAGE_HEADER + body + b"%04X" % crc_fun(body) + MESSAGE_FOOTER
+
+
+def _log_date(logged):
+    """Return the hour of an energy log in the format of the Circles."""
+    minutes = ((logged.day - 1) * 24 + logged.hour) * 60 + logged.minute
+    return b"%02X%02X%04X" % (logged.year - 2000, logged.month, minutes)
+
+
+class EmulatedNode:
+    """A node in the emulated network."""
+
+    def __init__(self, mac, node_type=NODE_TYPE_CIRCLE, pulses=0, relay=True):
+        """Initialize the node, battery powered nodes start asleep."""
+        self.mac = mac
+        self.node_type = node_type
+        self.pulses = pulses
+        self.relay = relay
+        self.awake = node_type not in SED_TYPES
+
+
+def generate_network(circles, scans=0, senses=0):
+    """Return a network of Circles, Scans and Senses in the order they registered."""
+    node_types = (
+        [NODE_TYPE_CIRCLE] * circles
+        + [NODE_TYPE_SCAN] * scans
+        + [NODE_TYPE_SENSE] * senses
+    )
+    return [
+        EmulatedNode(b"000D6F00%08X" % index, node_type, pulses=index % 100)
+        for index, node_type in enumerate(node_types, 1)
+    ]
+
+
+class StickEmulator:
+    """Answer the requests written to the master side of a pty.
+
+    ``nodes`` are registered at the Circle+ in order, MAC addresses are
+    emulated as Circles. The stick acknowledges every request with ``ack``
+    right away, the nodes answer after ``latency`` seconds, give or take a
+    uniformly distributed ``jitter``. A ``loss`` fraction of the answers is
+    lost, like the answers of ``unreachable`` and sleeping nodes. With a
+    ``timeout`` the stick reports a lost answer after so many seconds.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+        self,
+        loop,
+        ack=ACK_SUCCESS,
+        nodes=(),
+        unreachable=(),
+        latency=0.0,
+        jitter=0.0,
+        loss=0.0,
+        timeout=None,
+        seed=None,
+    ):
+        """Open the pty and answer requests on the event loop."""
+        self.loop = loop
+        self.ack = ack
+        self.nodes = [
+            node if isinstance(node, EmulatedNode) else EmulatedNode(node)
+            for node in nodes
+        ]
+        self.network = {node.mac: node for node in self.nodes}
+        self.network[CIRCLE_PLUS_MAC] = EmulatedNode(
+            CIRCLE_PLUS_MAC, NODE_TYPE_CIRCLE_PLUS
+        )
+        self.unreachable = set(unreachable)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.timeout = timeout
+        self.requests = []
+        self.lost = 0
+
+        self._random = random.Random(seed)
+        self._buffer = b""
+        self._output = bytearray()
+        self._seq_id = 0
+        self._closed = False
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        os.set_blocking(self.master, False)
+        loop.add_reader(self.master, self._read)
+
+    @property
+    def port(self):
+        """Return the port to connect to."""
+        return os.ttyname(self.slave)
+
+    def close(self):
+        """Close the pty, answers still on their way are dropped."""
+        self._closed = True
+        self.loop.remove_reader(self.master)
+        if self._output:
+            self.loop.remove_writer(self.master)
+        os.close(self.master)
+        os.close(self.slave)
+
+    def wake(self, mac, awake_type=SED_AWAKE_MAINTENANCE):
+        """Wake a battery powered node, it answers until it sleeps again."""
+        self.network[mac].awake = True
+        self._write(_frame(b"004F" + SEQ_ID_AWAKE + mac + b"%02X" % awake_type))
+
+    def sleep(self, mac):
+        """Put a battery powered node to sleep."""
+        self.network[mac].awake = False
+
+    @staticmethod
+    def motion(mac, state):
+        """Return the switch group message of a Scan sensing motion or not."""
+        return _frame(b"0056" + SEQ_ID_SWITCH_GROUP + mac + b"01" + b"%02X" % state)
+
+    def sense_report(self, mac, temperature, humidity):
+        """Return the report of a Sense, the inverse of the library conversion."""
+        # Half a degree and percent up, the library truncates the values
+        raw_temperature = int(
+            (temperature + SENSE_TEMPERATURE_OFFSET + 0.5)
+            * 65536
+            / SENSE_TEMPERATURE_MULTIPLIER
+        )
+        raw_humidity = int(
+            (humidity + SENSE_HUMIDITY_OFFSET + 0.5) * 65536 / SENSE_HUMIDITY_MULTIPLIER
+        )
+        return _frame(
+            b"0105"
+            + self._next_seq_id()
+            + mac
+            + b"%04X%04X" % (raw_humidity, raw_temperature)
+        )
+
+    def push(self, *messages):
+        """Send messages of the nodes to the stick at once."""
+        self._write(b"".join(messages))
+
+    def _next_seq_id(self):
+        """Return the sequence ID of the next message of the stick."""
+        self._seq_id += 1
+        return b"%04X" % self._seq_id
+
+    def _write(self, data):
+        """Write to the pty, buffering what does not fit."""
+        if self._closed:
+            return
+        if not self._output:
+            try:
+                written = os.write(self.master, data)
+                data = data[written:]
+            except BlockingIOError:
+                pass
+            if not data:
+                return
+            self.loop.add_writer(self.master, self._write_ready)
+        self._output += data
+
+    def _write_ready(self):
+        """Write the buffered data the pty accepts."""
+        try:
+            written = os.write(self.master, self._output)
+        except BlockingIOError:
+            return
+        del self._output[:written]
+        if not self._output:
+            self.loop.remove_writer(self.master)
+
+    def _read(self):
+        """Acknowledge every complete request and have the node answer."""
+        self._buffer += os.read(self.master, 1024)
+        while MESSAGE_FOOTER in self._buffer:
+            request, _, self._buffer = self._buffer.partition(MESSAGE_FOOTER)
+            start = request.find(MESSAGE_HEADER) + len(MESSAGE_HEADER)
+            request = request[start:]
+            self.requests.append(request[:4])
+            seq_id = self._next_seq_id()
+            answer = _frame(b"0000" + seq_id + self.ack)
+            if self.ack == ACK_SUCCESS:
+                answer += self._answer(request, seq_id)
+            # Split the answer to have the transport reassemble it
+            self._write(b"\x83" + answer[:7])
+            self._write(answer[7:])
+
+    def _answer(self, request, seq_id):
+        """Return the answer sent right away, schedule the delayed ones."""
+        if request[:4] == b"000A":
+            return self._response(None, request, seq_id)
+
+        node = self.network.get(request[4:20])
+        if node is None:
+            # Only acknowledged by the stick
+            return b""
+        response = None
+        if node.awake and node.mac not in self.unreachable:
+            response = self._response(node, request, seq_id)
+            if response is None:
+                # Only acknowledged by the stick
+                return b""
+            if self._random.random() < self.loss:
+                self.lost += 1
+                response = None
+        if response is None:
+            if self.timeout is not None:
+                self.loop.call_later(
+                    self.timeout, self._write, _frame(b"0000" + seq_id + ACK_TIMEOUT)
+                )
+            return b""
+
+        delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay <= 0:
+            return response
+        self.loop.call_later(delay, self._write, response)
+        return b""
+
+    def _response(self, node, request, seq_id):
+        """Return the response of the node to the request."""
+        # pylint: disable=too-many-return-statements
+        request_id = request[:4]
+        if request_id == b"000A":
+            return _frame(
+                b"0011"
+                + seq_id
+                + STICK_MAC
+                + b"0001"
+                + b"00"
+                + CIRCLE_PLUS_MAC[2:]
+                + b"04D2"
+                + b"00"
+            )
+        mac = node.mac
+        if request_id == b"000D":
+            ping = int(self.latency * 1000)
+            return _frame(b"000E" + seq_id + mac + b"4848%04X" % ping)
+        if request_id == b"0012":
+            pulses = node.pulses if node.relay else 0
+            return _frame(
+                b"0013"
+                + seq_id
+                + mac
+                + b"%04X%04X%08X%08X0000" % (pulses, pulses * 8, pulses * 3600, 0)
+            )
+        if request_id == b"0017":
+            node.relay = request[20:22] == b"01"
+            return _frame(b"0000" + seq_id + (ACK_ON if node.relay else ACK_OFF) + mac)
+        if request_id == b"0018" and node.node_type == NODE_TYPE_CIRCLE_PLUS:
+            address = int(request[20:22], 16)
+            node_mac = (
+                self.nodes[address].mac
+                if address < len(self.nodes)
+                else b"FFFFFFFFFFFFFFFF"
+            )
+            return _frame(b"0019" + seq_id + mac + node_mac + request[20:22])
+        if request_id == b"0023":
+            return _frame(
+                b"0024"
+                + seq_id
+                + mac
+                + b"140B0000"
+                + b"00044000"
+                + (b"01" if node.relay else b"00")
+                + b"85"
+                + HARDWARE_VERSION
+                + FIRMWARE_VERSION
+                + b"%02X" % node.node_type
+            )
+        if request_id == b"0026":
+            return _frame(b"0027" + seq_id + mac + CALIBRATION)
+        if request_id == b"0029" and node.node_type == NODE_TYPE_CIRCLE_PLUS:
+            now = datetime.now(timezone.utc)
+            return _frame(
+                b"003A"
+                + seq_id
+                + mac
+                + now.strftime("%S%M%H").encode()
+                + b"%02X" % now.weekday()
+                + now.strftime("%d%m%y").encode()
+            )
+        if request_id == b"003E":
+            now = datetime.now(timezone.utc)
+            return _frame(
+                b"003F"
+                + seq_id
+                + mac
+                + b"%02X%02X%02X" % (now.hour, now.minute, now.second)
+                + b"%02X" % now.weekday()
+                + b"00"
+                + b"0000"
+            )
+        if request_id == b"0048":
+            address = (int(request[20:28], 16) - LOGADDR_OFFSET) // 32
+            logs = b"".join(
+                _log_date(LOG_START + timedelta(hours=address * 4 + index))
+                + b"%08X" % (node.pulses * 3600)
+                for index in range(4)
+            )
+            return _frame(b"0049" + seq_id + mac + logs + request[20:28])
+        return None
@@ -0,0 +1,573 @@
+"""Benchmarks for the Plugwise integration.
+
+The benchmarks are left out of the normal test run, set PLUGWISE_BENCHMARK to
+run them. Their timings are recorded as properties of the test report.
+"""
+# pylint: disable=protected-access
+
+import asyncio
+import os
+import time
+import tracemalloc
+from unittest.mock import AsyncMock, patch
+
+from defusedxml import ElementTree as etree
+from plugwise.constants import (
+    DEVICE_MEASUREMENTS,
+    NODE_TYPE_CIRCLE,
+    NODE_TYPE_SCAN,
+    NODE_TYPE_SENSE,
+)
+import pytest
+
+from homeassistant.components.plugwise.const import (
+    CB_NEW_NODE,
+    COORDINATOR,
+    DOMAIN,
+    MESSAGE_RATE_LIMITS,
+    NODE_DISCOVERY,
+    SWITCHES,
+    USB_SENSORS,
+)
+from homeassistant.components.plugwise.gateway import (
+    GATEWAY_DATA_KEYS,
+    SmileContentFilter,
+)
+from homeassistant.components.plugwise.sensor import USBSensor
+from homeassistant.components.plugwise.switch import USBSwitch
+from homeassistant.components.plugwise.usb import (
+    USB_SENSOR_DESCRIPTIONS,
+    AsyncStick,
+    NodeDiscovery,
+    NodeInventory,
+    StickMessageQueue,
+)
+from homeassistant.config_entries import ENTRY_STATE_LOADED
+from homeassistant.const import (
+    ATTR_DEVICE_CLASS,
+    ATTR_ICON,
+    ATTR_NAME,
+    ATTR_STATE,
+    ATTR_UNIT_OF_MEASUREMENT,
+)
+from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.entity_platform import DATA_ENTITY_PLATFORM
+
+from tests.common import MockConfigEntry
+from tests.components.plugwise.common import (
+    async_init_integration,
+    generate_installation,
+)
+from tests.components.plugwise.stick_emulator import CIRCLE_PLUS_MAC, generate_network
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("PLUGWISE_BENCHMARK"), reason="PLUGWISE_BENCHMARK not set"
+)
+
+ROUNDS = 20
+# Zones, plugs and valves of the generated installations
+INSTALLATION_SIZES = [(5, 5, 10), (20, 20, 40), (50, 50, 100)]
+# Response time and jitter of the simulated Smile, in seconds
+SIMULATED_LATENCY = (0.02, 0.01)
+# The library derives all devices again for the data of each device, updates
+# of the larger generated installations take too long to repeat over HTTP
+SIMULATED_SIZES = [(2, 2, 4), (5, 5, 10), (10, 10, 20)]
+# Circles, Scans and Senses of the emulated zigbee networks, the Circle+
+# registers 64 nodes at most
+STICK_NETWORK_SIZES = [(8, 2, 2), (32, 4, 4), (56, 4, 4)]
+# Response time and jitter of the emulated nodes, in seconds
+EMULATED_LATENCY = (0.005, 0.002)
+# Messages pushed by every Scan and Sense
+PUSHED_MESSAGES = 250
+# Circles of which the sensors and switches write their state
+STATE_WRITE_CIRCLES = 56
+
+
+def _count_writes():
+    """Patch the state writes of all entities to count them."""
+    return patch.object(
+        Entity,
+        "async_write_ha_state",
+        autospec=True,
+        side_effect=Entity.async_write_ha_state,
+    )
+
+
+async def test_adam_entity_update_benchmark(hass, mock_smile_adam, record_property):
+    """Compare writing all entities, each fetching its data, and the snapshot."""
+    entry = await async_init_integration(hass, mock_smile_adam)
+    assert entry.state == ENTRY_STATE_LOADED
+
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    entities = [
+        entity
+        for platform in hass.data[DATA_ENTITY_PLATFORM][DOMAIN]
+        for entity in platform.entities.values()
+    ]
+    devices = mock_smile_adam.get_all_devices()
+    fetches = sum(len(entity._device_keys) for entity in entities)
+    # One device changes every update
+    dev_id = "b310b72a0e354bfab43089919b9a88bf"
+    listeners = sum(1 for entity in entities if dev_id in entity._device_keys)
+
+    with _count_writes() as write:
+        # Before: every update wrote all entities, each deriving its device data
+        calls = mock_smile_adam.get_device_data.call_count
+        start = time.process_time()
+        for _ in range(ROUNDS):
+            for entity in entities:
+                for device_id in entity._device_keys:
+                    mock_smile_adam.get_device_data(device_id)
+                entity.async_write_ha_state()
+        record_property("fan_out_seconds", time.process_time() - start)
+        assert mock_smile_adam.get_device_data.call_count - calls == ROUNDS * fetches
+        assert write.call_count == ROUNDS * len(entities)
+
+        # After: one snapshot per update, only the entities of changes write
+        write.reset_mock()
+        calls = mock_smile_adam.get_device_data.call_count
+        start = time.process_time()
+        for _ in range(ROUNDS):
+            coordinator.async_invalidate(dev_id)
+            await coordinator.async_refresh()
+        record_property("snapshot_seconds", time.process_time() - start)
+        assert mock_smile_adam.get_device_data.call_count - calls <= ROUNDS * len(
+            devices
+        )
+        assert ROUNDS <= write.call_count <= ROUNDS * listeners
+
+    assert len(devices) < fetches
+    assert listeners < len(entities)
+
+
+@pytest.mark.parametrize("zones,plugs,valves", INSTALLATION_SIZES)
+async def test_synthetic_installation_benchmark(
+    hass, mock_smile_synthetic, record_property, zones, plugs, valves
+):
+    """Measure setup, dispatch and memory per entity of generated installations."""
+    installation = mock_smile_synthetic(zones, plugs, valves)
+
+    tracemalloc.start()
+    start = time.process_time()
+    entry = await async_init_integration(hass, mock_smile_synthetic)
+    setup = time.process_time() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert entry.state == ENTRY_STATE_LOADED
+
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    entities = [
+        entity
+        for platform in hass.data[DATA_ENTITY_PLATFORM][DOMAIN]
+        for entity in platform.entities.values()
+    ]
+
+    # Every entity processes the update and writes its state
+    skipped_writes = coordinator.skipped_writes
+    with _count_writes() as write:
+        start = time.process_time()
+        for _ in range(ROUNDS):
+            coordinator.changed = None
+            coordinator._async_dispatch()
+        dispatch = (time.process_time() - start) / ROUNDS
+
+    record_property("setup_seconds", setup)
+    record_property("dispatch_seconds", dispatch)
+    record_property("memory_per_entity", memory / len(entities))
+    assert len(installation["get_all_devices"]) == zones + plugs + valves + 2
+    assert len(entities) > zones + plugs + valves
+    assert coordinator.skipped_writes == skipped_writes
+    assert 0 < write.call_count <= ROUNDS * len(entities)
+
+
+@pytest.mark.parametrize("zones,plugs,valves", SIMULATED_SIZES)
+async def test_simulated_update_latency_benchmark(
+    hass, smile_simulator, record_property, zones, plugs, valves
+):
+    """Measure update and command latency of generated Adams served over HTTP."""
+    installation = generate_installation(zones, plugs, valves)
+    latency, jitter = SIMULATED_LATENCY
+    simulator = await smile_simulator(
+        installation, latency=latency, jitter=jitter, seed=0
+    )
+    entry = await async_init_integration(hass, simulator, data=simulator.entry_data)
+    assert entry.state == ENTRY_STATE_LOADED
+
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    devices = installation["get_all_devices"]
+    thermostat = next(
+        dev_id
+        for dev_id, details in devices.items()
+        if details["class"] == "zone_thermostat"
+    )
+
+    # Every update has new content, none is skipped
+    requests = sum(simulator.requests.values())
+    updates = []
+    for update in range(ROUNDS // 4):
+        simulator.update_device(thermostat, temperature=18.0 + update / 10)
+        start = time.perf_counter()
+        await coordinator.async_refresh()
+        updates.append(time.perf_counter() - start)
+    requests = (sum(simulator.requests.values()) - requests) / len(updates)
+    assert coordinator.last_update_success
+
+    # Switch all plugs while an update runs, the requests in flight stay capped
+    plug_ids = [
+        dev_id for dev_id, details in devices.items() if "plug" in details["types"]
+    ]
+    simulator.max_in_flight = 0
+    start = time.perf_counter()
+    await asyncio.gather(
+        coordinator.async_refresh(),
+        *(
+            coordinator.async_command(
+                coordinator.api.set_relay_state, dev_id, None, "off"
+            )
+            for dev_id in plug_ids
+        ),
+    )
+    commands = time.perf_counter() - start
+
+    record_property("update_seconds_mean", sum(updates) / len(updates))
+    record_property("update_seconds_max", max(updates))
+    record_property("requests_per_update", requests)
+    record_property("commands_seconds", commands)
+    assert len(plug_ids) == plugs
+    assert simulator.max_in_flight <= coordinator.request_scheduler.max_requests
+    assert not any(
+        installation["get_device_data"][dev_id]["relay"] for dev_id in plug_ids
+    )
+
+
+@pytest.mark.parametrize("circles,scans,senses", STICK_NETWORK_SIZES)
+async def test_stick_throughput_benchmark(
+    hass, stick_emulator, record_property, circles, scans, senses
+):
+    """Measure discovery, callback rate and relay latency of an emulated network."""
+    nodes = generate_network(circles, scans, senses)
+    for node in nodes:
+        # Awake battery powered nodes are discovered in the first pass
+        node.awake = True
+    latency, jitter = EMULATED_LATENCY
+    emulator = stick_emulator(nodes=nodes, latency=latency, jitter=jitter, seed=0)
+    stick = AsyncStick(hass, emulator.port)
+    # The transport is measured, not the rate limits of the send queue
+    stick.message_queue = StickMessageQueue(dict.fromkeys(MESSAGE_RATE_LIMITS))
+    entry = MockConfigEntry(domain=DOMAIN)
+    discovery = NodeDiscovery(hass, stick, NodeInventory(hass, stick))
+    hass.data[DOMAIN] = {entry.entry_id: {NODE_DISCOVERY: discovery}}
+
+    with patch("homeassistant.components.plugwise.usb.SLEEP_TIME", 0.001), patch(
+        "homeassistant.config_entries.ConfigEntries.async_forward_entry_setup",
+        AsyncMock(return_value=True),
+    ):
+        await stick.async_connect()
+        start = time.perf_counter()
+        await stick.async_initialize_stick(timeout=5)
+        await stick.async_initialize_circle_plus(timeout=5)
+        stick.subscribe_stick_callback(discovery.async_entity_added, CB_NEW_NODE)
+        discovery.async_entity_added(CIRCLE_PLUS_MAC.decode())
+        discovery.async_start(entry)
+        await discovery._task
+        discovered = time.perf_counter() - start
+        assert all(stick.node(node.mac.decode()) for node in nodes)
+
+        # Every report and switch group message of the battery powered nodes
+        callbacks = 0
+
+        def node_callback(*_):
+            nonlocal callbacks
+            callbacks += 1
+
+        messages = []
+        for node in nodes:
+            if node.node_type == NODE_TYPE_SENSE:
+                stick.node(node.mac.decode()).subscribe_callback(
+                    node_callback, "temperature"
+                )
+            elif node.node_type == NODE_TYPE_SCAN:
+                stick.node(node.mac.decode()).subscribe_callback(
+                    node_callback, "motion"
+                )
+        for index in range(PUSHED_MESSAGES):
+            for node in nodes:
+                if node.node_type == NODE_TYPE_SENSE:
+                    messages.append(
+                        emulator.sense_report(node.mac, 15 + index % 10, 50)
+                    )
+                elif node.node_type == NODE_TYPE_SCAN:
+                    messages.append(emulator.motion(node.mac, index % 2 == 0))
+        start = time.perf_counter()
+        emulator.push(*messages)
+        while callbacks < len(messages) and time.perf_counter() - start < 30:
+            await asyncio.sleep(0.01)
+        pushed = time.perf_counter() - start
+
+        # Switch every Circle off at once, the requests are sent in turn
+        relays = []
+        for node in nodes:
+            if node.node_type == NODE_TYPE_CIRCLE:
+                future = hass.loop.create_future()
+                relays.append(future)
+                stick.node(node.mac.decode()).set_relay_state(
+                    False, stick._resolve(future)
+                )
+        start = time.perf_counter()
+        await asyncio.wait_for(asyncio.gather(*relays), 60)
+        switched = time.perf_counter() - start
+
+    relay_latency = stick.latency.async_diagnostics()["CircleSwitchRelayRequest"]
+    record_property("discovery_seconds", discovered)
+    record_property("callbacks_per_second", callbacks / pushed)
+    record_property("switch_seconds", switched)
+    record_property("relay_round_trip_mean", relay_latency["mean"])
+    assert callbacks == len(messages)
+    assert len(relays) == circles
+    assert not any(
+        node.relay for node in nodes if node.node_type == NODE_TYPE_CIRCLE
+    )
+
+    discovery.async_stop()
+    stick.disconnect()
+    await hass.async_block_till_done()
+
+
+class _TableLookupSensor(USBSensor):
+    """USBSensor looking its type up in the const.py table on every access."""
+
+    @property
+    def available(self):
+        """Return the availability of the node."""
+        return getattr(self._node, USB_SENSORS["available"][ATTR_STATE])()
+
+    @property
+    def device_class(self):
+        """Return the device class of the sensor."""
+        return USB_SENSORS[self.sensor_id][ATTR_DEVICE_CLASS]
+
+    @property
+    def icon(self):
+        """Return the icon of the sensor."""
+        return USB_SENSORS[self.sensor_id][ATTR_ICON]
+
+    @property
+    def name(self):
+        """Return the display name of the sensor."""
+        return f"{USB_SENSORS[self.sensor_id][ATTR_NAME]} ({self._mac[-5:]})"
+
+    @property
+    def state(self):
+        """Return the state of the sensor."""
+        state_value = getattr(self._node, USB_SENSORS[self.sensor_id][ATTR_STATE])()
+        if state_value is not None:
+            return float(round(state_value, 3))
+        return None
+
+    @property
+    def unique_id(self):
+        """Return the unique ID of the sensor."""
+        return f"{self._mac}-{self.sensor_id}"
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of the sensor."""
+        return USB_SENSORS[self.sensor_id][ATTR_UNIT_OF_MEASUREMENT]
+
+
+class _TableLookupSwitch(USBSwitch):
+    """USBSwitch looking its type up in the const.py table on every access."""
+
+    @property
+    def available(self):
+        """Return the availability of the node."""
+        return getattr(self._node, USB_SENSORS["available"][ATTR_STATE])()
+
+    @property
+    def current_power_w(self):
+        """Return the current power usage in W."""
+        current_power = getattr(self._node, USB_SENSORS["power_1s"][ATTR_STATE])()
+        if current_power:
+            return float(round(current_power, 2))
+        return None
+
+    @property
+    def device_class(self):
+        """Return the device class of the switch."""
+        return SWITCHES[self.switch_id][ATTR_DEVICE_CLASS]
+
+    @property
+    def icon(self):
+        """Return the icon of the switch."""
+        switch_type = SWITCHES[self.switch_id]
+        return None if switch_type[ATTR_DEVICE_CLASS] else switch_type[ATTR_ICON]
+
+    @property
+    def is_on(self):
+        """Return true if the switch is on."""
+        return getattr(self._node, SWITCHES[self.switch_id][ATTR_STATE])()
+
+    @property
+    def today_energy_kwh(self):
+        """Return the today total energy usage in kWh."""
+        today_energy = getattr(
+            self._node, USB_SENSORS["power_con_today"][ATTR_STATE]
+        )()
+        if today_energy:
+            return float(round(today_energy, 3))
+        return None
+
+    @property
+    def unique_id(self):
+        """Return the unique ID of the switch."""
+        return f"{self._mac}-{self.switch_id}"
+
+
+def _fixed_node():
+    """Return a Circle answering every accessor with the same values."""
+    accessors = {
+        description.state: staticmethod(lambda: 12.3456)
+        for description in USB_SENSOR_DESCRIPTIONS.values()
+    }
+    accessors.update(
+        get_available=staticmethod(lambda: True),
+        get_node_type=staticmethod(lambda: "Circle"),
+        get_relay_state=staticmethod(lambda: True),
+        get_sensors=staticmethod(lambda: list(USB_SENSORS)),
+        set_relay_state=staticmethod(lambda state: None),
+    )
+    return type("FixedNode", (), accessors)()
+
+
+async def test_node_entity_state_write_benchmark(hass, record_property):
+    """Compare state writes of node entities with table lookups and descriptions."""
+    results = {}
+    for sensor_type, switch_type in (
+        (_TableLookupSensor, _TableLookupSwitch),
+        (USBSensor, USBSwitch),
+    ):
+        entities = {}
+        for index in range(STATE_WRITE_CIRCLES):
+            node = _fixed_node()
+            mac = f"000D6F00{index:08X}"
+            entities[f"switch.{mac}_relay".lower()] = switch_type(node, mac, "relay")
+            for sensor_id in USB_SENSORS:
+                if sensor_id != "available":
+                    entities[f"sensor.{mac}_{sensor_id}".lower()] = sensor_type(
+                        node, mac, sensor_id
+                    )
+        for entity_id, entity in entities.items():
+            entity.hass = hass
+            entity.entity_id = entity_id
+            # The states exist, the writes below change nothing
+            entity.async_write_ha_state()
+
+        start = time.process_time()
+        for _ in range(ROUNDS):
+            for entity in entities.values():
+                entity.async_write_ha_state()
+        results[sensor_type] = (time.process_time() - start) / ROUNDS / len(entities)
+
+    record_property("table_lookup_write_seconds", results[_TableLookupSensor])
+    record_property("description_write_seconds", results[USBSensor])
+    assert len(entities) == STATE_WRITE_CIRCLES * len(USB_SENSORS)
+    for entity_id in entities:
+        state = hass.states.get(entity_id).state
+        assert state == ("on" if entity_id.startswith("switch.") else "12.346")
+
+
+def _synthetic_log(tag, log_id, log_type, value):
+    """Return a measurement log as found in the Smile domain objects."""
+    return (
+        f'<{tag} id="{log_id}">'
+        "<updated_date>2020-11-01T10:00:00+01:00</updated_date>"
+        f"<type>{log_type}</type><unit>C</unit>"
+        '<period start_date="2020-11-01T10:00:00+01:00" '
+        'end_date="2020-11-01T10:00:00+01:00">'
+        f'<measurement log_date="2020-11-01T10:00:00+01:00">{value}</measurement>'
+        f"</period></{tag}>"
+    )
+
+
+def _synthetic_domain_objects(zones):
+    """Return the domain objects of an Adam, a thermostat and two valves a zone."""
+    log_types = [
+        ("point_log", "temperature"),
+        ("point_log", "thermostat"),
+        ("point_log", "battery"),
+        ("point_log", "valve_position"),
+        ("point_log", "temperature_difference"),
+        ("point_log", "uncorrected_temperature"),
+        ("point_log", "temperature_offset"),
+        ("point_log", "signal_strength"),
+        ("point_log", "link_quality"),
+        ("interval_log", "uncorrected_temperature"),
+        ("cumulative_log", "battery_charge_cycles"),
+    ]
+    parts = ["<domain_objects>"]
+    for zone in range(zones):
+        parts.append(
+            f'<location id="{zone:032x}"><name>Zone {zone}</name><type>zone</type>'
+            f"<logs>{_synthetic_log('point_log', f'{zone:032x}', 'temperature', 20.5)}"
+            "</logs></location>"
+        )
+        for device in range(3):
+            dev_id = f"{zone:016x}{device:016x}"
+            logs = "".join(
+                _synthetic_log(tag, f"{dev_id[:24]}{index:08x}", log_type, 19.5)
+                for index, (tag, log_type) in enumerate(log_types)
+            )
+            parts.append(
+                f'<appliance id="{dev_id}"><name>Device {zone}.{device}</name>'
+                "<type>thermostatic_radiator_valve</type>"
+                f'<location id="{zone:032x}"/>'
+                f"<logs>{logs}</logs></appliance>"
+            )
+    parts.append("</domain_objects>")
+    return "".join(parts).encode()
+
+
+def _parse_and_query(body):
+    """Parse the body and look up all device measurements like the library does."""
+    tree = etree.XML(body)
+    for appliance in tree.findall(".//appliance"):
+        for measurement in DEVICE_MEASUREMENTS:
+            appliance.find(
+                f'.//logs/point_log[type="{measurement}"]/period/measurement'
+            )
+    return tree
+
+
+def _measure(function, *args):
+    """Return the result, best CPU time and peak memory of the function."""
+    elapsed = []
+    for _ in range(ROUNDS // 4):
+        start = time.process_time()
+        function(*args)
+        elapsed.append(time.process_time() - start)
+    tracemalloc.start()
+    result = function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, min(elapsed), peak
+
+
+def test_adam_200_zone_content_filter_benchmark(record_property):
+    """Compare parsing the full and filtering then parsing the 200 zone content."""
+    body = _synthetic_domain_objects(200)
+    content_filter = SmileContentFilter(GATEWAY_DATA_KEYS)
+
+    full_tree, full_time, full_peak = _measure(_parse_and_query, body)
+    filtered_tree, filtered_time, filtered_peak = _measure(
+        lambda body: _parse_and_query(content_filter.filter(body)), body
+    )
+
+    record_property("full_parse_seconds", full_time)
+    record_property("full_parse_peak_memory", full_peak)
+    record_property("filtered_parse_seconds", filtered_time)
+    record_property("filtered_parse_peak_memory", filtered_peak)
+    assert sum(1 for _ in filtered_tree.iter()) < sum(1 for _ in full_tree.iter())
+    # Every round drops the same logs
+    assert content_filter.dropped == (ROUNDS // 4 + 1) * 200 * 3 * 6
+    # Filtering pays for itself within the parse of the library
+    assert filtered_time < full_time
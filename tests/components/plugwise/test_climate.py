@@ -1,10 +1,25 @@
 """Tests for the Plugwise Climate integration."""
 
+from datetime import timedelta
+
 from plugwise.exceptions import PlugwiseException
 
-from homeassistant.components.climate.const import HVAC_MODE_AUTO, HVAC_MODE_HEAT
+from homeassistant.components.climate.const import (
+    HVAC_MODE_AUTO,
+    HVAC_MODE_HEAT,
+    HVAC_MODE_HEAT_COOL,
+    HVAC_MODE_OFF,
+)
+from homeassistant.components.plugwise.const import (
+    COORDINATOR,
+    DEFAULT_CONFIRM_DELAY,
+    DOMAIN,
+    SERVICE_SET_HVAC_MODES,
+)
 from homeassistant.config_entries import ENTRY_STATE_LOADED
+from homeassistant.util import dt as dt_util
 
+from tests.common import async_fire_time_changed
 from tests.components.plugwise.common import async_init_integration
 
 
@@ -81,6 +96,14 @@ async def test_adam_climate_adjust_negative_testing(hass, mock_smile_adam):
     state = hass.states.get("climate.zone_thermostat_jessie")
     attrs = state.attributes
 
+    # The Smile is asked for the state the failed commands left it in
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    async_fire_time_changed(
+        hass, dt_util.utcnow() + timedelta(seconds=DEFAULT_CONFIRM_DELAY + 1)
+    )
+    await hass.async_block_till_done()
+    assert coordinator.confirmations == 1
+
 
 async def test_adam_climate_entity_climate_changes(hass, mock_smile_adam):
     """Test handling of user requests in adam climate device environment."""
@@ -135,6 +158,85 @@ async def test_adam_climate_entity_climate_changes(hass, mock_smile_adam):
     assert attrs["preset_mode"] == "home"
 
 
+async def test_adam_climate_set_hvac_modes(hass, mock_smile_adam):
+    """Test setting the hvac modes of multiple zones in one call."""
+    entry = await async_init_integration(hass, mock_smile_adam)
+    assert entry.state == ENTRY_STATE_LOADED
+
+    await hass.services.async_call(
+        "plugwise",
+        "set_hvac_modes",
+        {
+            "hvac_modes": {
+                "climate.zone_lisa_wk": HVAC_MODE_HEAT,
+                "climate.zone_thermostat_jessie": HVAC_MODE_HEAT,
+            }
+        },
+        blocking=True,
+    )
+
+    assert hass.states.get("climate.zone_lisa_wk").state == HVAC_MODE_HEAT
+    assert hass.states.get("climate.zone_thermostat_jessie").state == HVAC_MODE_HEAT
+    assert mock_smile_adam.set_schedule_state.call_count == 2
+
+    # Modes a zone does not support are left out
+    await hass.services.async_call(
+        "plugwise",
+        "set_hvac_modes",
+        {
+            "hvac_modes": {
+                "climate.zone_lisa_wk": HVAC_MODE_HEAT_COOL,
+                "climate.zone_thermostat_jessie": HVAC_MODE_AUTO,
+            }
+        },
+        blocking=True,
+    )
+    assert hass.states.get("climate.zone_lisa_wk").state == HVAC_MODE_HEAT
+    assert hass.states.get("climate.zone_thermostat_jessie").state == HVAC_MODE_AUTO
+    assert mock_smile_adam.set_schedule_state.call_count == 3
+
+    await hass.config_entries.async_unload(entry.entry_id)
+    await hass.async_block_till_done()
+    assert not hass.services.has_service(DOMAIN, SERVICE_SET_HVAC_MODES)
+
+
+async def test_adam_climate_hvac_mode_command_order(hass, mock_smile_adam):
+    """Test the setpoint is sent before the schedule is switched on."""
+    entry = await async_init_integration(hass, mock_smile_adam)
+    assert entry.state == ENTRY_STATE_LOADED
+
+    await hass.services.async_call(
+        "climate",
+        "set_hvac_mode",
+        {"entity_id": "climate.zone_lisa_wk", "hvac_mode": HVAC_MODE_AUTO},
+        blocking=True,
+    )
+    commands = [
+        name
+        for name, _, _ in mock_smile_adam.mock_calls
+        if name in ("set_temperature", "set_schedule_state", "set_preset")
+    ]
+    assert commands == ["set_temperature", "set_schedule_state"]
+
+
+async def test_adam_climate_hvac_mode_off_sends_away(hass, mock_smile_adam):
+    """Test switching off always sends the away preset, also when cached as away."""
+    entry = await async_init_integration(hass, mock_smile_adam)
+    assert entry.state == ENTRY_STATE_LOADED
+
+    for _ in range(2):
+        await hass.services.async_call(
+            "climate",
+            "set_hvac_mode",
+            {"entity_id": "climate.zone_lisa_wk", "hvac_mode": HVAC_MODE_OFF},
+            blocking=True,
+        )
+    assert mock_smile_adam.set_preset.call_count == 2
+    mock_smile_adam.set_preset.assert_called_with(
+        "c50f167537524366a5af7aa3942feb1e", "away"
+    )
+
+
 async def test_anna_climate_entity_attributes(hass, mock_smile_anna):
     """Test creation of anna climate device environment."""
     entry = await async_init_integration(hass, mock_smile_anna)
@@ -10,6 +10,9 @@ import pytest
 
 from homeassistant import config_entries, data_entry_flow, setup
 from homeassistant.components.plugwise.const import (
+    CONF_ADAPTIVE_SCAN_INTERVAL,
+    CONF_MAX_SCAN_INTERVAL,
+    COORDINATOR,
     DEFAULT_PORT,
     DEFAULT_SCAN_INTERVAL,
     DOMAIN,
@@ -287,7 +290,8 @@ async def test_options_flow_power(hass, mock_smile) -> None:
         options={CONF_SCAN_INTERVAL: DEFAULT_SCAN_INTERVAL},
     )
 
-    hass.data[DOMAIN] = {entry.entry_id: {"api": MagicMock(smile_type="power")}}
+    coordinator = MagicMock(topology=MagicMock(smile_type="power"))
+    hass.data[DOMAIN] = {entry.entry_id: {COORDINATOR: coordinator}}
     entry.add_to_hass(hass)
 
     with patch(
@@ -307,6 +311,8 @@ async def test_options_flow_power(hass, mock_smile) -> None:
         assert result["type"] == data_entry_flow.RESULT_TYPE_CREATE_ENTRY
         assert result["data"] == {
             CONF_SCAN_INTERVAL: 10,
+            CONF_ADAPTIVE_SCAN_INTERVAL: False,
+            CONF_MAX_SCAN_INTERVAL: 60,
         }
 
 
@@ -319,7 +325,8 @@ async def test_options_flow_thermo(hass, mock_smile) -> None:
         options={CONF_SCAN_INTERVAL: DEFAULT_SCAN_INTERVAL},
     )
 
-    hass.data[DOMAIN] = {entry.entry_id: {"api": MagicMock(smile_type="thermostat")}}
+    coordinator = MagicMock(topology=MagicMock(smile_type="thermostat"))
+    hass.data[DOMAIN] = {entry.entry_id: {COORDINATOR: coordinator}}
     entry.add_to_hass(hass)
 
     with patch(
@@ -340,4 +347,40 @@ async def test_options_flow_thermo(hass, mock_smile) -> None:
         assert result["type"] == data_entry_flow.RESULT_TYPE_CREATE_ENTRY
         assert result["data"] == {
             CONF_SCAN_INTERVAL: 60,
+            CONF_ADAPTIVE_SCAN_INTERVAL: False,
+            CONF_MAX_SCAN_INTERVAL: 300,
         }
+
+
+async def test_options_flow_adaptive_invalid(hass, mock_smile) -> None:
+    """Test config flow options rejecting a scan interval above the maximum."""
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        title=CONF_NAME,
+        data={CONF_HOST: TEST_HOST, CONF_PASSWORD: TEST_PASSWORD},
+        options={CONF_SCAN_INTERVAL: DEFAULT_SCAN_INTERVAL},
+    )
+
+    coordinator = MagicMock(topology=MagicMock(smile_type="power"))
+    hass.data[DOMAIN] = {entry.entry_id: {COORDINATOR: coordinator}}
+    entry.add_to_hass(hass)
+
+    with patch(
+        "homeassistant.components.plugwise.async_setup_entry", return_value=True
+    ):
+        assert await hass.config_entries.async_setup(entry.entry_id)
+        await hass.async_block_till_done()
+
+        result = await hass.config_entries.options.async_init(entry.entry_id)
+
+        result = await hass.config_entries.options.async_configure(
+            result["flow_id"],
+            user_input={
+                CONF_SCAN_INTERVAL: 120,
+                CONF_ADAPTIVE_SCAN_INTERVAL: True,
+                CONF_MAX_SCAN_INTERVAL: 60,
+            },
+        )
+
+        assert result["type"] == data_entry_flow.RESULT_TYPE_FORM
+        assert result["errors"] == {"base": "invalid_scan_interval"}
@@ -1,18 +1,41 @@
 """Tests for the Plugwise Climate integration."""
 
 import asyncio
+from datetime import timedelta
+from unittest.mock import Mock
 
 from plugwise.exceptions import XMLDataMissingError
 
-from homeassistant.components.plugwise.const import DOMAIN
+from homeassistant.components.plugwise.const import (
+    CONF_ADAPTIVE_SCAN_INTERVAL,
+    CONF_MAX_SCAN_INTERVAL,
+    COORDINATOR,
+    DEFAULT_CONFIRM_DELAY,
+    DOMAIN,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_POLL,
+    TOPOLOGY_STORAGE_KEY,
+    TOPOLOGY_STORAGE_VERSION,
+)
+from homeassistant.components.plugwise.gateway import (
+    SmileContentTracker,
+    SmileRequestScheduler,
+)
 from homeassistant.config_entries import (
+    ENTRY_STATE_LOADED,
     ENTRY_STATE_NOT_LOADED,
     ENTRY_STATE_SETUP_ERROR,
     ENTRY_STATE_SETUP_RETRY,
 )
+from homeassistant.const import CONF_SCAN_INTERVAL, EVENT_HOMEASSISTANT_CLOSE
+from homeassistant.helpers import device_registry as dr, entity_registry as er
+from homeassistant.util import dt as dt_util
 
-from tests.common import AsyncMock, MockConfigEntry
-from tests.components.plugwise.common import async_init_integration
+from tests.common import AsyncMock, MockConfigEntry, async_fire_time_changed
+from tests.components.plugwise.common import (
+    async_init_integration,
+    load_installation,
+)
 
 
 async def test_smile_unauthorized(hass, mock_smile_unauth):
@@ -48,6 +71,450 @@ async def test_smile_adam_xmlerror(hass, mock_smile_adam):
     assert entry.state == ENTRY_STATE_SETUP_RETRY
 
 
+async def test_coordinator_skips_unchanged(hass, mock_smile_adam):
+    """Test only entities with changed device data are written."""
+    entry = await async_init_integration(hass, mock_smile_adam)
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+
+    skipped_writes = coordinator.skipped_writes
+    await coordinator.async_refresh()
+    assert coordinator.changed == set()
+    assert coordinator.skipped_writes > skipped_writes
+
+    coordinator.async_invalidate("b310b72a0e354bfab43089919b9a88bf")
+    await coordinator.async_refresh()
+    assert coordinator.changed == {("b310b72a0e354bfab43089919b9a88bf", None)}
+
+
+async def test_coordinator_adaptive_interval(hass, mock_smile_adam):
+    """Test the scan interval backs off up to the maximum and resets on changes."""
+    entry = await async_init_integration(hass, mock_smile_adam)
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+
+    hass.config_entries.async_update_entry(
+        entry,
+        options={
+            CONF_SCAN_INTERVAL: 15,
+            CONF_ADAPTIVE_SCAN_INTERVAL: True,
+            CONF_MAX_SCAN_INTERVAL: 50,
+        },
+    )
+    await hass.async_block_till_done()
+    assert coordinator.update_interval == timedelta(seconds=15)
+
+    await coordinator.async_refresh()
+    assert coordinator.update_interval == timedelta(seconds=30)
+    await coordinator.async_refresh()
+    assert coordinator.update_interval == timedelta(seconds=50)
+
+    coordinator.async_invalidate("b310b72a0e354bfab43089919b9a88bf")
+    await coordinator.async_refresh()
+    assert coordinator.update_interval == timedelta(seconds=15)
+
+    # Without options it starts from the default scan interval of the Smile
+    hass.config_entries.async_update_entry(
+        entry, options={CONF_ADAPTIVE_SCAN_INTERVAL: True}
+    )
+    await hass.async_block_till_done()
+    assert coordinator.update_interval == timedelta(seconds=60)
+    assert coordinator.adaptive_interval[1] == timedelta(seconds=300)
+
+
+async def test_coordinator_confirmation_debounced(hass, mock_smile_adam):
+    """Test commands sent in a burst are confirmed by a single update."""
+    entry = await async_init_integration(hass, mock_smile_adam)
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    updates = mock_smile_adam.full_update_device.call_count
+
+    for service, entity_id, data in (
+        ("set_temperature", "climate.zone_lisa_wk", {"temperature": 22}),
+        ("set_temperature", "climate.zone_thermostat_jessie", {"temperature": 18}),
+        ("set_preset_mode", "climate.zone_lisa_wk", {"preset_mode": "away"}),
+    ):
+        await hass.services.async_call(
+            "climate", service, {"entity_id": entity_id, **data}, blocking=True
+        )
+    assert mock_smile_adam.set_temperature.call_count == 2
+    assert mock_smile_adam.set_preset.call_count == 1
+
+    # Nothing is fetched until the commands settled
+    assert mock_smile_adam.full_update_device.call_count == updates
+    assert coordinator.confirmations == 0
+
+    mock_smile_adam.get_device_data.reset_mock()
+    polls = coordinator.request_scheduler.async_diagnostics()["poll"]["requests"]
+    async_fire_time_changed(
+        hass, dt_util.utcnow() + timedelta(seconds=DEFAULT_CONFIRM_DELAY + 1)
+    )
+    await hass.async_block_till_done()
+    assert mock_smile_adam.full_update_device.call_count == updates + 1
+    assert coordinator.confirmations == 1
+    # The confirmation is fetched in the poll slot
+    diagnostics = coordinator.request_scheduler.async_diagnostics()
+    assert diagnostics["poll"]["requests"] == polls + 1
+
+    # Only the devices in the commanded zones are derived again
+    assert {call[0][0] for call in mock_smile_adam.get_device_data.call_args_list} == {
+        "b310b72a0e354bfab43089919b9a88bf",
+        "b59bcebaf94b499ea7d46e4a66fb62d8",
+        "78d1126fc4c743db81b61c20e88342a7",
+        "d3da73bde12a47d5a6b8f9dad971f2ec",
+        "6a3bf693d05e48e0b460c815a4fdd09d",
+    }
+
+    # The cooldown passing without commands does not fetch again
+    async_fire_time_changed(
+        hass, dt_util.utcnow() + timedelta(seconds=2 * DEFAULT_CONFIRM_DELAY + 2)
+    )
+    await hass.async_block_till_done()
+    assert mock_smile_adam.full_update_device.call_count == updates + 1
+    assert coordinator.confirmations == 1
+
+
+async def test_poll_scheduler_diagnostics(hass, mock_smile_adam):
+    """Test the phase offset of the gateway refreshes in the diagnostic sensor."""
+    entry = await async_init_integration(hass, mock_smile_adam)
+    registry = await er.async_get_registry(hass)
+    entity_id = registry.async_get_entity_id(
+        "sensor", DOMAIN, "fe799307f1624099878210aa0b9f1475-diagnostics"
+    )
+    assert hass.states.get(entity_id) is None
+
+    registry.async_update_entity(entity_id, disabled_by=None)
+    await hass.config_entries.async_reload(entry.entry_id)
+    await hass.async_block_till_done()
+    state = hass.states.get(entity_id)
+    interval = float(state.state)
+    phase = state.attributes["phase_offset"]
+    assert 0 <= phase < interval / 2
+    assert state.attributes["last_update_success"]
+    # The counters of the updates are not recorded
+    assert "requests" not in state.attributes
+
+    # Updates without a change in the statistics write no state
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    await coordinator.async_refresh()
+    await hass.async_block_till_done()
+    assert hass.states.get(entity_id).last_updated == state.last_updated
+
+
+async def test_request_scheduler_priority(hass):
+    """Test user commands overtaking queued polls within the request limit."""
+    scheduler = SmileRequestScheduler(max_requests=2)
+    started = []
+
+    async def request(name):
+        started.append(name)
+        await asyncio.sleep(0.01)
+
+    polls = [
+        hass.async_create_task(scheduler.async_run(PRIORITY_POLL, request, name))
+        for name in ("poll_1", "poll_2")
+    ]
+    await asyncio.sleep(0)
+    command = hass.async_create_task(
+        scheduler.async_run(PRIORITY_INTERACTIVE, request, "command")
+    )
+    await asyncio.sleep(0)
+
+    # The second poll waits as polls never take the last slot
+    assert started == ["poll_1", "command"]
+    assert scheduler.async_diagnostics()["queue_depth"] == 1
+
+    await asyncio.gather(*polls, command)
+    assert started == ["poll_1", "command", "poll_2"]
+
+    diagnostics = scheduler.async_diagnostics()
+    assert diagnostics["queue_depth"] == 0
+    assert diagnostics["poll"]["queued"] == 1
+    assert diagnostics["interactive"]["queued"] == 0
+
+
+async def test_content_tracker_conditional_requests(hass):
+    """Test the unchanged content detection of the Smile responses."""
+    tracker = SmileContentTracker()
+    response = Mock(
+        url="http://1.1.1.1:80/core/domain_objects",
+        status=200,
+        headers={"ETag": '"1"'},
+    )
+
+    tracker.async_start()
+    assert tracker.async_process_body(response, b"<domain_objects/>")
+    assert not tracker.unchanged
+    tracker.async_mark_derived()
+
+    # Not modified, the previous body is served again
+    response.status = 304
+    tracker.async_start()
+    assert tracker.async_process_body(response, b"") == b"<domain_objects/>"
+    assert tracker.unchanged
+
+    # Firmware without validators, the fingerprint detects the change
+    response.status = 200
+    response.headers = {}
+    tracker.async_start()
+    tracker.async_process_body(response, b"<domain_objects><a/></domain_objects>")
+    assert not tracker.unchanged
+    assert tracker.async_diagnostics()["not_modified"] == 1
+
+
+async def test_data_key_projection(hass, mock_smile_adam):
+    """Test the data keys follow the disabled and enabled sensors."""
+    entry = await async_init_integration(hass, mock_smile_adam)
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    log_types = coordinator.content_tracker.content_filter.log_types
+    assert "battery" in log_types
+
+    registry = await er.async_get_registry(hass)
+    batteries = [
+        entity.entity_id
+        for entity in er.async_entries_for_config_entry(registry, entry.entry_id)
+        if entity.unique_id.endswith("-battery")
+    ]
+    assert batteries
+
+    for entity_id in batteries:
+        registry.async_update_entity(entity_id, disabled_by=er.DISABLED_USER)
+    await hass.async_block_till_done()
+    assert "battery" not in coordinator.content_tracker.content_filter.log_types
+
+    # The climate entities keep reading the temperature whatever the sensors
+    assert "temperature" in coordinator.content_tracker.content_filter.log_types
+
+    registry.async_update_entity(batteries[0], disabled_by=None)
+    await hass.async_block_till_done()
+    assert "battery" in coordinator.content_tracker.content_filter.log_types
+
+
+async def test_device_projection(hass, mock_smile_adam):
+    """Test the data of a device with every entity disabled is not derived."""
+    entry = await async_init_integration(hass, mock_smile_adam)
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    dev_id = "21f2b542c49845e6bb416884c55778d6"
+    assert coordinator.data[dev_id]
+
+    registry = await er.async_get_registry(hass)
+    device_registry = await dr.async_get_registry(hass)
+    device = device_registry.async_get_device({(DOMAIN, dev_id)}, set())
+    entity_ids = [
+        entity.entity_id
+        for entity in er.async_entries_for_device(registry, device.id)
+    ]
+    assert entity_ids
+
+    for entity_id in entity_ids:
+        registry.async_update_entity(entity_id, disabled_by=er.DISABLED_USER)
+    await hass.async_block_till_done()
+    mock_smile_adam.get_device_data.reset_mock()
+    await coordinator.async_refresh()
+    assert not coordinator.data[dev_id]
+    assert dev_id not in [
+        call.args[0] for call in mock_smile_adam.get_device_data.call_args_list
+    ]
+    assert coordinator.content_tracker.async_diagnostics()["disabled_devices"] == 1
+
+    registry.async_update_entity(entity_ids[0], disabled_by=None)
+    await hass.async_block_till_done()
+    assert coordinator.data[dev_id]
+
+
+async def test_data_key_projection_enable(hass, hass_storage, mock_smile_adam):
+    """Test a sensor enabled for a data key not fetched is added by one reload."""
+    entry = await async_init_integration(hass, mock_smile_adam, skip_setup=True)
+    registry = await er.async_get_registry(hass)
+    dev_id = "b59bcebaf94b499ea7d46e4a66fb62d8"
+    battery = registry.async_get_or_create(
+        "sensor",
+        DOMAIN,
+        f"{dev_id}-battery",
+        config_entry=entry,
+        disabled_by=er.DISABLED_USER,
+    )
+
+    # The content filter drops the logs of the disabled key
+    derive = mock_smile_adam.get_device_data.side_effect
+    dropped = {"battery"}
+    mock_smile_adam.get_device_data.side_effect = lambda device_id: {
+        key: value for key, value in derive(device_id).items() if key not in dropped
+    }
+    await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    assert "battery" not in coordinator.content_tracker.content_filter.log_types
+    assert "battery" not in coordinator.topology.device_keys[dev_id]
+
+    dropped.clear()
+    registry.async_update_entity(battery.entity_id, disabled_by=None)
+    await hass.async_block_till_done()
+    assert "battery" in coordinator.content_tracker.content_filter.log_types
+    storage_key = f"{TOPOLOGY_STORAGE_KEY}.{entry.entry_id}"
+    assert "battery" in hass_storage[storage_key]["data"]["device_keys"][dev_id]
+
+    await hass.config_entries.async_reload(entry.entry_id)
+    await hass.async_block_till_done()
+    assert hass.states.get(battery.entity_id).state == "34"
+
+
+async def test_stored_topology_startup(hass, hass_storage, mock_smile_adam):
+    """Test creating the entities from the stored topology before connecting."""
+    entry = await async_init_integration(hass, mock_smile_adam)
+    topology = hass.data[DOMAIN][entry.entry_id][COORDINATOR].topology
+    assert topology.confirmed
+    storage_key = f"{TOPOLOGY_STORAGE_KEY}.{entry.entry_id}"
+    hass_storage[storage_key] = {
+        "version": TOPOLOGY_STORAGE_VERSION,
+        "key": storage_key,
+        "data": topology._data_to_save(),
+    }
+    await hass.config_entries.async_unload(entry.entry_id)
+    await hass.async_block_till_done()
+
+    # The Smile does not answer, the entities are created nevertheless
+    mock_smile_adam.connect.reset_mock()
+    mock_smile_adam.connect.side_effect = asyncio.TimeoutError
+    await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+    assert entry.state == ENTRY_STATE_LOADED
+    assert mock_smile_adam.connect.call_count == 1
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    assert not coordinator.topology.confirmed
+    assert hass.states.get("sensor.adam_outdoor_temperature").state == "unavailable"
+
+    mock_smile_adam.connect.side_effect = AsyncMock(return_value=True)
+    await coordinator.async_refresh()
+    await hass.async_block_till_done()
+    assert coordinator.topology.confirmed
+    assert float(hass.states.get("sensor.adam_outdoor_temperature").state) == 7.81
+
+
+async def test_stored_topology_outdated(hass, hass_storage, mock_smile_adam):
+    """Test reloading only once the stored devices turned out to be outdated."""
+    entry = await async_init_integration(hass, mock_smile_adam)
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    storage_key = f"{TOPOLOGY_STORAGE_KEY}.{entry.entry_id}"
+    record = coordinator.topology._data_to_save()
+    assert hass_storage[storage_key]["data"] == record
+
+    # A data key without a value is no reason to reload
+    gateway = coordinator.topology.gateway_id
+    record["device_keys"][gateway].append("illuminance")
+    hass_storage[storage_key]["data"] = record
+    await hass.config_entries.async_reload(entry.entry_id)
+    await hass.async_block_till_done()
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    await coordinator.async_refresh()
+    await hass.async_block_till_done()
+    assert hass.data[DOMAIN][entry.entry_id][COORDINATOR] is coordinator
+    assert "illuminance" in coordinator.topology.device_keys[gateway]
+
+    # A missing device reloads with the saved topology, and only once
+    record = coordinator.topology._data_to_save()
+    record["devices"].pop(coordinator.topology.heater_id)
+    hass_storage[storage_key]["data"] = record
+    await hass.config_entries.async_reload(entry.entry_id)
+    await hass.async_block_till_done()
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    await coordinator.async_refresh()
+    await hass.async_block_till_done()
+    heater = coordinator.topology.heater_id
+    assert heater in hass_storage[storage_key]["data"]["devices"]
+
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    assert heater in coordinator.topology.devices
+    await coordinator.async_refresh()
+    await hass.async_block_till_done()
+    assert hass.data[DOMAIN][entry.entry_id][COORDINATOR] is coordinator
+
+
+async def test_simulated_smile_update(hass, smile_simulator):
+    """Test updating the devices of an Adam served over HTTP."""
+    installation = load_installation("adam_multiple_devices_per_zone")
+    simulator = await smile_simulator(installation)
+    entry = await async_init_integration(hass, simulator, data=simulator.entry_data)
+    assert entry.state == ENTRY_STATE_LOADED
+
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    assert set(coordinator.data) == set(installation["get_all_devices"])
+    plug = "78d1126fc4c743db81b61c20e88342a7"
+    thermostat = "b59bcebaf94b499ea7d46e4a66fb62d8"
+    assert coordinator.data[plug]["relay"] is True
+    assert coordinator.data[thermostat]["setpoint"] == 21.5
+
+    simulator.update_device(plug, relay=False)
+    await coordinator.async_refresh()
+    assert coordinator.data[plug]["relay"] is False
+
+    # Commands change the served content like a Smile
+    loc_id = installation["get_all_devices"][thermostat]["location"]
+    await coordinator.async_command(coordinator.api.set_temperature, loc_id, 19.0)
+    await coordinator.async_refresh()
+    assert coordinator.data[thermostat]["setpoint"] == 19.0
+    assert simulator.requests["PUT", "/core/locations/thermostat"] == 1
+
+
+async def test_simulated_smile_connection_reuse(hass, smile_simulator):
+    """Test the requests of an update reuse the connection of the session."""
+    simulator = await smile_simulator(load_installation("p1v3_full_option"))
+    entry = await async_init_integration(hass, simulator, data=simulator.entry_data)
+    assert entry.state == ENTRY_STATE_LOADED
+
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    stats = coordinator.connection_stats
+    created = stats.created
+    assert created >= 1
+
+    await coordinator.async_refresh()
+    assert stats.created == created
+    assert coordinator.handshakes_saved >= 1
+    assert stats.reused >= coordinator.handshakes_saved
+
+    # Reloading does not leave the shutdown listener of the session behind
+    listeners = hass.bus.async_listeners()[EVENT_HOMEASSISTANT_CLOSE]
+    await hass.config_entries.async_reload(entry.entry_id)
+    await hass.async_block_till_done()
+    assert hass.bus.async_listeners()[EVENT_HOMEASSISTANT_CLOSE] == listeners
+    await hass.config_entries.async_unload(entry.entry_id)
+    assert hass.bus.async_listeners().get(EVENT_HOMEASSISTANT_CLOSE, 0) == listeners - 1
+
+
+async def test_simulated_smile_content_filter(hass, smile_simulator):
+    """Test the logs the library reads by itself survive the content filter."""
+    simulator = await smile_simulator(load_installation("anna_heatpump"))
+    entry = await async_init_integration(hass, simulator, data=simulator.entry_data)
+    assert entry.state == ENTRY_STATE_LOADED
+
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    assert coordinator.content_tracker.content_filter.dropped
+    assert coordinator.data["3cb70739631c4d17a86b8b12e8a5161b"]["illuminance"] == 86.0
+
+
+async def test_simulated_smile_timeout_and_errors(hass, smile_simulator):
+    """Test updates of a P1 answering slowly or with errors."""
+    simulator = await smile_simulator(load_installation("p1v3_full_option"))
+    entry = await async_init_integration(hass, simulator, data=simulator.entry_data)
+    assert entry.state == ENTRY_STATE_LOADED
+
+    # The library gives up after a request and three retries timed out
+    coordinator = hass.data[DOMAIN][entry.entry_id][COORDINATOR]
+    coordinator.api._timeout = 0.1
+    simulator.latency = 0.2
+    requests = simulator.requests["GET", "/core/appliances"]
+    await coordinator.async_refresh()
+    assert not coordinator.last_update_success
+    assert simulator.requests["GET", "/core/appliances"] - requests == 4
+
+    simulator.latency = 0.0
+    simulator.error_rate = 1.0
+    await coordinator.async_refresh()
+    assert not coordinator.last_update_success
+    assert simulator.errors
+
+    simulator.error_rate = 0.0
+    await coordinator.async_refresh()
+    assert coordinator.last_update_success
+
+
 async def test_unload_entry(hass, mock_smile_adam):
     """Test being able to unload an entry."""
     entry = await async_init_integration(hass, mock_smile_adam)
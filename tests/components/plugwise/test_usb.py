@@ -0,0 +1,724 @@
+"""Tests for the Plugwise USB-stick transport."""
+# pylint: disable=protected-access
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+import itertools
+import queue
+import threading
+from unittest.mock import AsyncMock, Mock, patch
+
+from plugwise.constants import ACK_TIMEOUT, MESSAGE_RETRY
+from plugwise.exceptions import StickInitError
+from plugwise.messages.requests import (
+    CirclePowerUsageRequest,
+    CircleSwitchRelayRequest,
+    NodeInfoRequest,
+    NodePingRequest,
+)
+from plugwise.nodes.circle import PlugwiseCircle
+from plugwise.nodes.scan import PlugwiseScan
+import pytest
+
+from homeassistant.components.plugwise.const import (
+    CB_NEW_NODE,
+    CURRENT_POWER_SENSOR_ID,
+    DOMAIN,
+    ENERGY_LOG_INITIAL_PAGES,
+    ENERGY_LOG_STORAGE_KEY,
+    ENERGY_LOG_STORAGE_VERSION,
+    INVENTORY_STORAGE_KEY,
+    INVENTORY_STORAGE_VERSION,
+    MESSAGE_CONFIG,
+    MESSAGE_INTERACTIVE,
+    MESSAGE_TELEMETRY,
+    NODE_DISCOVERY,
+    NODE_STATE_WRITER,
+    POWER_POLL_IDLE,
+    POWER_POLL_MAX,
+    POWER_POLL_MIN,
+    POWER_POLLER,
+    PREVIOUS_HOUR_ENERGY_SENSOR_ID,
+    STICK,
+    STICK_BRIDGE,
+    SWITCHES,
+    TODAY_ENERGY_SENSOR_ID,
+    YESTERDAY_ENERGY_SENSOR_ID,
+)
+from homeassistant.components.plugwise.sensor import USBSensor, USBStickDiagnostics
+from homeassistant.components.plugwise.switch import USBSwitch
+from homeassistant.components.plugwise.usb import (
+    SWITCH_DESCRIPTIONS,
+    USB_SENSOR_DESCRIPTIONS,
+    AsyncStick,
+    CachedNode,
+    EnergyLogCollector,
+    NodeDiscovery,
+    NodeInventory,
+    NodeStateWriter,
+    PowerPollScheduler,
+    StickBridge,
+    StickMessageQueue,
+)
+from homeassistant.const import ATTR_STATE
+from homeassistant.util import dt as dt_util
+
+from tests.common import MockConfigEntry, async_fire_time_changed
+from tests.components.plugwise.stick_emulator import (
+    CIRCLE_PLUS_MAC,
+    STICK_MAC,
+    generate_network,
+)
+
+
+async def test_async_stick_initialize(hass, stick_emulator):
+    """Test initializing the stick and Circle+ on the event loop."""
+    emulator = stick_emulator()
+    stick = AsyncStick(hass, emulator.port)
+    await stick.async_connect()
+    await stick.async_initialize_stick(timeout=5)
+    assert stick.network_online
+    assert stick.get_mac_stick() == STICK_MAC.decode()
+    assert stick.circle_plus_mac == CIRCLE_PLUS_MAC.decode()
+
+    await stick.async_initialize_circle_plus(timeout=5)
+    assert emulator.requests[0] == b"000A"
+    assert emulator.requests[1] == b"0023"
+
+    latency = stick.latency.async_diagnostics()
+    assert latency["StickInitRequest"]["count"] == 1
+    assert sum(latency["StickInitRequest"]["buckets"].values()) == 1
+    assert latency["NodeInfoRequest"]["count"] >= 1
+    assert latency["NodeInfoRequest"]["failed"] == 0
+
+    stick.disconnect()
+    await hass.async_block_till_done()
+    assert not stick.connection.is_connected()
+
+
+async def test_stick_diagnostics(hass, stick_emulator):
+    """Test the statistics of the stick in the attributes of its sensor."""
+    emulator = stick_emulator()
+    stick = AsyncStick(hass, emulator.port)
+    await stick.async_connect()
+    await stick.async_initialize_stick(timeout=5)
+    inventory = NodeInventory(hass, stick)
+    entity = USBStickDiagnostics(
+        {
+            STICK: stick,
+            STICK_BRIDGE: StickBridge(hass),
+            NODE_DISCOVERY: NodeDiscovery(hass, stick, inventory),
+            NODE_STATE_WRITER: NodeStateWriter(hass, 0),
+            POWER_POLLER: PowerPollScheduler(hass, stick, inventory),
+        }
+    )
+    assert entity.unique_id == f"{STICK_MAC.decode()}-diagnostics"
+    assert not entity.entity_registry_enabled_default
+
+    await entity.async_update()
+    assert entity.state == 0
+    attributes = entity.device_state_attributes
+    assert attributes["request_latency"]["StickInitRequest"]["count"] == 1
+    assert attributes["state_writes"]["writes"] == 0
+    assert set(attributes) == {
+        "discovery",
+        "energy_log",
+        "message_queue",
+        "power_polling",
+        "request_latency",
+        "state_writes",
+        "stick_bridge",
+    }
+
+    stick.disconnect()
+    await hass.async_block_till_done()
+
+
+async def test_async_stick_request_failed(hass, stick_emulator):
+    """Test counting requests the stick does not acknowledge."""
+    emulator = stick_emulator(ack=ACK_TIMEOUT)
+    stick = AsyncStick(hass, emulator.port)
+    with patch("homeassistant.components.plugwise.usb.SLEEP_TIME", 0.001), patch(
+        "homeassistant.components.plugwise.usb.MESSAGE_TIME_OUT", 0.1
+    ):
+        await stick.async_connect()
+        with pytest.raises(StickInitError):
+            await stick.async_initialize_stick(timeout=0.5)
+
+        # Resent until out of retries
+        stick.send(NodePingRequest(CIRCLE_PLUS_MAC))
+        await _async_wait_for(
+            lambda: stick.latency.async_diagnostics()
+            .get("NodePingRequest", {})
+            .get("failed")
+            == MESSAGE_RETRY + 2
+        )
+    # Timed out, then resent and refused by the stick
+    assert stick.latency.async_diagnostics()["StickInitRequest"]["failed"] == 2
+    assert emulator.requests.count(b"000A") == 2
+
+    stick.disconnect()
+    await hass.async_block_till_done()
+
+
+async def test_node_discovery_progressive(hass, stick_emulator):
+    """Test announcing nodes as they answer and retrying unreachable nodes."""
+    nodes = [b"000D6F0000000001", b"000D6F0000000002", b"000D6F0000000003"]
+    emulator = stick_emulator(nodes=nodes, unreachable=[nodes[1]])
+    stick = AsyncStick(hass, emulator.port)
+    entry = MockConfigEntry(domain=DOMAIN)
+    discovery = NodeDiscovery(hass, stick, NodeInventory(hass, stick))
+    hass.data[DOMAIN] = {entry.entry_id: {NODE_DISCOVERY: discovery}}
+    announced = []
+
+    def node_announced(mac):
+        announced.append(mac)
+        discovery.async_entity_added(mac)
+
+    with patch("homeassistant.components.plugwise.usb.SLEEP_TIME", 0.001), patch(
+        "homeassistant.components.plugwise.usb.MESSAGE_TIME_OUT", 0.5
+    ), patch(
+        "homeassistant.config_entries.ConfigEntries.async_forward_entry_setup",
+        AsyncMock(return_value=True),
+    ) as forward_entry_setup:
+        await stick.async_connect()
+        await stick.async_initialize_stick(timeout=5)
+        await stick.async_initialize_circle_plus(timeout=5)
+        stick.subscribe_stick_callback(node_announced, CB_NEW_NODE)
+        discovery.async_entity_added(CIRCLE_PLUS_MAC.decode())
+        discovery.async_start(entry)
+        await discovery._task
+
+        assert forward_entry_setup.call_count == 3
+        assert announced == [nodes[0].decode(), nodes[2].decode()]
+        diagnostics = discovery.async_diagnostics()
+        assert diagnostics["registered"] == 4
+        assert diagnostics["unreachable"] == 1
+        assert diagnostics["time_to_first_entity"] is not None
+        assert diagnostics["time_to_all_entities"] is None
+
+        # The retry announces the node once it answers
+        emulator.unreachable.clear()
+        discovery._async_retry(nodes[1].decode(), None)
+        await asyncio.gather(*discovery._retry_tasks)
+
+    assert announced[-1] == nodes[1].decode()
+    diagnostics = discovery.async_diagnostics()
+    assert diagnostics["unreachable"] == 0
+    assert diagnostics["retries"] == 1
+    assert diagnostics["time_to_all_entities"] is not None
+
+    discovery.async_stop()
+    stick.disconnect()
+    await hass.async_block_till_done()
+
+
+async def _async_wait_for(condition, timeout=5):
+    """Wait until the condition is met by the stick threads."""
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise asyncio.TimeoutError
+
+
+async def test_emulated_network_sleeping_and_lost(hass, stick_emulator):
+    """Test discovering a Scan once awake and resending requests lost on the way."""
+    nodes = generate_network(2, scans=1)
+    circle_mac, scan_mac = nodes[0].mac, nodes[2].mac
+    emulator = stick_emulator(nodes=nodes, latency=0.01, jitter=0.005, timeout=0.05)
+    stick = AsyncStick(hass, emulator.port)
+    entry = MockConfigEntry(domain=DOMAIN)
+    discovery = NodeDiscovery(hass, stick, NodeInventory(hass, stick))
+    hass.data[DOMAIN] = {entry.entry_id: {NODE_DISCOVERY: discovery}}
+    announced = []
+
+    def node_announced(mac):
+        announced.append(mac)
+        discovery.async_entity_added(mac)
+
+    with patch("homeassistant.components.plugwise.usb.SLEEP_TIME", 0.001), patch(
+        "homeassistant.components.plugwise.usb.MESSAGE_TIME_OUT", 0.5
+    ), patch(
+        "homeassistant.config_entries.ConfigEntries.async_forward_entry_setup",
+        AsyncMock(return_value=True),
+    ):
+        await stick.async_connect()
+        await stick.async_initialize_stick(timeout=5)
+        await stick.async_initialize_circle_plus(timeout=5)
+        stick.subscribe_stick_callback(node_announced, CB_NEW_NODE)
+        discovery.async_entity_added(CIRCLE_PLUS_MAC.decode())
+        discovery.async_start(entry)
+        await discovery._task
+
+        # The sleeping Scan only answers the retry once it is awake
+        assert set(announced) == {node.mac.decode() for node in nodes[:2]}
+        assert scan_mac.decode() in discovery._retry_listeners
+        emulator.wake(scan_mac)
+        discovery._async_retry(scan_mac.decode(), None)
+        await asyncio.gather(*discovery._retry_tasks)
+        assert announced[-1] == scan_mac.decode()
+        assert isinstance(stick.node(scan_mac.decode()), PlugwiseScan)
+
+        # The stick reports every lost answer, resent until out of retries
+        emulator.loss = 1
+        stick.node(circle_mac.decode()).set_relay_state(False)
+        await _async_wait_for(
+            lambda: stick.latency.async_diagnostics()
+            .get("CircleSwitchRelayRequest", {})
+            .get("failed")
+            == MESSAGE_RETRY + 2
+        )
+        assert emulator.requests.count(b"0017") == MESSAGE_RETRY + 2
+        assert stick.node(circle_mac.decode()).get_relay_state()
+
+        emulator.loss = 0
+        stick.node(circle_mac.decode()).set_relay_state(False)
+        await _async_wait_for(
+            lambda: not stick.node(circle_mac.decode()).get_relay_state()
+        )
+        assert not emulator.network[circle_mac].relay
+
+    discovery.async_stop()
+    stick.disconnect()
+    await hass.async_block_till_done()
+
+
+async def test_node_inventory(hass, hass_storage, stick_emulator):
+    """Test creating entities from the inventory until the node answers."""
+    node_mac = "000D6F0000000001"
+    storage_key = f"{INVENTORY_STORAGE_KEY}.{STICK_MAC.decode()}"
+    hass_storage[storage_key] = {
+        "version": INVENTORY_STORAGE_VERSION,
+        "key": storage_key,
+        "data": {
+            node_mac: {
+                "node_type": "Circle",
+                "firmware_version": "2011-06-27 08:52:18",
+                "categories": ["sensor", "switch"],
+                "sensors": ["available", "power_1s"],
+                "switches": ["relay"],
+            }
+        },
+    }
+    emulator = stick_emulator(nodes=[node_mac.encode()])
+    stick = AsyncStick(hass, emulator.port)
+    inventory = NodeInventory(hass, stick)
+    with patch("homeassistant.components.plugwise.usb.SLEEP_TIME", 0.001):
+        await stick.async_connect()
+        await stick.async_initialize_stick(timeout=5)
+        await stick.async_initialize_circle_plus(timeout=5)
+        await inventory.async_load()
+        assert set(inventory.nodes) == {node_mac, CIRCLE_PLUS_MAC.decode()}
+
+        cached = inventory.async_cached_node(node_mac)
+        assert cached.get_node_type() == "Circle"
+        assert not cached.get_available()
+        assert cached.get_power_usage() is None
+
+        entity = Mock(unique_id=f"{node_mac}-power_1s")
+        new_entity = Mock(unique_id=f"{node_mac}-power_8s")
+        inventory.async_add_entity(node_mac, entity)
+        assert inventory.async_unknown([entity, new_entity]) == [new_entity]
+
+        await stick.async_scan_for_nodes()
+        assert await stick.async_discover_node(node_mac, 5)
+
+    inventory.async_node_discovered(node_mac)
+    node = stick.node(node_mac)
+    entity.async_set_node.assert_called_once_with(node)
+    assert inventory.nodes[node_mac]["sensors"] == list(node.get_sensors())
+
+    stick.disconnect()
+    await hass.async_block_till_done()
+
+
+async def test_node_discovery_scan_timeout(hass, hass_storage, stick_emulator):
+    """Test keeping the inventory nodes and retrying a scan that times out."""
+    node_mac = "000D6F0000000001"
+    storage_key = f"{INVENTORY_STORAGE_KEY}.{STICK_MAC.decode()}"
+    hass_storage[storage_key] = {
+        "version": INVENTORY_STORAGE_VERSION,
+        "key": storage_key,
+        "data": {
+            node_mac: {
+                "node_type": "Circle",
+                "firmware_version": "2011-06-27 08:52:18",
+                "categories": ["sensor", "switch"],
+                "sensors": ["available", "power_1s"],
+                "switches": ["relay"],
+            }
+        },
+    }
+    emulator = stick_emulator(nodes=[node_mac.encode()])
+    stick = AsyncStick(hass, emulator.port)
+    entry = MockConfigEntry(domain=DOMAIN)
+    inventory = NodeInventory(hass, stick)
+    discovery = NodeDiscovery(hass, stick, inventory)
+    hass.data[DOMAIN] = {entry.entry_id: {NODE_DISCOVERY: discovery}}
+    announced = []
+    before_rescan = {}
+
+    async def scan():
+        if not before_rescan:
+            before_rescan.update(discovery.async_diagnostics())
+            return None
+        return {node_mac: 1}
+
+    with patch("homeassistant.components.plugwise.usb.SLEEP_TIME", 0.001), patch(
+        "homeassistant.config_entries.ConfigEntries.async_forward_entry_setup",
+        AsyncMock(return_value=True),
+    ), patch(
+        "homeassistant.components.plugwise.usb.DISCOVERY_RETRY_MIN", 0.01
+    ), patch.object(
+        stick, "async_scan_for_nodes", AsyncMock(side_effect=scan)
+    ):
+        await stick.async_connect()
+        await stick.async_initialize_stick(timeout=5)
+        await stick.async_initialize_circle_plus(timeout=5)
+        await inventory.async_load()
+        stick.subscribe_stick_callback(announced.append, CB_NEW_NODE)
+        discovery.async_start(entry)
+        await discovery._task
+
+    assert before_rescan["time_to_all_entities"] is None
+    assert node_mac in inventory.nodes
+    assert discovery.registered == {CIRCLE_PLUS_MAC.decode(), node_mac}
+    assert announced == [node_mac]
+    assert stick.node(node_mac) is not None
+    diagnostics = discovery.async_diagnostics()
+    assert diagnostics["scanned"]
+    assert diagnostics["scan_retries"] == 1
+
+    discovery.async_stop()
+    stick.disconnect()
+    await hass.async_block_till_done()
+
+
+def _circle(power):
+    """Return an available Circle reporting the power usage."""
+    node = Mock(spec=PlugwiseCircle, last_info_message=None, last_log_collected=True)
+    node.is_sed.return_value = False
+    node.get_available.return_value = True
+    node.get_power_usage.side_effect = power
+    return node
+
+
+async def test_power_poll_scheduler(hass):
+    """Test adapting the polling rate of each Circle within the budget."""
+    nodes = {
+        "varying": _circle(itertools.cycle([10.0, 200.0])),
+        "steady": _circle(itertools.repeat(50.0)),
+        "idle": _circle(itertools.repeat(50.0)),
+    }
+    stick = Mock(expected_responses={})
+    stick.nodes.return_value = list(nodes)
+    stick.node.side_effect = nodes.get
+    inventory = Mock()
+    inventory.async_has_entity.side_effect = lambda mac, _: mac != "idle"
+
+    poller = PowerPollScheduler(hass, stick, inventory, budget=100)
+    poller.async_start()
+    for _ in range(6):
+        poller._tokens = poller.budget
+        for state in poller._nodes.values():
+            state.due = 0
+        poller._async_tick()
+    poller.async_stop()
+
+    assert nodes["steady"].update_power_usage.call_count == 6
+    assert poller._nodes["varying"].interval == POWER_POLL_MIN
+    assert poller._nodes["steady"].interval == POWER_POLL_MAX
+    assert poller._nodes["idle"].interval == POWER_POLL_IDLE
+
+    # Over budget every node is polled less often and one request fits a tick
+    poller.budget = 0.1
+    poller._tokens = 1
+    for state in poller._nodes.values():
+        state.due = 0
+    poller._async_tick()
+    assert poller.scale > 1
+    assert poller._tokens < 1
+    assert sum(node.update_power_usage.call_count for node in nodes.values()) == 19
+
+    diagnostics = poller.async_diagnostics()
+    assert diagnostics["requests"] == 19
+    assert diagnostics["demand"] > 1
+    assert diagnostics["nodes"]["varying"]["interval"] == round(
+        POWER_POLL_MIN * poller.scale, 1
+    )
+
+
+async def test_power_poll_backfill(hass):
+    """Test requesting the energy log pages within a budget of their own."""
+    nodes = {"first": _circle(itertools.repeat(50.0))}
+    nodes["second"] = _circle(itertools.repeat(50.0))
+    for node in nodes.values():
+        node.last_log_collected = False
+    missing = {mac: 12 for mac in nodes}
+
+    def collect(mac, limit):
+        count = min(missing[mac], limit)
+        missing[mac] -= count
+        return count
+
+    stick = Mock(expected_responses={})
+    stick.nodes.return_value = list(nodes)
+    stick.node.side_effect = nodes.get
+    stick.energy_log.async_collect.side_effect = collect
+    poller = PowerPollScheduler(hass, stick, Mock(), budget=2, backfill_budget=0.1)
+    poller.async_start()
+    poller._tokens = 2
+    poller._backfill_tokens = 1
+    poller._async_tick()
+
+    # The power polls are not charged for the pages
+    assert all(node.update_power_usage.call_count == 1 for node in nodes.values())
+    assert poller.requests == 2
+    assert missing == {"first": 11, "second": 12}
+    # The other nodes take their turn before the next page of the first one
+    poller._backfill_tokens = 1
+    poller._async_tick()
+    poller.async_stop()
+    assert missing == {"first": 11, "second": 11}
+    diagnostics = poller.async_diagnostics()
+    assert diagnostics["backfill_requests"] == 2
+    assert diagnostics["backfill_pending"] == 2
+
+
+def test_stick_message_queue():
+    """Test sending interactive requests first and limiting the rate per class."""
+    message_queue = StickMessageQueue(
+        {MESSAGE_INTERACTIVE: None, MESSAGE_CONFIG: None, MESSAGE_TELEMETRY: 1000}
+    )
+    macs = [b"000D6F00000000%02d" % index for index in range(50)]
+    for mac in macs:
+        message_queue.put([None, CirclePowerUsageRequest(mac), None, 0, None])
+    # A queued telemetry request is not queued twice
+    message_queue.put([None, CirclePowerUsageRequest(macs[0]), None, 0, None])
+    message_queue.put([None, NodeInfoRequest(macs[0]), None, 1, None])
+    message_queue.put([None, CircleSwitchRelayRequest(macs[0], True), None, 0, None])
+    assert message_queue.qsize() == 52
+
+    assert isinstance(message_queue.get()[1], CircleSwitchRelayRequest)
+    assert isinstance(message_queue.get()[1], NodeInfoRequest)
+    assert isinstance(message_queue.get(timeout=1)[1], CirclePowerUsageRequest)
+    # The next telemetry request waits for its turn
+    with pytest.raises(queue.Empty):
+        message_queue.get(block=False)
+    for _ in macs[1:]:
+        message_queue.get(timeout=1)
+    with pytest.raises(queue.Empty):
+        message_queue.get(timeout=0.01)
+    assert message_queue.get_ready() == (None, None)
+
+    diagnostics = message_queue.async_diagnostics()
+    assert diagnostics[MESSAGE_INTERACTIVE]["sent"] == 1
+    assert diagnostics[MESSAGE_CONFIG]["retries"] == 1
+    assert diagnostics[MESSAGE_TELEMETRY]["sent"] == 50
+    assert diagnostics[MESSAGE_TELEMETRY]["dropped"] == 1
+    assert diagnostics[MESSAGE_TELEMETRY]["queued"] == 0
+    assert diagnostics[MESSAGE_TELEMETRY]["wait_max"] >= 0.049
+
+
+def _log_page(mac, address):
+    """Return a log page of four hours with a pulse per hour of the day."""
+    page = Mock(mac=mac, logaddr=Mock(value=address))
+    for index in range(1, 5):
+        hour = address * 4 + index
+        logged = datetime(2020, 11, 1 + hour // 24, hour % 24)
+        setattr(page, f"logdate{index}", Mock(value=logged))
+        setattr(page, f"pulses{index}", Mock(value=hour))
+    return page
+
+
+async def test_energy_log_collector(hass, hass_storage):
+    """Test collecting the energy log pages of a Circle only once."""
+    node_mac = b"000D6F0000000001"
+    node = Mock(
+        spec=PlugwiseCircle, mac=node_mac, calibration=True, _last_log_address=20
+    )
+    node.pulses_to_kWs.side_effect = lambda pulses, seconds: pulses / 1000
+    stick = Mock()
+    stick.get_mac_stick.return_value = STICK_MAC.decode()
+    stick.node.return_value = node
+    energy_log = EnergyLogCollector(hass, stick)
+    await energy_log.async_load()
+
+    # Without a log the latest pages are requested
+    assert energy_log.async_collect(node_mac.decode()) == ENERGY_LOG_INITIAL_PAGES
+    addresses = [call[0][0].args[0].value for call in stick.send.call_args_list]
+    assert addresses == list(range(21 - ENERGY_LOG_INITIAL_PAGES, 21))
+    # Requested pages are not requested again
+    assert energy_log.async_collect(node_mac.decode()) == 0
+    for address in addresses:
+        energy_log.async_record(_log_page(node_mac, address))
+
+    buffer = energy_log.buffers[node_mac.decode()]
+    assert len(buffer) == ENERGY_LOG_INITIAL_PAGES * 4
+    # The first hour of the page at address 20 is logged at 9:00 UTC
+    hour = int(datetime(2020, 11, 4, 8, tzinfo=timezone.utc).timestamp()) // 3600
+    assert buffer.get(hour) == 0.081
+    assert not buffer.has_page(20)
+
+    # After downtime only the current page and the pages logged since are requested
+    node._last_log_address = 25
+    stick.send.reset_mock()
+    # Within a limit the latest pages go first
+    assert energy_log.async_collect(node_mac.decode(), 2) == 2
+    assert stick.send.call_args_list[-1][0][0].args[0].value == 25
+    assert energy_log.async_collect(node_mac.decode()) == 4
+    for call in stick.send.call_args_list:
+        energy_log.async_record(_log_page(node_mac, call[0][0].args[0].value))
+
+    await hass.async_block_till_done()
+    restored = EnergyLogCollector(hass, stick)
+    hass_storage[f"{ENERGY_LOG_STORAGE_KEY}.{STICK_MAC.decode()}"] = {
+        "version": ENERGY_LOG_STORAGE_VERSION,
+        "data": energy_log._data_to_save(),
+    }
+    await restored.async_load()
+    stick.send.reset_mock()
+    assert restored.async_collect(node_mac.decode()) == 1
+    assert restored.buffers[node_mac.decode()].items() == buffer.items()
+    assert energy_log.async_diagnostics()["pages_received"] == 18
+    node.do_callback.assert_any_call(TODAY_ENERGY_SENSOR_ID)
+
+    # The energy sensors read the hours held
+    hour = int(dt_util.utcnow().timestamp()) // 3600
+    midnight = int(dt_util.start_of_local_day().timestamp()) // 3600
+    buffer.add(hour - 1, 0.5)
+    buffer.add(midnight - 2, 0.25)
+    node.stick = stick
+    stick.energy_log = energy_log
+    sensor = USBSensor(node, node_mac.decode(), PREVIOUS_HOUR_ENERGY_SENSOR_ID)
+    assert sensor.state == 0.5
+    if hour > midnight:
+        assert energy_log.async_energy(node_mac.decode(), TODAY_ENERGY_SENSOR_ID) == 0.5
+        assert (
+            energy_log.async_energy(node_mac.decode(), YESTERDAY_ENERGY_SENSOR_ID)
+            == 0.25
+        )
+    # Without a log the library value is used
+    node.get_power_consumption_prev_hour.return_value = 0.125
+    sensor = USBSensor(node, "000D6F0000000002", PREVIOUS_HOUR_ENERGY_SENSOR_ID)
+    assert sensor.state == 0.125
+
+
+async def test_stick_bridge(hass):
+    """Test running the callbacks of the stick thread on the event loop."""
+    bridge = StickBridge(hass)
+    calls = []
+
+    def record(number):
+        calls.append((number, threading.get_ident()))
+
+    def report(numbers):
+        for number in numbers:
+            bridge.call(record, number)
+
+    await hass.async_add_executor_job(report, range(10))
+    await hass.async_block_till_done()
+    assert [number for number, _ in calls] == list(range(10))
+    assert {thread for _, thread in calls} == {threading.get_ident()}
+
+    diagnostics = bridge.async_diagnostics()
+    assert diagnostics["events"] == 10
+    assert 1 <= diagnostics["drains"] <= 10
+    assert diagnostics["max_batch"] <= 10
+
+    # Once stopped the callbacks queued and reported later are dropped
+    bridge.call(record, 10)
+    bridge.async_stop()
+    await hass.async_add_executor_job(report, range(11, 20))
+    await hass.async_block_till_done()
+    assert len(calls) == 10
+    assert bridge.async_diagnostics()["events"] == 10
+
+
+async def test_node_state_writer(hass):
+    """Test writing the state of the entities once per burst of callbacks."""
+    writer = NodeStateWriter(hass, 0)
+    entities = [Mock(), Mock(), Mock()]
+    for entity in entities:
+        writer.async_add(entity)
+
+    for _ in range(5):
+        for entity in entities:
+            writer.async_mark_dirty(entity)
+    # Entities being removed are not written anymore
+    writer.async_discard(entities[2])
+    await hass.async_block_till_done()
+    assert entities[0].async_write_ha_state.call_count == 1
+    assert entities[1].async_write_ha_state.call_count == 1
+    assert entities[2].async_write_ha_state.call_count == 0
+
+    # Entities not added, or marked after being discarded, are skipped too
+    writer.async_mark_dirty(entities[2])
+    writer.async_mark_dirty(Mock())
+    await hass.async_block_till_done()
+    assert entities[2].async_write_ha_state.call_count == 0
+
+    diagnostics = writer.async_diagnostics()
+    assert diagnostics["callbacks"] == 17
+    assert diagnostics["writes"] == 2
+
+
+async def test_node_state_writer_window(hass):
+    """Test delaying the state writes until the window has passed."""
+    writer = NodeStateWriter(hass, 1)
+    entity = Mock()
+    writer.async_add(entity)
+
+    writer.async_mark_dirty(entity)
+    await hass.async_block_till_done()
+    writer.async_mark_dirty(entity)
+    assert entity.async_write_ha_state.call_count == 0
+
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=2))
+    await hass.async_block_till_done()
+    assert entity.async_write_ha_state.call_count == 1
+    assert writer.writes == 1
+
+    # The next callback opens a new window
+    writer.async_mark_dirty(entity)
+    await hass.async_block_till_done()
+    assert entity.async_write_ha_state.call_count == 1
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=2))
+    await hass.async_block_till_done()
+    assert entity.async_write_ha_state.call_count == 2
+
+
+def test_node_entity_descriptions():
+    """Test binding the node accessors of the entities once per node."""
+    description = SWITCH_DESCRIPTIONS["relay"]
+    assert description.state == SWITCHES["relay"][ATTR_STATE]
+    assert description.switch == SWITCHES["relay"]["switch"]
+    with pytest.raises(AttributeError):
+        description.icon = "mdi:power-socket-eu"
+
+    node_mac = "000D6F0000000001"
+    cached = CachedNode(
+        node_mac,
+        {"node_type": "Circle", "sensors": ["available", "power_1s"]},
+    )
+    switch = USBSwitch(cached, node_mac, "relay")
+    sensor = USBSensor(cached, node_mac, CURRENT_POWER_SENSOR_ID)
+    assert sensor.description is USB_SENSOR_DESCRIPTIONS[CURRENT_POWER_SENSOR_ID]
+    assert sensor.name == "Power usage (00001)"
+    assert not switch.available
+    assert switch.is_on is None
+    assert sensor.state is None
+
+    # The accessors are bound again when the node is discovered
+    node = _circle(itertools.repeat(12.3456))
+    node.get_relay_state.return_value = True
+    for entity in (switch, sensor):
+        entity._state_writer = Mock()
+        entity.async_set_node(node)
+    assert switch.available
+    assert switch.is_on
+    assert switch.current_power_w == 12.35
+    assert sensor.state == 12.346
+    switch.turn_off()
+    node.set_relay_state.assert_called_once_with(False)